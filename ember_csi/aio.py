@@ -0,0 +1,236 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Asyncio gRPC server.
+
+Used instead of eventlet and the threaded gRPC server when X_CSI_GRPC_ASYNCIO
+is set to true.  Requires Python 3.7 and gRPC 1.32 or newer.
+
+The gRPC server runs on an asyncio event loop, so there's no need to monkey
+patch the process or to proxy the completion queue through eventlet's tpool.
+
+Calls wait for admission control and for their Worker lock on the event loop,
+so waiting calls don't take a thread.  Only then are our servicer methods,
+which are synchronous because cinderlib, the drivers, and OS-Brick are
+blocking, run on a thread pool of `grpc_workers` and `reserved_workers`
+threads.  Methods receive a synchronous context that behaves like the one
+from the threaded server, raising an exception on abort.
+
+Calls still take a thread while they wait for the backend and for the status
+of their resources to change.  It is experimental.
+"""
+import asyncio
+from concurrent import futures
+import contextlib
+import signal
+
+import grpc
+from grpc import aio
+from oslo_log import log as logging
+
+from ember_csi import common
+from ember_csi import config
+
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class Admission(common.Admission):
+    """Admission control that waits on the event loop."""
+    def __init__(self, workers, limits=None, timeout=None, queue=0):
+        self.workers = asyncio.Semaphore(workers)
+        self.queue = asyncio.Semaphore(queue)
+        self.limits = {name: asyncio.Semaphore(limit)
+                       for name, limit in (limits or {}).items()}
+        self.timeout = timeout
+
+    async def _acquire(self, semaphore):
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @contextlib.asynccontextmanager
+    async def admit(self, method, context):
+        if method in self.FAST_METHODS:
+            yield
+            return
+
+        if self.workers.locked():
+            if self.queue.locked():
+                self._reject(method, context, 'all workers are busy')
+            async with self.queue:
+                acquired = await self._acquire(self.workers)
+            if not acquired:
+                self._reject(method, context, 'all workers are busy')
+        else:
+            await self.workers.acquire()
+        try:
+            limit = self._get_limit(method)
+            if limit is None:
+                context.admitted = True
+                yield
+                return
+
+            if not await self._acquire(limit):
+                self._reject(method, context, 'too many concurrent calls')
+            try:
+                context.admitted = True
+                yield
+            finally:
+                limit.release()
+        finally:
+            self.workers.release()
+
+
+class _LoopEvent(object):
+    """Event for KeyedLock waiters that can be set from any thread."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self._set = False
+
+    def set(self):
+        self._set = True
+        self.loop.call_soon_threadsafe(self._wake_up)
+
+    def _wake_up(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+    def is_set(self):
+        return self._set
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+@contextlib.asynccontextmanager
+async def worker_lock(method, request, context):
+    """Acquire the call's Worker lock, if it has one, on the event loop."""
+    field = getattr(method, 'unique_field', None)
+    if not field or CONF.ABORT_DUPLICATES:
+        yield
+        return
+
+    lock_key = (method.__name__, getattr(request, field))
+    event = _LoopEvent(asyncio.get_event_loop())
+    if not common.Worker.locks.enqueue(lock_key, event):
+        try:
+            await event.wait(CONF.LOCK_TIMEOUT or None)
+        except BaseException:
+            # Cancelled call, don't leave the lock to a waiter that's gone
+            if common.Worker.locks.dequeue(lock_key, event):
+                common.Worker.locks.release(lock_key)
+            raise
+        if not common.Worker.locks.dequeue(lock_key, event):
+            common.Worker.lock_timed_out(lock_key, context)
+    try:
+        context.lock_key = lock_key
+        yield
+    finally:
+        common.Worker.locks.release(lock_key)
+
+
+class GenericHandler(grpc.GenericRpcHandler):
+    """Run the methods of a synchronous handler on an executor."""
+    def __init__(self, handler, executor, admission):
+        self.handler = handler
+        self.executor = executor
+        self.admission = admission
+        self.methods = {}
+
+    def _wrap(self, method):
+        async def unary_unary(request, context):
+            sync_context = common.SyncContext(context.invocation_metadata())
+            loop = asyncio.get_event_loop()
+            try:
+                async with self.admission.admit(method.__name__,
+                                                sync_context), \
+                        worker_lock(method, request, sync_context):
+                    work = loop.run_in_executor(self.executor, method,
+                                                request, sync_context)
+                    try:
+                        return await asyncio.shield(work)
+                    except asyncio.CancelledError:
+                        # Keep the worker and the lock until the thread is
+                        # done with the resource
+                        await asyncio.wait((work,))
+                        raise
+            except Exception:
+                if not sync_context._state.code:
+                    raise
+            state = sync_context._state
+            await context.abort(state.code, state.details or '',
+                                state.trailing_metadata)
+        return unary_unary
+
+    def service(self, handler_call_details):
+        name = handler_call_details.method
+        if name not in self.methods:
+            method_handler = self.handler.service(handler_call_details)
+            # CSI only has unary calls
+            if method_handler and method_handler.unary_unary:
+                method_handler = grpc.unary_unary_rpc_method_handler(
+                    self._wrap(method_handler.unary_unary),
+                    request_deserializer=method_handler.request_deserializer,
+                    response_serializer=method_handler.response_serializer)
+            self.methods[name] = method_handler
+        return self.methods[name]
+
+
+class Server(object):
+    """Asyncio gRPC server with the interface our servicers expect."""
+    def __init__(self, workers, options=None):
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self.loop = asyncio.get_event_loop()
+        self.server = aio.server(options=options)
+        self.admission = Admission(CONF.WORKERS, CONF.CONCURRENCY_LIMITS,
+                                   CONF.ADMISSION_TIMEOUT or None,
+                                   CONF.ADMISSION_QUEUE)
+
+    def add_generic_rpc_handlers(self, generic_rpc_handlers):
+        self.server.add_generic_rpc_handlers(
+            [GenericHandler(handler, self.executor, self.admission)
+             for handler in generic_rpc_handlers])
+
+    def add_insecure_port(self, address):
+        return self.server.add_insecure_port(address)
+
+    async def _serve(self, grace):
+        stop = asyncio.Event()
+
+        def shutdown_handler(signal_name):
+            LOG.info('Received signal %s' % signal_name)
+            stop.set()
+
+        for signum, name in ((signal.SIGTERM, 'SIGTERM'),
+                             (signal.SIGINT, 'SIGINT')):
+            self.loop.add_signal_handler(signum, shutdown_handler, name)
+
+        await self.server.start()
+        await stop.wait()
+
+        LOG.info('Gracefully stopping server')
+        await self.server.stop(grace)
+        self.executor.shutdown(wait=False)
+
+    def run(self, grace):
+        """Serve requests until we receive SIGTERM or SIGINT."""
+        self.loop.run_until_complete(self._serve(grace))
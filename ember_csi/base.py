@@ -19,12 +19,15 @@ import itertools
 import os
 import stat
 import re
+import select
 import socket
 import sys
+import threading
 import time
 
 import cinderlib
 from cinderlib import exception
+from eventlet import patcher
 import grpc
 from oslo_concurrency import processutils as putils
 from oslo_log import log as logging
@@ -36,12 +39,18 @@ from ember_csi import config
 from ember_csi import constants
 from ember_csi import defaults
 from ember_csi import messages
+from ember_csi import metrics
+from ember_csi import privileged
+from ember_csi import tracing
+from ember_csi import waiters
 
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
 CAP_KEY = constants.CAPABILITY_KEY
+# Non green select, as eventlet doesn't support poll
+_select = patcher.original('select')
 CAPS_KEY = constants.CAPABILITIES_KEY
 
 # TODO: Account for UNKNOWN access_mode
@@ -103,6 +112,8 @@ class IdentityBase(object):
 
         self.root_helper = ((ember_config or {}).get('root_helper') or
                             defaults.ROOT_HELPER)
+        if CONF.PRIVILEGED_DAEMON:
+            privileged.init(self.root_helper)
 
         manifest = {
             'cinder-version': constants.CINDER_VERSION,
@@ -240,7 +251,7 @@ class IdentityBase(object):
                               'Driver check setup error failed')
             try:
                 # Use stats gathering to further confirm it's working fine
-                self.backend.stats(refresh=True)
+                self.backend_stats.get()
             except Exception:
                 context.abort(grpc.StatusCode.FAILED_PRECONDITION,
                               'Driver failed to return the stats')
@@ -263,15 +274,15 @@ class IdentityBase(object):
             return res[0]
         return res
 
-    def sudo(self, *cmd, **kwargs):
+    @staticmethod
+    def _retry(func, *args, **kwargs):
         retries = kwargs.pop('retries', 1)
         delay = kwargs.pop('delay', 1)
         backoff = kwargs.pop('backoff', 2)
         errors = kwargs.pop('errors', [32])
         while retries:
             try:
-                return putils.execute(*cmd, run_as_root=True,
-                                      root_helper=self.root_helper)
+                return func(*args)
             except putils.ProcessExecutionError as exc:
                 retries -= 1
                 if exc.exit_code not in errors or not retries:
@@ -279,6 +290,19 @@ class IdentityBase(object):
                 time.sleep(delay)
                 delay *= backoff
 
+    @staticmethod
+    def _privileged(command, func, *args, **kwargs):
+        with tracing.span('command', {'command': command}), \
+                metrics.track_command(command):
+            return func(*args, **kwargs)
+
+    def _execute(self, *cmd):
+        return self._privileged(cmd[0], putils.execute, *cmd,
+                                run_as_root=True, root_helper=self.root_helper)
+
+    def sudo(self, *cmd, **kwargs):
+        return self._retry(self._execute, *cmd, **kwargs)
+
     def _get_size(self, what, request, default):
         vol_size = getattr(request.capacity_range, what + '_bytes', None)
         if vol_size:
@@ -352,31 +376,31 @@ class IdentityBase(object):
 
     @staticmethod
     def conn_cap(conn):
-        return capabilities_lib.Capability(conn.connector_info[CAP_KEY])
+        return capabilities_lib.Capability.load(conn.connector_info[CAP_KEY])
 
     def _get_conn(self, volume, capability=None, path=None, alt_path=None,
                   return_all=False, node_id=None):
-        if capability and not isinstance(capability,
-                                         capabilities_lib.Capability):
-            capability = capabilities_lib.Capabiilty(capability)
-
-        result = []
-        alt_conn = []
+        if capability:
+            capability = capabilities_lib.Capability.load(capability)
 
         node_id = node_id or self.node_info.id
-        for conn in volume.connections:
-            if (node_id == conn.attached_host and
-                    (capability is None or capability == self.conn_cap(conn))):
+        connections = common.ConnectionList.of(volume)
 
-                if path is None or path == conn.mountpoint:
-                    if not return_all:
-                        return conn
-                    result.append(conn)
-                elif alt_path == conn.mountpoint:
-                    alt_conn.append(conn)
+        def matching(conns):
+            if capability is None:
+                return list(conns)
+            return [conn for conn in conns
+                    if capability == self.conn_cap(conn)]
+
+        if path is None:
+            result = matching(connections.with_host(node_id))
+            alt_conn = []
+        else:
+            result = matching(connections.with_host_path(node_id, path))
+            alt_conn = matching(connections.with_host_path(node_id, alt_path))
 
         if result:
-            return result
+            return result if return_all else result[0]
 
         return alt_conn if return_all else (alt_conn[0] if alt_conn else None)
 
@@ -391,6 +415,7 @@ class ControllerBase(IdentityBase):
         cinderlib.setup(persistence_config=persistence_config,
                         **cinderlib_extra_config)
         self.backend = cinderlib.Backend(**backend_config)
+        self.backend_stats = common.BackendStats(self.backend, CONF.STATS_TTL)
         IdentityBase.__init__(self, server, ember_config)
         self.CSI.add_ControllerServicer_to_server(self, server)
 
@@ -422,20 +447,40 @@ class ControllerBase(IdentityBase):
         return (vol, node)
 
     def _wait(self, resource, states, delete_on_error=False):
-        # TODO(geguileo): Introduce timeout and probably cleanup mechanism
-        status = resource.status
-        try:
-            while status not in states:
-                if 'error' in resource.status:
-                    if delete_on_error:
-                        resource.delete()
-                    return False
-                time.sleep(constants.REFRESH_TIME)
-                resource.refresh()
-        except exception.NotFound:
-            resource._ovo.status = 'deleted'
-            resource._ovo.deleted = True
-            return False
+        """Wait until the resource is in one of the states.
+
+        The resource is refreshed when the persistence plugin notifies us that
+        it has changed, or otherwise with an exponential backoff, and we give
+        up after the configured wait timeout, if any.
+
+        Returns True if the resource reached one of the states.
+        """
+        # A wait timeout of 0 means we wait forever
+        deadline = CONF.WAIT_TIMEOUT and time.time() + CONF.WAIT_TIMEOUT
+        delay = constants.REFRESH_TIME
+        with waiters.listen(resource.id) as changed:
+            try:
+                while resource.status not in states:
+                    if 'error' in resource.status:
+                        if delete_on_error:
+                            resource.delete()
+                        return False
+
+                    remaining = deadline - time.time() if deadline else delay
+                    if remaining <= 0:
+                        LOG.warning('Timed out waiting for %s to change '
+                                    'from %s to %s', resource.id,
+                                    resource.status, ', '.join(states))
+                        return False
+
+                    changed.wait(min(delay, remaining))
+                    changed.clear()
+                    delay = min(delay * 2, constants.MAX_REFRESH_TIME)
+                    resource.refresh()
+            except exception.NotFound:
+                resource._ovo.status = 'deleted'
+                resource._ovo.deleted = True
+                return False
         return True
 
     def _validate_requirements(self, request, context):
@@ -445,16 +490,18 @@ class ControllerBase(IdentityBase):
             context.abort(grpc.StatusCode.INVALID_ARGUMENT, error)
 
     def _create_volume(self, name, vol_size, request, context, **params):
-        vol = self.backend.create_volume(size=vol_size, name=name, **params)
+        with tracing.span('backend.create_volume'):
+            vol = self.backend.create_volume(size=vol_size, name=name,
+                                             **params)
         return vol
 
     @common.debuggable
     @common.logrpc
     @common.require('name', 'volume_capabilities')
-    @common.Worker.unique('name')
+    @common.Worker.unique('name', distributed=True)
     def CreateVolume(self, request, context):
         vol_size, min_size, max_size = self._calculate_size(request, context)
-        self._validate_requirements(request, context)
+        topologies = self._validate_requirements(request, context)
 
         # NOTE(geguileo): Any reason to support controller_create_secrets?
 
@@ -488,7 +535,7 @@ class ControllerBase(IdentityBase):
             context.abort(grpc.StatusCode.ABORTED,
                           'Operation pending for volume (%s)' % vol.status)
 
-        volume = self._convert_volume_type(vol)
+        volume = self._convert_volume_type(vol, topologies)
         return self.TYPES.CreateResp(volume=volume)
 
     def _convert_volume_params(self, request, vol_caps, context):
@@ -517,7 +564,7 @@ class ControllerBase(IdentityBase):
     @common.debuggable
     @common.logrpc
     @common.require('volume_id')
-    @common.Worker.unique
+    @common.Worker.unique(distributed=True)
     def DeleteVolume(self, request, context):
         vol = self._get_vol(request.volume_id)
         if not vol:
@@ -535,6 +582,9 @@ class ControllerBase(IdentityBase):
 
         if vol.status == 'deleting':
             self._wait(vol, ('deleted',))
+            if vol.status == 'deleting':
+                context.abort(grpc.StatusCode.ABORTED,
+                              'Operation pending for volume (deleting)')
 
         if vol.status != 'deleted':
             LOG.debug('Deleting volume %s' % request.volume_id)
@@ -555,7 +605,7 @@ class ControllerBase(IdentityBase):
         return self.DELETE_RESP
 
     def _assert_req_cap_matches_vol(self, vol, request):
-        vol_caps = capabilities_lib.Capabilities(vol.metadata[CAPS_KEY])
+        vol_caps = capabilities_lib.Capabilities.load(vol.metadata[CAPS_KEY])
         if all(vol_caps.supports(cap) for cap in request.volume_capabilities):
             return None
         return messages.INCOMPATIBLE_REQUESTED_CAPABILITY
@@ -574,7 +624,7 @@ class ControllerBase(IdentityBase):
                               messages.ALREADY_PUBLISHED_CAP)
             return my_conn
 
-        vol_caps = capabilities_lib.Capabilities(vol.metadata[CAPS_KEY])
+        vol_caps = capabilities_lib.Capabilities.load(vol.metadata[CAPS_KEY])
 
         # First check that the requested capabilities make sense given the
         # volume created capabilities.
@@ -592,11 +642,12 @@ class ControllerBase(IdentityBase):
     @common.debuggable
     @common.logrpc
     @common.require('volume_id', 'node_id', 'volume_capability')
-    @common.Worker.unique
+    @common.Worker.unique(distributed=True)
+    @common.batched
     def ControllerPublishVolume(self, request, context):
         vol, node = self._get_vol_node(request, context)
-        req_cap = capabilities_lib.Capability(request.volume_capability,
-                                              ro_forced=request.readonly)
+        req_cap = capabilities_lib.Capability.load(
+            request.volume_capability, ro_forced=request.readonly)
 
         attach_mode = 'ro' if req_cap.used_as_ro else 'rw'
         conn = self.check_controller_publish_caps(vol, req_cap,
@@ -608,19 +659,25 @@ class ControllerBase(IdentityBase):
             # connection entry will be used by the node staging.
             connector_dict = node.connector_dict.copy()
             connector_dict[CAP_KEY] = req_cap.json
-            vol.connect(connector_dict, attached_host=node.id, mountpoint='',
-                        attach_mode=attach_mode)
+            try:
+                with tracing.span('backend.connect'):
+                    vol.connect(connector_dict, attached_host=node.id,
+                                mountpoint='', attach_mode=attach_mode)
+            except Exception:
+                # Node may have changed its connector information
+                common.NodeInfo.invalidate(node.id)
+                raise
 
         return self.TYPES.CtrlPublishResp()
 
     @common.debuggable
     @common.logrpc
     @common.require('volume_id')
-    @common.Worker.unique
+    @common.Worker.unique(distributed=True)
+    @common.batched
     def ControllerUnpublishVolume(self, request, context):
         vol, node = self._get_vol_node(request, context)
-        connections = [conn for conn in vol.connections
-                       if conn.attached_host == node.id]
+        connections = list(common.ConnectionList.of(vol).with_host(node.id))
         if connections:
             if len(connections) > 1:
                 uuids = [c.instance_uuid for c in connections
@@ -634,7 +691,8 @@ class ControllerBase(IdentityBase):
                 vol._ovo.volume_attachment.objects.remove(conn._ovo)
             # Do disconnect after removing other connections to ensure it
             # changes to available if there are no more connections.
-            connections[0].disconnect()
+            with tracing.span('backend.disconnect'):
+                connections[0].disconnect()
         return self.CTRL_UNPUBLISH_RESP
 
     def _paginate(self, request, context, resources):
@@ -670,11 +728,28 @@ class ControllerBase(IdentityBase):
             token = None
         return selected_resources, token
 
+    def _get_page(self, request, context, get_page, **filters):
+        """Get a page from a persistence plugin that supports pagination."""
+        try:
+            return get_page(limit=request.max_entries or None,
+                            marker=request.starting_token or None,
+                            **filters)
+        except ValueError:
+            context.abort(grpc.StatusCode.ABORTED, 'Invalid starting_token')
+
     @common.debuggable
     @common.logrpc
     def ListVolumes(self, request, context):
-        vols = self._get_vol(always_list=True)
-        selected, token = self._paginate(request, context, vols)
+        # Let the persistence plugin paginate if it knows how to
+        get_page = getattr(self.persistence, 'get_volumes_page', None)
+        if get_page:
+            vols, token = self._get_page(request, context, get_page,
+                                         backend_name=self.backend.id)
+            # Ignore soft-deleted volumes
+            selected = [vol for vol in vols if vol.status != 'deleted']
+        else:
+            vols = self._get_vol(always_list=True)
+            selected, token = self._paginate(request, context, vols)
 
         # TODO(geguileo): Once we support volume types set attributes
         entries = [self.TYPES.Entry(volume=self._convert_volume_type(vol))
@@ -690,10 +765,8 @@ class ControllerBase(IdentityBase):
         try:
             self._validate_requirements(request, context)
             # TODO(geguileo): Take into account over provisioning values
-            stats = self.backend.stats(refresh=True)
-            if 'pools' in stats:
-                stats = stats['pools'][0]
-            free = stats['free_capacity_gb'] * constants.GB
+            stats = self.backend_stats.get()
+            free = self.backend_stats.free_capacity_gb(stats) * constants.GB
         except Exception:
             free = 0
 
@@ -708,45 +781,56 @@ class ControllerBase(IdentityBase):
 
 # As per http://man7.org/linux/man-pages/man5/proc.5.html
 class MountInfo(object):
+    __slots__ = ('mount_id', 'parent_id', 'st_dev', 'root', 'mount_point',
+                 'mount_options', 'optional_fields', 'fs_type',
+                 'mount_source', 'super_options')
+
     # Data to return instead of failing
     BAD_MOUNTINFO = ('', '', '', '', '', '', '-', '', '', '')
+    # Kernel escapes spaces, tabs, new lines, and backslashes in paths
+    ESCAPED_REGEX = re.compile(r'\\([0-7]{3})')
 
     def __init__(self, data):
         # Don't fail on bad data, just log it and return whatever we can.
         if isinstance(data, six.string_types):
             data = data.split()
-        self.original_data = data
 
-        length = len(data)
-        if (length < 10):
-            LOG.error('Mount info data is too short: %s', data)
+        try:
+            i = data.index('-', 6)
+        except ValueError:
+            i = None
+
+        if len(data) < 10 or i is None or len(data) < i + 4:
+            LOG.error('Bad mount info data: %s', data)
             data = self.BAD_MOUNTINFO
+            i = 6
 
         self.mount_id = data[0]
         self.parent_id = data[1]
         self.st_dev = data[2]
-        self.root = data[3]
-        self.mount_point = data[4]
+        self.root = self.unescape(data[3])
+        self.mount_point = self.unescape(data[4])
         self.mount_options = data[5]
-
-        i = 6
-        optional_fields = []
-        while i < length and data[i] != '-':
-            optional_fields.append(data[i])
-            i += 1
-
-        # We must have found the optional fields separator
-        if i == length:
-            LOG.error('Bad mount info data, missing separator')
-            data = self.BAD_MOUNTINFO
-            i = 6
-
-        self.optional_fields = optional_fields
-
+        self.optional_fields = tuple(data[6:i])
         self.fs_type = data[i+1]
-        self.mount_source = data[i+2]
+        self.mount_source = self.unescape(data[i+2])
         self.super_options = data[i+3]
 
+    @classmethod
+    def unescape(cls, value):
+        if '\\' not in value:
+            return value
+        return cls.ESCAPED_REGEX.sub(lambda m: chr(int(m.group(1), 8)),
+                                     value)
+
+    @classmethod
+    def parse(cls, lines):
+        """Generator of MountInfo instances from mountinfo lines."""
+        for line in lines:
+            data = line.split()
+            if data:
+                yield cls(data)
+
     @property
     def source(self):
         # Bindmounts will have devtmpfs and we want the root instead
@@ -761,6 +845,59 @@ class MountInfo(object):
     __repr__ = __str__
 
 
+class MountTable(object):
+    """Indexed view of /proc/self/mountinfo.
+
+    The kernel signals changes in the mount table with POLLPRI on the open
+    file, so we only parse the file again when there has been a change.
+    """
+    FILENAME = '/proc/self/mountinfo'
+
+    def __init__(self, filename=FILENAME):
+        self.lock = threading.Lock()
+        self._file = open(filename)
+        self._poll = _select.poll()
+        self._poll.register(self._file.fileno(),
+                            select.POLLPRI | select.POLLERR)
+        self._load()
+
+    def _load(self):
+        self._file.seek(0)
+        mounts = list(MountInfo.parse(self._file))
+
+        by_mount_point = {}
+        by_source = {}
+        for mount in mounts:
+            # Like the kernel, return the top one for stacked mounts, which
+            # is the last one
+            by_mount_point[mount.mount_point] = mount
+            by_source.setdefault(mount.source, []).append(mount)
+
+        self.mounts = mounts
+        self.by_mount_point = by_mount_point
+        self.by_source = by_source
+
+    def refresh(self):
+        """Reload the mount table if it has changed."""
+        with self.lock:
+            # Polling clears the event, so it only reports changes once
+            if self._poll.poll(0):
+                self._load()
+
+    def get_mounts(self):
+        self.refresh()
+        return self.mounts
+
+    def find(self, mount_point):
+        self.refresh()
+        return self.by_mount_point.get(mount_point)
+
+    def with_source(self, *sources):
+        self.refresh()
+        return [mount for source in set(sources)
+                for mount in self.by_source.get(source, [])]
+
+
 class NodeBase(IdentityBase):
     STAGED_NAME = 'stage'
     MOUNT_FS_FLAGS = {'xfs': ['nouuid']}
@@ -778,6 +915,7 @@ class NodeBase(IdentityBase):
             IdentityBase.__init__(self, server, ember_config)
 
         self.node_info = common.NodeInfo.set(node_id, storage_nw_ip)
+        self.mount_table = MountTable()
         self.CSI.add_NodeServicer_to_server(self, server)
 
         self.STAGE_RESP = self.TYPES.StageResp()
@@ -792,25 +930,30 @@ class NodeBase(IdentityBase):
         self.NODE_CAPABILITIES_RESP = self.TYPES.NodeCapabilityResp(
             capabilities=capabilities)
 
-    def _get_split_file(self, filename):
-        with open(filename) as f:
-            result = [line.split() for line in f.read().split('\n') if line]
-        return result
-
-    def _get_mountinfo(self):
-        return [MountInfo(mount)
-                for mount in self._get_split_file('/proc/self/mountinfo')]
-
     def _vol_private_location(self, volume_id):
         private_bind = os.path.join(defaults.VOL_BINDS_DIR, volume_id)
         return private_bind
 
     def _get_mount(self, private_bind):
-        mounts = self._get_split_file('/proc/self/mounts')
-        result = [mount for mount in mounts if mount[0] == private_bind]
+        """Return the mounts of a private bind like /proc/self/mounts does.
+
+        Each mount is a list with the source, the mount point, the filesystem
+        type, and the mount options followed by the superblock options.
+        """
+        result = []
+        for mount in self.mount_table.with_source(private_bind):
+            # Skip mounts where it's the root instead of the source
+            if mount.mount_source != private_bind:
+                continue
+            # Superblock's ro or rw doesn't apply to this mount
+            options = mount.mount_options.split(',')
+            options.extend(option for option in mount.super_options.split(',')
+                           if option not in options and
+                           option not in ('ro', 'rw'))
+            result.append([mount.mount_source, mount.mount_point,
+                           mount.fs_type, ','.join(options)])
         if not result:
-            LOG.debug('Private bind %s not found in %s' % (private_bind,
-                                                           mounts))
+            LOG.debug('Private bind %s not found in mounts' % private_bind)
         return result
 
     def _get_device(self, path):
@@ -819,19 +962,18 @@ class NodeBase(IdentityBase):
         The source of a mounted path will either be the mount source of the
         mount point or the root if it's a bind mount.
         """
-        mount_info = self._get_mountinfo()
-        for mount in mount_info:
-            if mount.mount_point == path:
-                return mount.source
-        LOG.debug('Could not find %s as dest in %s' % (path, mount_info))
+        mount = self.mount_table.find(path)
+        if mount:
+            return mount.source
+        LOG.debug('Could not find %s as dest in mountinfo' % path)
         return None
 
     IS_RO_REGEX = re.compile(r'(^|.+,)ro($|,.+)')
 
     def _is_ro_mount(self, path):
-        for mount in self._get_mountinfo():
-            if mount.mount_point == path:
-                return bool(self.IS_RO_REGEX.match(mount.mount_options))
+        mount = self.mount_table.find(path)
+        if mount:
+            return bool(self.IS_RO_REGEX.match(mount.mount_options))
         return None
 
     def _get_vol_device(self, volume_id):
@@ -850,9 +992,7 @@ class NodeBase(IdentityBase):
     def _format_device(self, vol, requested_fs, device, context):
         metadata_fs = self._get_fs_type(vol)
 
-        # We don't use the util-linux Python library to reduce dependencies
-        stdout, stderr = self.sudo('lsblk', '-nlfoFSTYPE', device, retries=5,
-                                   errors=[1, 32], delay=2)
+        stdout = self._get_device_fs_types(device)
         fs_types = [line for line in stdout.split() if line]
         current_fs = fs_types[0] if fs_types else None
 
@@ -872,10 +1012,9 @@ class NodeBase(IdentityBase):
                           'already has filesystem %s' %
                           (requested_fs, current_fs))
 
-        cmd = [defaults.MKFS + requested_fs]
-        cmd.extend(self.MKFS_ARGS.get(requested_fs, self.DEFAULT_MKFS_ARGS))
-        cmd.append(device)
-        self.sudo(*cmd)
+        self._mkfs(requested_fs,
+                   self.MKFS_ARGS.get(requested_fs, self.DEFAULT_MKFS_ARGS),
+                   device)
 
         # Store that the volume is being used as a mount.
         if metadata_fs != requested_fs:
@@ -900,11 +1039,17 @@ class NodeBase(IdentityBase):
 
     def _mount(self, fs_type, mount_flags, private_bind, target):
         # Mount must only be called if it's already not mounted
-        # We don't use the util-linux Python library to reduce dependencies
-        command = ['mount', '-t', fs_type]
-        flags = self.MOUNT_FS_FLAGS.get(fs_type, [])
+        flags = list(self.MOUNT_FS_FLAGS.get(fs_type, []))
         if mount_flags:
             flags.extend(mount_flags)
+
+        if CONF.PRIVILEGED_DAEMON:
+            self._privileged('mount', privileged.mount, fs_type, flags,
+                             private_bind, target)
+            return
+
+        # We don't use the util-linux Python library to reduce dependencies
+        command = ['mount', '-t', fs_type]
         if flags:
             command.append('-o')
             command.append(','.join(flags))
@@ -912,6 +1057,49 @@ class NodeBase(IdentityBase):
         command.append(target)
         self.sudo(*command)
 
+    def _bind_mount(self, source, target, read_only=False):
+        if CONF.PRIVILEGED_DAEMON:
+            self._privileged('mount', privileged.bind_mount, source, target,
+                             read_only)
+        elif read_only:
+            self.sudo('mount', '-o', 'bind,ro', source, target)
+        else:
+            self.sudo('mount', '--bind', source, target)
+
+    def _umount(self, target, **kwargs):
+        if CONF.PRIVILEGED_DAEMON:
+            self._retry(self._privileged, 'umount', privileged.umount, target,
+                        **kwargs)
+        else:
+            self.sudo('umount', target, **kwargs)
+
+    def _get_device_fs_types(self, device):
+        """Return lsblk's output listing the filesystems on a device."""
+        kwargs = {'retries': 5, 'errors': [1, 32], 'delay': 2}
+        if CONF.PRIVILEGED_DAEMON:
+            stdout, stderr = self._retry(self._privileged, 'lsblk',
+                                         privileged.lsblk_fs_type, device,
+                                         **kwargs)
+        else:
+            # We don't use the util-linux Python library to reduce
+            # dependencies
+            stdout, stderr = self.sudo('lsblk', '-nlfoFSTYPE', device,
+                                       **kwargs)
+        return stdout
+
+    def _mkfs(self, fs_type, options, device):
+        if CONF.PRIVILEGED_DAEMON:
+            self._privileged('mkfs', privileged.mkfs, fs_type, options,
+                             device)
+        else:
+            self.sudo(*privileged.mkfs_command(fs_type, options, device))
+
+    def _sync(self, path):
+        if CONF.PRIVILEGED_DAEMON:
+            self._privileged('sync', privileged.sync, path)
+        else:
+            self.sudo('sync', path)
+
     def _check_path(self, request, context, path, attr='staging'):
         try:
             st_mode = os.stat(os.path.dirname(path)).st_mode
@@ -967,8 +1155,8 @@ class NodeBase(IdentityBase):
         con_cap = self.conn_cap(conn)
         # Staging capability doesn't come with readonly parameter, so we just
         # copy it from the published one.
-        req_cap = capabilities_lib.Capability(request.volume_capability,
-                                              con_cap.ro_forced)
+        req_cap = capabilities_lib.Capability.load(
+            request.volume_capability, con_cap.ro_forced)
 
         if not con_cap.supports(req_cap):
             context.abort(grpc.StatusCode.ALREADY_EXISTS,
@@ -991,6 +1179,7 @@ class NodeBase(IdentityBase):
     @common.logrpc
     @common.require('volume_id', 'staging_target_path', 'volume_capability')
     @common.Worker.unique
+    @common.batched
     def NodeStageVolume(self, request, context):
         vol = self._get_vol(request.volume_id, context=context)
         target, is_block = self._check_staging_path(request, context)
@@ -1002,14 +1191,15 @@ class NodeBase(IdentityBase):
             # retry the attach.  Since we don't disconnect this will go fast
             # through the login phase.
             for i in range(constants.MULTIPATH_FIND_RETRIES):
-                conn.attach()
+                with tracing.span('os_brick.attach'):
+                    conn.attach()
                 if not conn.use_multipath or conn.path.startswith('/dev/dm'):
                     break
                 LOG.debug('Retrying to get a multipath')
             # Create the private bind file
             open(private_bind, 'a').close()
             # TODO(geguileo): make path for private binds configurable
-            self.sudo('mount', '--bind', conn.path, private_bind)
+            self._bind_mount(conn.path, private_bind)
             device = conn.path
 
         if is_block:
@@ -1019,7 +1209,7 @@ class NodeBase(IdentityBase):
                 # TODO(geguileo): Add support for NFS/QCOW2
                 # Create the staging file for bind mounting
                 open(target, 'a').close()
-                self.sudo('mount', '--bind', private_bind, target)
+                self._bind_mount(private_bind, target)
         else:
             if not self._check_mount_exists(request.volume_capability,
                                             private_bind, target, context):
@@ -1032,12 +1222,14 @@ class NodeBase(IdentityBase):
         if not conn.mountpoint:
             conn._ovo.mountpoint = target
             conn.save()
+            common.ConnectionList.of(vol).invalidate()
         return self.STAGE_RESP
 
     @common.debuggable
     @common.logrpc
     @common.require('volume_id', 'staging_target_path')
     @common.Worker.unique
+    @common.batched
     def NodeUnstageVolume(self, request, context):
         # TODO(geguileo): Add support for NFS/QCOW2
         vol = self._get_vol(request.volume_id, context=context)
@@ -1045,8 +1237,7 @@ class NodeBase(IdentityBase):
         # If it's not already unstaged
         expected = (device, private_bind)
         if device:
-            do_match = [mount for mount in self._get_mountinfo()
-                        if mount.source in expected]
+            do_match = self.mount_table.with_source(*expected)
             count = len(do_match)
 
             # If the volume is still in use we cannot unstage (one use is for
@@ -1059,17 +1250,19 @@ class NodeBase(IdentityBase):
             staging_path = os.path.join(request.staging_target_path,
                                         self.STAGED_NAME)
             if count == 2:
-                self.sudo('umount', staging_path, retries=4)
+                self._umount(staging_path, retries=4)
                 self._clean_file_or_dir(staging_path)
             if count > 0:
-                self.sudo('umount', private_bind, retries=4)
+                self._umount(private_bind, retries=4)
             os.remove(private_bind)
 
             conn = self._get_conn(vol, path=staging_path)
             if conn:
-                conn.detach()
+                with tracing.span('os_brick.detach'):
+                    conn.detach()
                 conn._ovo.mountpoint = ''
                 conn.save()
+                common.ConnectionList.of(vol).invalidate()
 
         return self.UNSTAGE_RESP
 
@@ -1091,8 +1284,8 @@ class NodeBase(IdentityBase):
             return None, None
 
         pod_uid = self._get_pod_uid(request)
-        req_cap = capabilities_lib.Capability(request.volume_capability,
-                                              request.readonly)
+        req_cap = capabilities_lib.Capability.load(
+            request.volume_capability, request.readonly)
 
         if staging == conn.mountpoint:
             # Check if requested capability is compatible with existing ones
@@ -1126,6 +1319,7 @@ class NodeBase(IdentityBase):
     @common.require('volume_id', 'staging_target_path', 'target_path',
                     'volume_capability')
     @common.Worker.unique
+    @common.batched
     def NodePublishVolume(self, request, context):
         vol = self._get_vol(request.volume_id, context=context)
         staging_target, is_block = self._check_staging_path(request, context)
@@ -1160,8 +1354,7 @@ class NodeBase(IdentityBase):
             return self.NODE_PUBLISH_RESP
 
         # If not published bind it
-        mount_options = 'bind,ro' if req_cap.used_as_ro else 'bind'
-        self.sudo('mount', '-o', mount_options, staging_target, target)
+        self._bind_mount(staging_target, target, req_cap.used_as_ro)
 
         return self.NODE_PUBLISH_RESP
 
@@ -1169,6 +1362,7 @@ class NodeBase(IdentityBase):
     @common.logrpc
     @common.require('volume_id', 'target_path')
     @common.Worker.unique
+    @common.batched
     def NodeUnpublishVolume(self, request, context):
         device = self._get_device(request.target_path)
         if device:
@@ -1176,8 +1370,8 @@ class NodeBase(IdentityBase):
             # flushed after the unpublish, but in our case it wouldn't be until
             # the unstage, so we have to force the sync here.
             vol_dev = self._vol_private_location(request.volume_id)
-            self.sudo('sync', vol_dev)
-            self.sudo('umount', request.target_path, retries=4)
+            self._sync(vol_dev)
+            self._umount(request.target_path, retries=4)
             self._clean_file_or_dir(request.target_path)
         vol = self._get_vol(request.volume_id)
         conn = self._get_conn(vol, path=request.target_path)
@@ -1195,43 +1389,68 @@ class NodeBase(IdentityBase):
         return self.NODE_CAPABILITIES_RESP
 
 
+class TopologyIndex(object):
+    """Index of the configured topologies.
+
+    Topologies are stored as frozen sets of (segment name, value) tuples so
+    that finding which configured topologies a requested one is a subset or
+    a superset of only takes dictionary lookups.
+    """
+    def __init__(self, topologies):
+        self.topologies = topologies
+        # Every subset of a configured topology to the topologies containing it
+        self.subsets = {}
+        # Configured topologies to their positions
+        self.full = {}
+        keysets = set()
+        for i, topology in enumerate(topologies):
+            items = tuple(topology.items())
+            for size in range(len(items) + 1):
+                for subset in itertools.combinations(items, size):
+                    self.subsets.setdefault(frozenset(subset), []).append(i)
+            self.full.setdefault(frozenset(items), []).append(i)
+            keysets.add(frozenset(topology))
+        self.keysets = tuple(keysets)
+
+    def matches(self, segments):
+        """Return positions of topologies accessible with these segments.
+
+        Accessible topologies are the ones that are a subset or a superset of
+        the segments.
+        """
+        result = set(self.subsets.get(frozenset(segments.items()), ()))
+        for keyset in self.keysets:
+            if len(keyset) < len(segments) and keyset.issubset(segments):
+                key = frozenset((k, segments[k]) for k in keyset)
+                result.update(self.full.get(key, ()))
+        return result
+
+    def __repr__(self):
+        return repr(self.topologies)
+
+
 class TopologyBase(object):
     GRPC_TOPOLOGIES = None
-    TOPOLOGY_HIERA = None
+    TOPOLOGY_INDEX = None
 
     def _init_topology(self, constraint_type):
         if CONF.TOPOLOGIES:
             if constraint_type not in self.PLUGIN_CAPABILITIES:
                 self.PLUGIN_CAPABILITIES.append(constraint_type)
 
-            hiera = {}
-            grpc_topos = []
-
-            for topology in CONF.TOPOLOGIES:
-                level = hiera
-                for segment_name, segment_value in topology.items():
-                    value = level.setdefault(segment_name, {})
-                    level = value.setdefault(segment_value, {})
-                grpc_topos.append(self.TYPES.Topology(segments=topology))
-
-            self.TOPOLOGY_HIERA = hiera
-            self.GRPC_TOPOLOGIES = grpc_topos
+            self.TOPOLOGY_INDEX = TopologyIndex(CONF.TOPOLOGIES)
+            self.GRPC_TOPOLOGIES = [self.TYPES.Topology(segments=topology)
+                                    for topology in CONF.TOPOLOGIES]
 
     def _topology_is_accessible(self, topology, context):
-        unchecked = list(topology.segments.keys())
-        level = self.TOPOLOGY_HIERA
-        while level and unchecked:
-            for segment_name in level:
-                if segment_name in unchecked:
-                    value = topology.segments[segment_name]
-                    level = level[segment_name].get(value)
-                    unchecked.remove(segment_name)
-                    break
+        return bool(self.TOPOLOGY_INDEX.matches(topology.segments))
 
-        # Accessible if value of a segment name didn't fail, and if one of the
-        # topologies is a subset of the other one.
-        return level is not None and not (unchecked and level)
-        # return not (levels is None or (unchecked_segments and level))
+    def _accessible_topologies(self, topologies):
+        """Return the configured topologies accessible from any of these."""
+        matches = set()
+        for topology in topologies:
+            matches.update(self.TOPOLOGY_INDEX.matches(topology.segments))
+        return [self.GRPC_TOPOLOGIES[i] for i in sorted(matches)]
 
     def _validate_accessible_requirements(self, topology_req, context):
         requisite = getattr(topology_req, 'requisite', None)
@@ -1242,8 +1461,10 @@ class TopologyBase(object):
 
         # preferrend must be a subset of requisite
         if requisite and preferred:
+            requisite_items = {frozenset(r.segments.items())
+                               for r in requisite}
             for p in preferred:
-                if p not in requisite:
+                if frozenset(p.segments.items()) not in requisite_items:
                     context.abort(grpc.StatusCode.INVALID_ARGUMENT,
                                   'All preferred topologies must be in '
                                   'requisite topologies')
@@ -1251,33 +1472,39 @@ class TopologyBase(object):
         # If we only have preferred, we can ignore it, after all we don't have
         # different topologies to choose from.
         if not requisite:
-            return
-
-        for topology in requisite:
-            if self._topology_is_accessible(topology, context):
-                return
+            return None
 
-        context.abort(grpc.StatusCode.INVALID_ARGUMENT,
-                      'None of the requested topologies are accessible.')
+        accessible = self._accessible_topologies(requisite)
+        if not accessible:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          'None of the requested topologies are accessible.')
+        return accessible
 
     def _validate_accessibility(self, request, context):
+        """Validate request topologies returning the accessible ones.
+
+        Returns None when the request doesn't restrict the topologies.
+        """
         if not self.GRPC_TOPOLOGIES:
-            return
+            return None
 
         # Used by CreateVolume
         if (hasattr(request, 'accessibility_requirements') and
                 request.HasField('accessibility_requirements')):
-            self._validate_accessible_requirements(
+            return self._validate_accessible_requirements(
                 request.accessibility_requirements, context)
 
         # Used by GetCapacity
         if (hasattr(request, 'accessible_topology') and
                 request.HasField('accessible_topology')):
             # TODO(geguileo): Check request.accessible_topology for GetCapacity
-            if not self._topology_is_accessible(request.accessible_topology,
-                                                context):
+            accessible = self._accessible_topologies(
+                [request.accessible_topology])
+            if not accessible:
                 context.abort(grpc.StatusCode.INVALID_ARGUMENT,
                               'Topology is not accessible.')
+            return accessible
+        return None
 
 
 class SnapshotBase(object):
@@ -1301,7 +1528,8 @@ class SnapshotBase(object):
             context.abort(grpc.StatusCode.OUT_OF_RANGE,
                           'Snapshot %s is bigger than requested volume' %
                           snap_id)
-        vol = src_snap.create_volume(name=name, size=vol_size, **params)
+        with tracing.span('backend.create_volume_from_snapshot'):
+            vol = src_snap.create_volume(name=name, size=vol_size, **params)
         return vol
 
     # Inheriting classes must implement
@@ -1309,7 +1537,7 @@ class SnapshotBase(object):
     @common.debuggable
     @common.logrpc
     @common.require('name', 'source_volume_id')
-    @common.Worker.unique('name')
+    @common.Worker.unique('name', distributed=True)
     def CreateSnapshot(self, request, context):
         snaps = self._get_snap(snapshot_name=request.name, always_list=True)
 
@@ -1317,7 +1545,8 @@ class SnapshotBase(object):
         # request to create it
         if not snaps:
             vol = self._get_vol(request.source_volume_id, context=context)
-            snap = vol.create_snapshot(name=request.name)
+            with tracing.span('backend.create_snapshot'):
+                snap = vol.create_snapshot(name=request.name)
 
         # If we have multiple references there's something wrong, either the
         # same DB used for multiple purposes and there is a collision name, or
@@ -1346,7 +1575,7 @@ class SnapshotBase(object):
     @common.debuggable
     @common.logrpc
     @common.require('snapshot_id')
-    @common.Worker.unique('snapshot_id')
+    @common.Worker.unique('snapshot_id', distributed=True)
     def DeleteSnapshot(self, request, context):
         snap = self._get_snap(request.snapshot_id)
         if snap:
@@ -1360,17 +1589,33 @@ class SnapshotBase(object):
     @common.debuggable
     @common.logrpc
     def ListSnapshots(self, request, context):
-        if not (request.source_volume_id or request.snapshot_id):
-            vols = self._get_vol()
-            snaps = []
-            for v in vols:
-                snaps.extend(self._get_snap(volume_id=v.id, always_list=True))
+        get_page = getattr(self.persistence, 'get_snapshots_page', None)
+        if request.snapshot_id:
+            get_page = None
+
+        # Let the persistence plugin paginate if it knows how to
+        if get_page:
+            if request.source_volume_id:
+                filters = {'volume_id': request.source_volume_id}
+            else:
+                filters = {'backend_name': self.backend.id}
+            selected, token = self._get_page(request, context, get_page,
+                                             **filters)
+
         else:
-            snaps = self._get_snap(snapshot_id=request.snapshot_id,
-                                   volume_id=request.source_volume_id,
-                                   always_list=True)
+            if not (request.source_volume_id or request.snapshot_id):
+                # Get all snapshots at once and filter them here instead of
+                # making a request for each one of our volumes.
+                backend_name = self.backend.id
+                snaps = [snap for snap in self._get_snap(always_list=True)
+                         if getattr(snap.backend, 'id',
+                                    snap.backend) == backend_name]
+            else:
+                snaps = self._get_snap(snapshot_id=request.snapshot_id,
+                                       volume_id=request.source_volume_id,
+                                       always_list=True)
 
-        selected, token = self._paginate(request, context, snaps)
+            selected, token = self._paginate(request, context, snaps)
 
         entries = [
             self.TYPES.SnapEntry(snapshot=self._convert_snapshot_type(snap))
@@ -77,14 +77,27 @@ class ServiceCapabilities(object):
 
 
 class Capabilities(object):
+    # Parsed capabilities by their JSON string
+    _parsed = {}
+
     def __init__(self, capabilities):
         if isinstance(capabilities, six.string_types):
             capabilities = json.loads(capabilities)
 
-        self.capabilities = [c if isinstance(c, Capability) else Capability(c)
-                             for c in capabilities]
+        self.capabilities = [Capability.load(c) for c in capabilities]
         self._has_multi_mode = None
 
+    @classmethod
+    def load(cls, capabilities):
+        """Return capabilities, parsing JSON strings only once."""
+        if not isinstance(capabilities, six.string_types):
+            return cls(capabilities)
+
+        result = cls._parsed.get(capabilities)
+        if result is None:
+            result = cls._parsed[capabilities] = cls(capabilities)
+        return result
+
     @property
     def has_multi_mode(self):
         if self._has_multi_mode is None:
@@ -106,65 +119,105 @@ class Capabilities(object):
         return json.dumps(self.json, separators=(',', ':'))
 
     def supports(self, capability):
-        if not isinstance(capability, Capability):
-            capability = Capability(capability)
-
+        capability = Capability.load(capability)
         return any(cap.supports(capability) for cap in self)
 
 
 class Capability(object):
+    """Immutable volume capability.
+
+    Capabilities should be created with the load method, which returns the
+    same instance for equal capabilities and only parses each JSON string
+    once, so comparing them and checking their compatibility are cached
+    lookups.
+    """
+    __slots__ = ('is_block', 'access_mode', 'fs_type', 'mount_flags',
+                 'ro_forced', 'ro_mode', 'multi_mode', 'used_as_ro', 'key',
+                 '_supports')
+
+    # Interned capabilities by key and by the JSON string they came from
+    _interned = {}
+    _parsed = {}
+
     def __init__(self, capability, ro_forced=None):
         if isinstance(capability, six.string_types):
             capability = json.loads(capability)
 
         if isinstance(capability, dict):
-            self.is_block = capability['is_block']
-            self.access_mode = capability['access_mode']
-            self.fs_type = capability.get('fs_type')
-            self.mount_flags = capability.get('mount_flags')
+            is_block = capability['is_block']
+            access_mode = capability['access_mode']
+            fs_type = capability.get('fs_type')
+            mount_flags = capability.get('mount_flags')
             if ro_forced is None:
-                self.ro_forced = capability.get('ro_forced', False)
-            else:
-                self.ro_forced = ro_forced
+                ro_forced = capability.get('ro_forced', False)
 
         # If it's a gRPC object
         else:
-            self.is_block = capability.HasField('block')
-            self.access_mode = capability.access_mode.mode
-            if self.is_block:
-                self.fs_type = None
-                self.mount_flags = None
+            is_block = capability.HasField('block')
+            access_mode = capability.access_mode.mode
+            if is_block:
+                fs_type = None
+                mount_flags = None
             else:
-                self.fs_type = (capability.mount.fs_type or
-                                CONF.DEFAULT_MOUNT_FS)
-                self.mount_flags = list(capability.mount.mount_flags)
-            self.ro_forced = ro_forced or False
+                fs_type = capability.mount.fs_type or CONF.DEFAULT_MOUNT_FS
+                mount_flags = capability.mount.mount_flags
+            ro_forced = ro_forced or False
+
+        self.is_block = is_block
+        self.access_mode = access_mode
+        self.fs_type = fs_type
+        self.mount_flags = (None if mount_flags is None
+                            else tuple(mount_flags))
+        self.ro_forced = ro_forced
+        self.key = (self.is_block, self.access_mode, self.fs_type,
+                    self.mount_flags, self.ro_forced)
 
         self.ro_mode = self.access_mode in self.RO_ACCESS_MODES
         self.multi_mode = self.access_mode not in self.SINGLE_ACCESS_MODES
         self.used_as_ro = self.ro_forced or self.ro_mode
+        # Results of supports calls by the other capability's key
+        self._supports = {}
+
+    @classmethod
+    def load(cls, capability, ro_forced=None):
+        """Return the interned capability for a JSON, dict, or gRPC value."""
+        if isinstance(capability, Capability):
+            if ro_forced is None or ro_forced == capability.ro_forced:
+                return capability
+            capability = capability.json
+
+        parsed_key = None
+        if isinstance(capability, six.string_types):
+            parsed_key = (capability, ro_forced)
+            result = cls._parsed.get(parsed_key)
+            if result is not None:
+                return result
+
+        new = cls(capability, ro_forced)
+        result = cls._interned.setdefault(new.key, new)
+        if parsed_key:
+            cls._parsed[parsed_key] = result
+        return result
 
     def __eq__(self, other):
-        if not isinstance(other, Capability):
-            other = Capability(other)
-
-        res = (self.is_block == other.is_block and
-               self.access_mode == other.access_mode and
-               self.fs_type == other.fs_type and
-               self.mount_flags == other.mount_flags and
-               self.ro_forced == other.ro_forced)
-        return res
+        if self is other:
+            return True
+        return self.key == Capability.load(other).key
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.key)
+
     @property
     def json(self):
         res = {'is_block': self.is_block, 'access_mode': self.access_mode,
                'ro_forced': self.ro_forced}
         if not self.is_block:
             res['fs_type'] = self.fs_type
-            res['mount_flags'] = self.mount_flags
+            res['mount_flags'] = (None if self.mount_flags is None
+                                  else list(self.mount_flags))
         return res
 
     @property
@@ -172,6 +225,13 @@ class Capability(object):
         return json.dumps(self.json, separators=(',', ':'))
 
     def supports(self, capability):
+        result = self._supports.get(capability.key)
+        if result is None:
+            result = self._supports[capability.key] = self._check_supports(
+                capability)
+        return result
+
+    def _check_supports(self, capability):
         if self == capability:
             return True
 
@@ -182,8 +242,6 @@ class Capability(object):
                 (capability.multi_mode and not self.multi_mode)):
             return False
 
-            return False
-
         return (self.is_block or
                 (self.fs_type == capability.fs_type and
                  self.mount_flags == capability.mount_flags))
@@ -204,7 +262,7 @@ class Capability(object):
                         not self.used_as_ro)
 
             for conn in all_conns:
-                cap = Capability(conn.connector_info[CAP_KEY])
+                cap = Capability.load(conn.connector_info[CAP_KEY])
 
                 # All multi modes are incompatible between them
                 if cap.access_mode != self.access_mode:
@@ -55,12 +55,53 @@ with::
     kubectl get all
     kubectl get ember
 
-This plugin is not watching the CROs and acting on changes, so we should not be
+This plugin is not acting on changes to the CROs, so we should not be
 creating/deleting/changing them via kubectl, but through the CSI interface
 instead.
+
+By default every lookup goes to the Kubernetes API, but the plugin can keep a
+local cache of the CROs that is kept up to date watching for changes.  Lookups
+are then resolved in memory.  To enable it we need to set the `informer` key
+in the persistence configuration::
+
+    {"storage": "crd", "namespace": "default", "informer": true}
+
+When enabled, the RBACs must also allow the "watch" verb, which is already
+included in the "*" wildcard above.
+
+Connections to the Kubernetes API can be tuned with the `pool_size` (maximum
+number of connections, not counting those of the informer watches),
+`request_timeout` (in seconds), and `retries` (for connection errors and 429
+and 5xx responses) keys of the persistence configuration::
+
+    {"storage": "crd", "pool_size": 30, "request_timeout": 30, "retries": 3}
+
+Credentials are loaded from the in-cluster configuration, or from the
+kubeconfig file outside Kubernetes, unless we use the `api_host` key to give
+the URL of an API server to use without credentials, or the `fake_api` key to
+start an in-process fake Kubernetes API server, for example to test or
+benchmark the plugin.  Its value can be true or a dictionary with the options
+of the fake server (see the ember_csi.fake_k8s module)::
+
+    {"storage": "crd", "api_host": "http://127.0.0.1:8001"}
+    {"storage": "crd", "fake_api": {"latency": 0.005, "conflict_rate": 0.01}}
+
+The plugin also provides distributed leases, used by Ember-CSI to prevent
+multiple controllers from working on the same resource at the same time.  They
+are stored as KeyValue CROs named "lease-" followed by the hash of the leased
+key.
 """
 from __future__ import absolute_import
+import bisect
+import collections
+import contextlib
+import hashlib
+import json
 import os
+import socket
+import threading
+import time
+import uuid
 
 import cinderlib
 from cinderlib import objects
@@ -68,8 +109,12 @@ from cinderlib.persistence import base
 import kubernetes as k8s
 from oslo_log import log as logging
 import six
+import urllib3
 
 from ember_csi import defaults
+from ember_csi import metrics
+from ember_csi import tracing
+from ember_csi import waiters
 from ember_csi import workarounds
 
 
@@ -83,8 +128,8 @@ class CRD(object):
     Kubernetes do the search on the objects, and the cinderlib object's JSON
     data will be stored as an annotation called `json`.
 
-    In the future we may want to do this more efficiently: have individual
-    annotation fields and use patch to only update changes.
+    Updates are done using JSON merge patches, and unchanged resources are not
+    written again.
 
     The CRDs are added to the "all" and "ember" categories.
     """
@@ -92,6 +137,13 @@ class CRD(object):
     DOMAIN = defaults.NAME
     NAMESPACE = defaults.CRD_NAMESPACE
     RESOURCE_VERSION_ATTR = '__resource_version'
+    # Labels that also get a fixed length hash label to search by them
+    HASHED_LABELS = ()
+    HASH_SUFFIX = '_hash'
+    # Labels that older versions didn't set
+    REQUIRED_LABELS = ()
+    # Set by start_informers when the informer mode is enabled
+    informer = None
 
     @classmethod
     def ensure_crds_exist(cls):
@@ -121,6 +173,51 @@ class CRD(object):
                     if exc.status != 409:
                         raise
 
+    @classmethod
+    def ensure_labels(cls):
+        """Add missing labels to CROs created by older versions.
+
+        Searches by hashed labels and by REQUIRED_LABELS rely on all CROs
+        having them, so we must add them before we do any search.
+
+        This runs while cinderlib is setting up the persistence plugin, before
+        the backend is loaded, so labels are built from the JSON data instead
+        of loading the cinderlib objects.
+        """
+        for crd in cls.__subclasses__():
+            selectors = ['%s,!%s' % (label, label + cls.HASH_SUFFIX)
+                         for label in crd.HASHED_LABELS]
+            selectors.extend('!' + label for label in crd.REQUIRED_LABELS)
+            for selector in selectors:
+                res = K8S.crd_api.list_namespaced_custom_object(
+                    crd.DOMAIN, crd.CRD_VERSION, crd.NAMESPACE, crd.plural,
+                    label_selector=selector)
+                for item in res['items']:
+                    name = item['metadata']['name']
+                    labels = crd._prepare_labels(crd._get_json_labels(
+                        item['metadata']['annotations']['json']))
+                    LOG.debug('Adding missing labels to %s %s',
+                              crd.kind, name)
+                    crd._apply(name, {'labels': labels}, False)
+
+    @classmethod
+    def start_informers(cls):
+        """Start an informer for each one of our CRDs.
+
+        Doesn't return until all the informers have their initial listing.
+        """
+        for crd in cls.__subclasses__():
+            crd.informer = Informer(crd)
+            crd.informer.start()
+
+    @classmethod
+    def stop_informers(cls):
+        """Stop the informers, lookups go to Kubernetes afterwards."""
+        for crd in cls.__subclasses__():
+            if crd.informer:
+                crd.informer.stop()
+                crd.informer = None
+
     @classmethod
     def create_crd_definition(cls):
         """Creates a CRD definition for the current class.
@@ -157,12 +254,32 @@ class CRD(object):
         K8S.ext_api.create_custom_resource_definition(crd)
 
     @staticmethod
-    def _prepare_labels(labels):
-        """Prepare labels for K8s, removing empty and splitting long ones."""
+    def _json_fields(json_data):
+        """Return the backend name and the fields of a cinderlib JSON."""
+        resource = json.loads(json_data)
+        return (resource['backend']['volume_backend_name'],
+                resource['ovo']['versioned_object.data'])
+
+    @staticmethod
+    def _hash(value):
+        return hashlib.sha1(six.text_type(value).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _prepare_labels(cls, labels, search=False):
+        """Prepare labels for K8s, removing empty and splitting long ones.
+
+        Labels in HASHED_LABELS get an additional label with a hash of the
+        value, and when searching only the hash label is used, so we filter
+        by a single label regardless of the value's length.
+        """
         result = {}
         for k, v in labels.items():
             if not v:
                 continue
+            if k in cls.HASHED_LABELS:
+                result[k + cls.HASH_SUFFIX] = cls._hash(v)
+                if search:
+                    continue
             # Split strings that are too long
             if isinstance(v, six.string_types) and len(v) > 63:
                 j = 2
@@ -174,6 +291,12 @@ class CRD(object):
             result[k] = v
         return result
 
+    @classmethod
+    def matches(cls, resource, selector):
+        """Check if a cinderlib object has the labels of a search selector."""
+        labels = cls._prepare_labels(cls._get_labels(resource))
+        return all(labels.get(k) == v for k, v in selector.items())
+
     @classmethod
     def get(cls, **kwargs):
         """Get a cinderlib object.
@@ -181,44 +304,118 @@ class CRD(object):
         Positional arguments are used as label selectors.
 
         Received CROs are then deserialized using cinderlib's load method.
+
+        With the informer, CROs created by other processes may not be in our
+        cache yet, so lookups that find nothing in it ask Kubernetes.
         """
-        selector = cls._prepare_labels(kwargs)
+        selector = cls._prepare_labels(kwargs, search=True)
         res_id = selector.get(cls.singular + '_id')
         if res_id is not None:
-            try:
-                res = K8S.crd_api.get_namespaced_custom_object(cls.DOMAIN,
-                                                               cls.CRD_VERSION,
-                                                               cls.NAMESPACE,
-                                                               cls.plural,
-                                                               res_id)
-            except k8s.client.rest.ApiException as exc:
-                if exc.status == 404:
-                    return []
-                raise
+            res = cls._get_cro(res_id)
+            if res is None:
+                return []
 
             # Check that the other fields also match
             for k, v in selector.items():
-                if res['metadata']['labels'][k] != v:
+                if res['metadata']['labels'].get(k) != v:
                     LOG.error("%s %s has wrong label %s. %s != %s",
                               cls.kind, res_id, k, v,
-                              res['metadata']['labels'][k])
+                              res['metadata']['labels'].get(k))
                     return []
             res = [res]
+        else:
+            res = cls.informer.find(selector) if cls.informer else None
+            if not res:
+                res = cls._list_cros(selector)
+
+        return cls._load(res)
+
+    @classmethod
+    def _list_cros(cls, selector):
+        """List CROs from Kubernetes, storing them in the informer if any."""
+        selector_str = ','.join(k + '=' + v for k, v in selector.items())
+        res = K8S.crd_api.list_namespaced_custom_object(
+            cls.DOMAIN, cls.CRD_VERSION, cls.NAMESPACE, cls.plural,
+            label_selector=selector_str, resource_version='', watch=False)
+        if cls.informer:
+            for cro in res['items']:
+                cls.informer.store(cro)
+        return res['items']
+
+    @classmethod
+    def get_page(cls, limit=None, marker=None, **kwargs):
+        """Get a page of cinderlib objects.
+
+        Keyword arguments are used as label selectors, like in the get method.
+
+        Returns the cinderlib objects and the marker to get the next page, or
+        None if this was the last one.  Raises ValueError if the marker is not
+        valid.
+
+        Without the informer we use Kubernetes' limit and continue, so the
+        marker is the continue token.
+        """
+        selector = cls._prepare_labels(kwargs, search=True)
+        if cls.informer:
+            res, marker = cls.informer.page(selector, limit, marker)
         else:
             selector_str = ','.join(k + '=' + v for k, v in selector.items())
-            res = K8S.crd_api.list_namespaced_custom_object(
-                cls.DOMAIN, cls.CRD_VERSION, cls.NAMESPACE, cls.plural,
-                label_selector=selector_str, resource_version='', watch=False)
+            try:
+                res = K8S.crd_api.list_namespaced_custom_object(
+                    cls.DOMAIN, cls.CRD_VERSION, cls.NAMESPACE, cls.plural,
+                    label_selector=selector_str, limit=limit or None,
+                    _continue=marker or None)
+            except k8s.client.rest.ApiException as exc:
+                # Bad or expired continue token
+                if exc.status in (400, 410):
+                    raise ValueError('Invalid marker %s: %s' % (marker, exc))
+                raise
+            marker = res['metadata'].get('continue') or None
             res = res['items']
 
+        return cls._load(res), marker
+
+    @classmethod
+    def _load(cls, cros):
+        """Deserialize CROs using cinderlib's load method."""
         result = []
-        for item in res:
+        for item in cros:
             resource_json = item['metadata']['annotations']['json']
             resource = cinderlib.load(resource_json)
             cls._set_resource_version(resource, item)
             result.append(resource)
         return result
 
+    @classmethod
+    def _get_cro(cls, name):
+        """Get a CRO by name, returning None if it doesn't exist.
+
+        With the informer we only ask Kubernetes if it's not in our cache.
+        """
+        if cls.informer:
+            cro = cls.informer.get(name)
+            if cro is not None:
+                return cro
+        return cls._read_cro(name)
+
+    @classmethod
+    def _read_cro(cls, name):
+        """Get a CRO from Kubernetes, returning None if it doesn't exist."""
+        try:
+            cro = K8S.crd_api.get_namespaced_custom_object(cls.DOMAIN,
+                                                           cls.CRD_VERSION,
+                                                           cls.NAMESPACE,
+                                                           cls.plural,
+                                                           name)
+        except k8s.client.rest.ApiException as exc:
+            if exc.status == 404:
+                return None
+            raise
+
+        if cls.informer:
+            cls.informer.store(cro)
+        return cro
+
     @classmethod
     def delete(cls, name):
         """Delete a CRO based on its name."""
@@ -232,41 +429,50 @@ class CRD(object):
         except k8s.client.rest.ApiException as exc:
             if exc.status != 404:
                 raise
+        # Only once it's gone, or we would lose it if the delete failed
+        if cls.informer:
+            cls.informer.remove(name)
+        waiters.notify(name)
 
     @classmethod
-    def set(cls, resource, is_new=None):
+    def set(cls, resource, is_new=None, changed=True):
         """Sets the JSON of a cinderlib object in a CRO.
 
         Creates labels to facilitate filtering when retrieving them.
+
+        If the resource has no changes since we last read or wrote it there is
+        no need to write it again.
         """
+        version = getattr(resource, cls.RESOURCE_VERSION_ATTR, None)
+        if not (is_new or changed) and version is not None:
+            LOG.debug('Skipping unchanged %s %s', cls.kind, resource.id)
+            return
+
         json_data = resource.to_jsons(simplified=True)
         labels = cls._prepare_labels(cls._get_labels(resource))
-        cro = {'kind': cls.kind,
-               'apiVersion': cls.api_version,
-               'metadata': {'labels': labels,
-                            'name': resource.id,
-                            'annotations': {'json': json_data}}}
-        cls._set_dict_resource_version(resource, cro)
-        res = cls._apply(resource.id, cro, is_new)
+        metadata = {'labels': labels, 'annotations': {'json': json_data}}
+        res = cls._apply(resource.id, metadata, is_new, version)
         cls._set_resource_version(resource, res)
+        if cls.informer:
+            cls.informer.store(res)
+        waiters.notify(resource.id)
 
     @classmethod
-    def _apply(cls, name, body, is_new):
-        """Ensure CRO exists, creating or updating it as necessary.
+    def _apply(cls, name, metadata, is_new, version=None):
+        """Ensure CRO exists, creating or patching it as necessary.
 
-        resourceVersion is used as a rough mechanism to prevent concurrent
-        changes.
-        """
-        def replace():
-            return K8S.crd_api.replace_namespaced_custom_object(
-                cls.DOMAIN,
-                cls.CRD_VERSION,
-                cls.NAMESPACE,
-                cls.plural,
-                name,
-                body)
+        Existing CROs are updated with a JSON merge patch of the metadata, so
+        we only send the fields we manage and we don't need to retrieve the
+        CRO first.
 
+        resourceVersion, if known, is used as a rough mechanism to prevent
+        concurrent changes, since Kubernetes rejects the patch if the CRO has
+        changed.
+        """
         def create():
+            body = {'kind': cls.kind,
+                    'apiVersion': cls.api_version,
+                    'metadata': dict(metadata, name=name)}
             return K8S.crd_api.create_namespaced_custom_object(cls.DOMAIN,
                                                                cls.CRD_VERSION,
                                                                cls.NAMESPACE,
@@ -276,23 +482,22 @@ class CRD(object):
         if is_new:
             return create()
 
-        elif body['metadata'].get('resourceVersion') is not None:
-            return replace()
+        patch = {'metadata': metadata}
+        if version is not None:
+            patch['metadata'] = dict(metadata, resourceVersion=version)
 
-        else:
-            try:
-                res = K8S.crd_api.get_namespaced_custom_object(cls.DOMAIN,
-                                                               cls.CRD_VERSION,
-                                                               cls.NAMESPACE,
-                                                               cls.plural,
-                                                               name)
-                body['metadata']['resourceVersion'] = (
-                    res['metadata']['resourceVersion'])
-                return replace()
-            except Exception as exc:
-                if exc.status != 404:
-                    raise
-                return create()
+        try:
+            return K8S.crd_api.patch_namespaced_custom_object(cls.DOMAIN,
+                                                              cls.CRD_VERSION,
+                                                              cls.NAMESPACE,
+                                                              cls.plural,
+                                                              name,
+                                                              patch)
+        except k8s.client.rest.ApiException as exc:
+            # If we knew the version someone deleted it, so don't recreate it
+            if exc.status != 404 or version is not None:
+                raise
+            return create()
 
     @classmethod
     def _set_resource_version(cls, resource, result):
@@ -300,12 +505,6 @@ class CRD(object):
                 cls.RESOURCE_VERSION_ATTR,
                 result['metadata']['resourceVersion'])
 
-    @classmethod
-    def _set_dict_resource_version(cls, resource, body):
-        version = getattr(resource, cls.RESOURCE_VERSION_ATTR, None)
-        if version is not None:
-            body['metadata']['resourceVersion'] = version
-
 
 class Volume(CRD):
     """CRD representation for volumes.
@@ -314,8 +513,12 @@ class Volume(CRD):
         - id
         - display_name
         - backend
+
+    The display_name also has a hash label, as CSI names are usually longer
+    than the 63 characters allowed in a label value.
     """
     SHORTNAME = 'vol'
+    HASHED_LABELS = ('volume_name',)
 
     @classmethod
     def _get_labels(cls, volume):
@@ -326,25 +529,51 @@ class Volume(CRD):
             'volume_name': volume.name,
         }
 
+    @classmethod
+    def _get_json_labels(cls, json_data):
+        backend_name, fields = cls._json_fields(json_data)
+        return {
+            'backend_name': backend_name,
+            'volume_id': fields['id'],
+            'volume_name': fields.get('display_name'),
+        }
+
 
 class Snapshot(CRD):
     """CRD representation for snapshots.
 
-    Snapshots are create with 3 labels to facilitate their search:
+    Snapshots are create with 4 labels to facilitate their search:
         - snapshot_id
         - snapshot_name
         - volume_id
+        - backend
+
+    The snapshot_name also has a hash label, like the volume name.
     """
     SHORTNAME = 'snap'
+    HASHED_LABELS = ('snapshot_name',)
+    REQUIRED_LABELS = ('backend_name',)
 
     @classmethod
     def _get_labels(cls, snapshot):
+        # Like volumes, snapshot.backend can be an object or a string
         return {
+            'backend_name': getattr(snapshot.backend, 'id', snapshot.backend),
             'snapshot_id': snapshot.id,
             'snapshot_name': snapshot.name,
             'volume_id': snapshot.volume_id,
         }
 
+    @classmethod
+    def _get_json_labels(cls, json_data):
+        backend_name, fields = cls._json_fields(json_data)
+        return {
+            'backend_name': backend_name,
+            'snapshot_id': fields['id'],
+            'snapshot_name': fields.get('display_name'),
+            'volume_id': fields.get('volume_id'),
+        }
+
 
 class Connection(CRD):
     """CRD representation for snapshots.
@@ -362,6 +591,14 @@ class Connection(CRD):
             'volume_id': connection.volume_id,
         }
 
+    @classmethod
+    def _get_json_labels(cls, json_data):
+        backend_name, fields = cls._json_fields(json_data)
+        return {
+            'connection_id': fields['id'],
+            'volume_id': fields.get('volume_id'),
+        }
+
 
 class KeyValue(CRD):
     """CRD storage class for Key-Value pairs.
@@ -382,30 +619,356 @@ class KeyValue(CRD):
     @classmethod
     def get(cls, key):
         """Gets a KeyValue CRO and returns a cinderlib KeyValue."""
-        try:
-            res = K8S.crd_api.get_namespaced_custom_object(cls.DOMAIN,
-                                                           cls.CRD_VERSION,
-                                                           cls.NAMESPACE,
-                                                           cls.plural,
-                                                           key)
-            kv = objects.KeyValue(key, res['metadata']['annotations']['value'])
-            cls._set_resource_version(kv, res)
-            return([kv])
-        except k8s.client.rest.ApiException as exc:
-            if exc.status == 404:
-                return []
-            raise
+        res = cls._get_cro(key)
+        if res is None:
+            return []
+        kv = objects.KeyValue(key, res['metadata']['annotations']['value'])
+        cls._set_resource_version(kv, res)
+        return([kv])
 
     @classmethod
     def set(cls, key_value, is_new=None):
         """Sets the value of a cinderlib KeyValue in a CRO."""
-        cro = {'kind': cls.kind,
-               'apiVersion': cls.api_version,
-               'metadata': {'name': key_value.key,
-                            'annotations': {'value': key_value.value}}}
-        cls._set_dict_resource_version(key_value, cro)
-        res = cls._apply(key_value.key, cro, is_new)
+        metadata = {'annotations': {'value': key_value.value}}
+        version = getattr(key_value, cls.RESOURCE_VERSION_ATTR, None)
+        res = cls._apply(key_value.key, metadata, is_new, version)
         cls._set_resource_version(key_value, res)
+        if cls.informer:
+            cls.informer.store(res)
+
+
+class Lease(object):
+    """Distributed leases stored in KeyValue CROs.
+
+    The CRO's resourceVersion is used as a compare-and-swap mechanism when
+    acquiring and renewing a lease, so only one holder can succeed, and leases
+    expire if the holder doesn't renew them in time.  Leases are always read
+    from Kubernetes, since the informer may not have the latest version.
+
+    Releasing a lease deletes its CRO.
+    """
+    PREFIX = 'lease-'
+
+    @classmethod
+    def _name(cls, key):
+        return cls.PREFIX + CRD._hash(key)
+
+    @staticmethod
+    def _value(cro):
+        return json.loads(cro['metadata']['annotations']['value'])
+
+    @classmethod
+    def acquire(cls, key, holder, duration):
+        """Acquire or renew a lease.
+
+        Returns the holder of the lease after the call, or None if we lost the
+        race to another holder.
+        """
+        name = cls._name(key)
+        value = json.dumps({'holder': holder,
+                            'expires': time.time() + duration})
+        metadata = {'annotations': {'value': value}}
+
+        cro = KeyValue._read_cro(name)
+        try:
+            if cro is None:
+                res = KeyValue._apply(name, metadata, is_new=True)
+            else:
+                current = cls._value(cro)
+                if (current['holder'] != holder and
+                        current['expires'] > time.time()):
+                    return current['holder']
+                res = KeyValue._apply(name, metadata, False,
+                                      cro['metadata']['resourceVersion'])
+        except k8s.client.rest.ApiException as exc:
+            # Someone created or changed the lease since we read it
+            if exc.status != 409:
+                raise
+            return None
+
+        if KeyValue.informer:
+            KeyValue.informer.store(res)
+        return holder
+
+    @classmethod
+    def release(cls, key, holder):
+        """Release a lease, deleting its CRO, if we are still the holder."""
+        name = cls._name(key)
+        while True:
+            cro = KeyValue._read_cro(name)
+            if cro is None:
+                break
+            if cls._value(cro)['holder'] != holder:
+                return
+
+            preconditions = {
+                'resourceVersion': cro['metadata']['resourceVersion']}
+            try:
+                K8S.crd_api.delete_namespaced_custom_object(
+                    KeyValue.DOMAIN, KeyValue.CRD_VERSION, KeyValue.NAMESPACE,
+                    KeyValue.plural, name=name,
+                    body={'preconditions': preconditions})
+            except k8s.client.rest.ApiException as exc:
+                # It changed since we read it, see if it's still ours
+                if exc.status == 409:
+                    continue
+                if exc.status != 404:
+                    raise
+            break
+
+        if KeyValue.informer:
+            KeyValue.informer.remove(name)
+
+
+class Informer(object):
+    """Local cache of the CROs of a CRD kept up to date with a watch.
+
+    On start it lists all the CROs of the CRD and then watches for changes
+    from the listing's resourceVersion, listing everything again if the watch
+    is too old.
+
+    CROs are stored as returned by Kubernetes and indexed by their labels, so
+    lookups by name and by label selectors are resolved in memory.
+
+    Changes made by this process are stored as soon as Kubernetes confirms
+    them, so they can be read back without waiting for the watch event, and
+    watch events older than the CRO we have are ignored.
+    """
+    WATCH_TIMEOUT = 300
+    RETRY_INTERVAL = 1
+
+    def __init__(self, crd):
+        self.crd = crd
+        self.lock = threading.Lock()
+        self.resource_version = None
+        self.running = False
+        self.watcher = None
+        self._reset()
+
+    def _reset(self):
+        self.items = {}
+        # Sorted CRO names for pagination
+        self.names = []
+        # Label name -> label value -> set of CRO names
+        self.indexes = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+        # Last resourceVersion we knew of CROs we have deleted
+        self.tombstones = {}
+
+    def start(self):
+        self._list()
+        self.running = True
+        thread = threading.Thread(target=self._run,
+                                  name='informer-' + self.crd.plural)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.watcher:
+            self.watcher.stop()
+
+    @staticmethod
+    def _version(cro):
+        return cro['metadata']['resourceVersion']
+
+    @staticmethod
+    def _is_newer(version, other_version):
+        """Compare resourceVersions.
+
+        Kubernetes says they are opaque, but they are etcd revisions, so they
+        can be compared as integers.  If they cannot we consider it newer.
+        """
+        try:
+            return int(version) > int(other_version)
+        except (TypeError, ValueError):
+            return True
+
+    def get(self, name):
+        with self.lock:
+            return self.items.get(name)
+
+    def find(self, selector):
+        """Return CROs matching all the labels in the selector dictionary."""
+        with self.lock:
+            names = None
+            for key, value in selector.items():
+                matches = self.indexes[key].get(value)
+                if not matches:
+                    return []
+                names = matches.copy() if names is None else names & matches
+                if not names:
+                    return []
+
+            if names is None:
+                return list(self.items.values())
+            return [self.items[name] for name in names]
+
+    def page(self, selector, limit=None, marker=None):
+        """Return CROs matching the selector sorted by name.
+
+        The marker is the name of the last CRO returned in the previous page,
+        and since we only paginate volumes and snapshots, whose names are
+        UUIDs, we use that to validate it.
+        """
+        if marker:
+            uuid.UUID(marker)
+
+        selector = list(selector.items())
+        result = []
+        with self.lock:
+            start = bisect.bisect_right(self.names, marker) if marker else 0
+            for i in range(start, len(self.names)):
+                cro = self.items[self.names[i]]
+                labels = cro['metadata'].get('labels') or {}
+                if any(labels.get(k) != v for k, v in selector):
+                    continue
+                # We only return a marker if there are more CROs to return
+                if limit and len(result) == limit:
+                    return result, result[-1]['metadata']['name']
+                result.append(cro)
+        return result, None
+
+    def store(self, cro):
+        with self.lock:
+            self._store(cro)
+
+    def remove(self, name, cro=None):
+        with self.lock:
+            self._remove(name, cro)
+
+    def _store(self, cro):
+        name = cro['metadata']['name']
+        version = self._version(cro)
+
+        deleted_version = self.tombstones.get(name)
+        if deleted_version is not None:
+            if not self._is_newer(version, deleted_version):
+                return
+            del self.tombstones[name]
+
+        current = self.items.get(name)
+        if current is not None:
+            if not self._is_newer(version, self._version(current)):
+                return
+            self._unindex(current)
+        else:
+            bisect.insort(self.names, name)
+
+        self.items[name] = cro
+        for key, value in (cro['metadata'].get('labels') or {}).items():
+            self.indexes[key][value].add(name)
+
+    def _remove(self, name, cro=None):
+        current = self.items.pop(name, None)
+        if current is not None:
+            self._unindex(current)
+            del self.names[bisect.bisect_left(self.names, name)]
+
+        if cro is not None:
+            # It's the watch's DELETED event, it's really gone
+            self.tombstones.pop(name, None)
+        elif current is not None:
+            # Ignore older events for this CRO still coming from the watch
+            self.tombstones[name] = self._version(current)
+
+    def _unindex(self, cro):
+        name = cro['metadata']['name']
+        for key, value in (cro['metadata'].get('labels') or {}).items():
+            names = self.indexes[key].get(value)
+            if names:
+                names.discard(name)
+                if not names:
+                    del self.indexes[key][value]
+
+    def _list(self):
+        res = K8S.crd_api.list_namespaced_custom_object(self.crd.DOMAIN,
+                                                        self.crd.CRD_VERSION,
+                                                        self.crd.NAMESPACE,
+                                                        self.crd.plural)
+        version = res['metadata']['resourceVersion']
+        with self.lock:
+            current = self.items
+            self._reset()
+            for cro in res['items']:
+                self._store(cro)
+            # Keep our changes that happened after the listing
+            for name, cro in current.items():
+                if self._is_newer(self._version(cro), version):
+                    self._store(cro)
+            self.resource_version = version
+        LOG.debug('Informer for %s has %s CROs (resourceVersion %s)',
+                  self.crd.plural, len(res['items']), version)
+
+    def _watch(self):
+        watcher = self.watcher = k8s.watch.Watch()
+        stream = watcher.stream(K8S.crd_api.list_namespaced_custom_object,
+                                self.crd.DOMAIN,
+                                self.crd.CRD_VERSION,
+                                self.crd.NAMESPACE,
+                                self.crd.plural,
+                                resource_version=self.resource_version,
+                                timeout_seconds=self.WATCH_TIMEOUT)
+        for event in stream:
+            if not self.running:
+                watcher.stop()
+                break
+
+            cro = event['object']
+            if event['type'] == 'ERROR':
+                # Only newer clients raise the 410 Gone errors themselves
+                raise k8s.client.rest.ApiException(status=cro.get('code'),
+                                                   reason=cro.get('message'))
+            if event['type'] == 'BOOKMARK':
+                self.resource_version = self._version(cro)
+                continue
+
+            name = cro['metadata']['name']
+            if event['type'] in ('ADDED', 'MODIFIED'):
+                self.store(cro)
+            elif event['type'] == 'DELETED':
+                self.remove(name, cro)
+            self.resource_version = self._version(cro)
+            # Wake up threads waiting for changes made by other processes
+            waiters.notify(name)
+
+    def _run(self):
+        while self.running:
+            try:
+                self._watch()
+            except k8s.client.rest.ApiException as exc:
+                # Our resourceVersion is too old, we may have missed changes
+                if exc.status == 410:
+                    LOG.debug('Informer for %s expired, listing again',
+                              self.crd.plural)
+                else:
+                    LOG.warning('Informer for %s failed to watch: %s',
+                                self.crd.plural, exc)
+                    time.sleep(self.RETRY_INTERVAL)
+                self._relist()
+            except Exception:
+                LOG.exception('Informer for %s failed to watch',
+                              self.crd.plural)
+                time.sleep(self.RETRY_INTERVAL)
+
+    def _relist(self):
+        while self.running:
+            try:
+                return self._list()
+            except Exception as exc:
+                LOG.warning('Informer for %s failed to list: %s',
+                            self.crd.plural, exc)
+                time.sleep(self.RETRY_INTERVAL)
+
+
+def instrumented(f):
+    """Measure and trace a persistence call."""
+    return tracing.traced('persistence.')(
+        metrics.timed(metrics.PERSISTENCE_LATENCY)(f))
+
+
+PendingWrite = collections.namedtuple('PendingWrite',
+                                      'resource is_new changed')
 
 
 class CRDPersistence(base.PersistenceDriverBase):
@@ -414,79 +977,330 @@ class CRDPersistence(base.PersistenceDriverBase):
     This is an opinionated implementation that takes into account our specific
     use case.
     """
-    def __init__(self, namespace=None, **kwargs):
+    # Pending writes of the current thread's batch, if any
+    _local = threading.local()
+
+    def __init__(self, namespace=None, informer=False, pool_size=None,
+                 request_timeout=None, retries=None, api_host=None,
+                 fake_api=None, **kwargs):
         # Create fake DB for drivers
         self.fake_db = base.DB(self)
         if namespace:
             CRD.NAMESPACE = namespace
+        self.fake_api = None
+        if fake_api:
+            # Only needed for tests and benchmarks
+            from ember_csi import fake_k8s
+
+            options = fake_api if isinstance(fake_api, dict) else {}
+            self.fake_api = fake_k8s.FakeApiServer(**options).start()
+            api_host = self.fake_api.url
+        # Watches keep their connections busy
+        if pool_size and informer:
+            pool_size += len(CRD.__subclasses__())
+        K8S.configure(pool_size, request_timeout, retries, api_host)
         CRD.ensure_crds_exist()
+        CRD.ensure_labels()
+        if informer:
+            CRD.start_informers()
         super(CRDPersistence, self).__init__()
 
     @property
     def db(self):
         return self.fake_db
 
+    def stop(self):
+        """Stop watching for changes, called when the plugin stops."""
+        CRD.stop_informers()
+        if self.fake_api:
+            self.fake_api.shutdown()
+            self.fake_api.server_close()
+            self.fake_api = None
+
+    @property
+    def watches_key_values(self):
+        """Whether key-values are read from a local copy kept up to date."""
+        return KeyValue.informer is not None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer this thread's volume, snapshot, and connection writes.
+
+        Writes are done at the end of the block, even on error, and multiple
+        writes of the same object are coalesced into a single one, while
+        resources created and deleted within the block are never written.
+        Reads within the block see the pending writes.
+
+        Writing a different instance of a resource with pending changes writes
+        those changes first, so the resourceVersion of each instance is still
+        checked by Kubernetes.
+
+        Batches don't nest, inner blocks are part of the outer batch.
+        """
+        if getattr(self._local, 'batch', None) is not None:
+            yield
+            return
+
+        pending = self._local.batch = collections.OrderedDict()
+        try:
+            yield
+        finally:
+            self._local.batch = None
+            # All errors are logged, but the block's exception takes precedence
+            errors = self._flush(pending)
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _write(key, write):
+        crd, resource_id = key
+        if write.resource is None:
+            crd.delete(resource_id)
+        else:
+            crd.set(write.resource, write.is_new, write.changed)
+
+    @classmethod
+    def _flush(cls, pending):
+        """Write pending changes, returning the errors.
+
+        Writes are done concurrently since they are independent CROs.
+        """
+        errors = []
+
+        def write_one(key, write):
+            try:
+                cls._write(key, write)
+            except Exception as exc:
+                LOG.exception('Error writing %s %s', key[0].plural, key[1])
+                errors.append(exc)
+
+        if len(pending) < 2:
+            for item in pending.items():
+                write_one(*item)
+            return errors
+
+        write_one = tracing.in_current_span(write_one)
+        threads = [threading.Thread(target=write_one, args=item)
+                   for item in pending.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def _get(self, crd, **filters):
+        """Get cinderlib objects, including this thread's pending writes."""
+        pending = getattr(self._local, 'batch', None)
+        if not pending:
+            return crd.get(**filters)
+
+        # No need to ask for a resource we have written or deleted
+        res_id = filters.get(crd.singular + '_id')
+        if res_id and (crd, res_id) in pending:
+            result = []
+        else:
+            result = [resource for resource in crd.get(**filters)
+                      if (crd, resource.id) not in pending]
+
+        selector = crd._prepare_labels(filters, search=True)
+        for (pending_crd, res_id), write in pending.items():
+            if (pending_crd is crd and write.resource is not None and
+                    crd.matches(write.resource, selector)):
+                result.append(write.resource)
+        return result
+
+    @instrumented
     def get_volumes(self, volume_id=None, volume_name=None, backend_name=None):
-        return Volume.get(volume_id=volume_id, volume_name=volume_name,
-                          backend_name=backend_name)
+        return self._get(Volume, volume_id=volume_id, volume_name=volume_name,
+                         backend_name=backend_name)
 
+    @instrumented
     def get_snapshots(self, snapshot_id=None, snapshot_name=None,
-                      volume_id=None):
-        return Snapshot.get(snapshot_id=snapshot_id,
-                            snapshot_name=snapshot_name,
-                            volume_id=volume_id)
+                      volume_id=None, backend_name=None):
+        return self._get(Snapshot, snapshot_id=snapshot_id,
+                         snapshot_name=snapshot_name, volume_id=volume_id,
+                         backend_name=backend_name)
 
+    @instrumented
     def get_connections(self, connection_id=None, volume_id=None):
-        return Connection.get(connection_id=connection_id, volume_id=volume_id)
+        return self._get(Connection, connection_id=connection_id,
+                         volume_id=volume_id)
 
+    @instrumented
     def get_key_values(self, key):
         return KeyValue.get(key)
 
+    @instrumented
+    def get_volumes_page(self, backend_name=None, limit=None, marker=None):
+        """Return a page of volumes and the marker for the next page."""
+        return Volume.get_page(limit, marker, backend_name=backend_name)
+
+    @instrumented
+    def get_snapshots_page(self, volume_id=None, backend_name=None,
+                           limit=None, marker=None):
+        """Return a page of snapshots and the marker for the next page."""
+        return Snapshot.get_page(limit, marker, volume_id=volume_id,
+                                 backend_name=backend_name)
+
+    def _set(self, crd, resource):
+        changed_fields = self.get_changed_fields(resource)
+        is_new = 'id' in changed_fields
+        changed = bool(changed_fields or resource._changed_fields)
+
+        pending = getattr(self._local, 'batch', None)
+        if pending is None:
+            crd.set(resource, is_new, changed)
+            return
+
+        key = (crd, resource.id)
+        write = pending.get(key)
+        if write and write.resource is resource:
+            pending[key] = PendingWrite(resource, write.is_new or is_new,
+                                        write.changed or changed)
+            return
+
+        # A pending delete, or the changes of another instance of the resource,
+        # must be written first so this write is checked against them
+        if write:
+            self._write(key, pending.pop(key))
+        pending[key] = PendingWrite(resource, is_new, changed)
+
+    def _delete(self, crd, resource_id):
+        pending = getattr(self._local, 'batch', None)
+        if pending is None:
+            crd.delete(resource_id)
+            return
+
+        key = (crd, resource_id)
+        write = pending.pop(key, None)
+        # Don't write resources that were created in this batch
+        if not (write and write.is_new):
+            pending[key] = PendingWrite(None, False, False)
+
+    @instrumented
     def set_volume(self, volume):
-        Volume.set(volume,
-                   'id' in self.get_changed_fields(volume))
+        self._set(Volume, volume)
         super(CRDPersistence, self).set_volume(volume)
 
+    @instrumented
     def set_snapshot(self, snapshot):
-        Snapshot.set(snapshot,
-                     'id' in self.get_changed_fields(snapshot))
+        self._set(Snapshot, snapshot)
         super(CRDPersistence, self).set_snapshot(snapshot)
 
+    @instrumented
     def set_connection(self, connection):
-        Connection.set(connection,
-                       'id' in self.get_changed_fields(connection))
+        self._set(Connection, connection)
         super(CRDPersistence, self).set_connection(connection)
 
+    @instrumented
     def set_key_value(self, key_value):
         KeyValue.set(key_value)
 
+    @instrumented
     def delete_volume(self, volume):
-        Volume.delete(volume.id)
+        self._delete(Volume, volume.id)
         super(CRDPersistence, self).delete_volume(volume)
 
+    @instrumented
     def delete_snapshot(self, snapshot):
-        Snapshot.delete(snapshot.id)
+        self._delete(Snapshot, snapshot.id)
         super(CRDPersistence, self).delete_snapshot(snapshot)
 
+    @instrumented
     def delete_connection(self, connection):
-        Connection.delete(connection.id)
+        self._delete(Connection, connection.id)
         super(CRDPersistence, self).delete_connection(connection)
 
+    @instrumented
+    def acquire_lease(self, key, holder, duration):
+        """Acquire or renew a lease, returning its current holder."""
+        return Lease.acquire(key, holder, duration)
+
+    @instrumented
+    def release_lease(self, key, holder):
+        Lease.release(key, holder)
+
+    @instrumented
     def delete_key_value(self, key):
         KeyValue.delete(key)
         super(CRDPersistence, self).delete_key_value(key)
 
 
+class ApiClient(k8s.client.api_client.ApiClient):
+    """Kubernetes API client with a default timeout for requests.
+
+    Streamed requests, like watches, don't get the default timeout since they
+    can be idle for a long time.
+    """
+    def __init__(self, configuration, request_timeout=None):
+        super(ApiClient, self).__init__(configuration=configuration)
+        self.request_timeout = request_timeout
+
+    def request(self, *args, **kwargs):
+        if (kwargs.get('_request_timeout') is None and
+                kwargs.get('_preload_content', True)):
+            kwargs['_request_timeout'] = self.request_timeout
+        return super(ApiClient, self).request(*args, **kwargs)
+
+
 class K8sConnection(object):
+    """Clients of the Kubernetes API.
+
+    They are created when the plugin calls configure, and credentials are
+    only loaded then, and only if we don't receive the API server's URL.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    RETRY_BACKOFF = 0.5
+
     def __init__(self):
-        if 'KUBERNETES_PORT' in os.environ:
-            k8s.config.load_incluster_config()
+        self.credentials_loaded = False
+        self.api = self.ext_api = self.crd_api = None
+
+    def _load_credentials(self):
+        if not self.credentials_loaded:
+            if 'KUBERNETES_PORT' in os.environ:
+                k8s.config.load_incluster_config()
+            else:
+                k8s.config.load_kube_config()
+            self.credentials_loaded = True
+        return k8s.client.Configuration().get_default_copy()
+
+    def configure(self, pool_size=None, request_timeout=None, retries=None,
+                  host=None):
+        """Create the API clients with the given connection settings.
+
+        :param pool_size: Maximum number of connections to the API server.
+        :param request_timeout: Default timeout in seconds for requests.
+        :param retries: Retries on connection errors and on 429 and 5xx
+                        responses to idempotent requests.
+        :param host: URL of the API server to use without credentials, instead
+                     of the in-cluster or kubeconfig configuration.
+        """
+        if host:
+            config = k8s.client.Configuration()
+            config.host = host
         else:
-            k8s.config.load_kube_config()
-        config = k8s.client.Configuration().get_default_copy()
+            config = self._load_credentials()
         if config.host.startswith('https://'):
             config.assert_hostname = False
-        self.api = k8s.client.api_client.ApiClient(configuration=config)
+        if pool_size:
+            config.connection_pool_maxsize = pool_size
+
+        self.api = ApiClient(configuration=config,
+                             request_timeout=request_timeout)
+        # Detect dead connections to the API server in our pool
+        pool_kwargs = self.api.rest_client.pool_manager.connection_pool_kw
+        pool_kwargs['socket_options'] = (
+            urllib3.connection.HTTPConnection.default_socket_options +
+            [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        # Set on the pool manager because the client ignores config.retries
+        # before version 12.  Return the last response instead of raising, so
+        # callers still get the ApiException with the status code.
+        if retries:
+            pool_kwargs['retries'] = urllib3.util.Retry(
+                total=retries, backoff_factor=self.RETRY_BACKOFF,
+                status_forcelist=self.RETRY_STATUSES, raise_on_status=False)
+
         self.ext_api = k8s.client.ApiextensionsV1Api(self.api)
         self.crd_api = k8s.client.CustomObjectsApi(self.api)
 
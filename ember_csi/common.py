@@ -15,12 +15,17 @@
 
 from __future__ import absolute_import
 import calendar
+import collections
 import contextlib
 from datetime import datetime
 import functools
 import json
+import numbers
+import socket
 import threading
+import time
 import traceback
+import uuid
 
 import cinderlib
 import grpc
@@ -32,23 +37,274 @@ import six
 
 from ember_csi import config
 from ember_csi import constants
+from ember_csi import metrics
+from ember_csi import tracing
 
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
 
-@contextlib.contextmanager
-def noop_cm():
-    yield
+class KeyedLock(object):
+    """Fair locks for arbitrary keys.
+
+    Locks are created when first acquired and removed once nobody holds or
+    waits for them, and waiters get the lock in the order they arrived.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Key to (thread holding the lock, time it was acquired)
+        self._holders = {}
+        # Key to queue of events of waiting threads
+        self._waiters = {}
+
+    def acquire(self, key, timeout=None):
+        """Acquire the key's lock, returning False if we timed out."""
+        event = threading.Event()
+        if self.enqueue(key, event):
+            return True
+        event.wait(timeout)
+        return self.dequeue(key, event)
+
+    def enqueue(self, key, event):
+        """Acquire the key's lock or queue the event to be set when we can.
+
+        Returns True if we have the lock, otherwise the caller must wait for
+        the event, which can be anything with the set and is_set methods of
+        threading.Event, and then call dequeue.
+        """
+        with self._lock:
+            if key not in self._holders:
+                self._holders[key] = (threading.current_thread().ident,
+                                      time.time())
+                return True
+            self._waiters.setdefault(key, collections.deque()).append(event)
+            holder = self._holders[key][0]
+
+        LOG.debug('Waiting for lock %s held by thread %s', key, holder)
+        return False
+
+    def dequeue(self, key, event):
+        """Finish waiting for the lock, returning False if we timed out."""
+        with self._lock:
+            # Lock may have been handed to us right after the timeout
+            if event.is_set():
+                self._holders[key] = (threading.current_thread().ident,
+                                      time.time())
+                return True
+            waiters = self._waiters[key]
+            waiters.remove(event)
+            if not waiters:
+                del self._waiters[key]
+        return False
+
+    def release(self, key):
+        """Release the lock handing it to the first waiter, if any."""
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                del self._holders[key]
+                return
+
+            event = waiters.popleft()
+            if not waiters:
+                del self._waiters[key]
+            # Keep the lock reserved until the waiter wakes up
+            self._holders[key] = (None, time.time())
+            event.set()
+
+    def holders(self):
+        """Return the holders and number of waiters of the current locks."""
+        with self._lock:
+            return {key: (thread, since, len(self._waiters.get(key, ())))
+                    for key, (thread, since) in self._holders.items()}
+
+
+class Lease(object):
+    """Distributed lease on a key, renewed in the background while held."""
+    def __init__(self, persistence, key, duration):
+        self.persistence = persistence
+        self.key = key
+        self.duration = duration
+        self.holder = '%s/%s' % (socket.gethostname(), uuid.uuid4())
+        self.released = threading.Event()
+        self.renewer = None
+
+    def acquire(self):
+        """Try to acquire the lease, returning its current holder."""
+        holder = self.persistence.acquire_lease(self.key, self.holder,
+                                                self.duration)
+        if holder == self.holder:
+            self.renewer = threading.Thread(
+                target=tracing.in_current_span(self._renew))
+            self.renewer.daemon = True
+            self.renewer.start()
+        return holder
+
+    def _renew(self):
+        while not self.released.wait(self.duration / 3.0):
+            try:
+                holder = self.persistence.acquire_lease(self.key, self.holder,
+                                                        self.duration)
+            except Exception as exc:
+                LOG.warning('Error renewing lease for %s: %s', self.key, exc)
+                continue
+            if holder != self.holder:
+                LOG.error('Lost lease for %s to %s', self.key, holder)
+                return
+
+    def release(self):
+        self.released.set()
+        # Don't race with a renewal that would leave the lease behind
+        if self.renewer:
+            self.renewer.join()
+        try:
+            self.persistence.release_lease(self.key, self.holder)
+        except Exception as exc:
+            # It will expire anyway
+            LOG.warning('Error releasing lease for %s: %s', self.key, exc)
+
+
+class Admission(object):
+    """Admission control for gRPC calls.
+
+    Cheap calls, like Probe, are always admitted so they can use the threads
+    reserved for them, while the rest can only use `grpc_workers` threads and
+    are further limited per method or per class of method with the
+    `concurrency_limits` key of X_CSI_EMBER_CONFIG.
+
+    Calls wait for a free worker and for a free slot of their limit up to
+    `admission_timeout` seconds (0 means no limit), and only `admission_queue`
+    calls can wait for a worker at the same time.  Calls that don't fit in the
+    queue or time out are rejected with RESOURCE_EXHAUSTED and a retry
+    pushback hint.
+
+    It is created on the first call, once the configuration is validated.
+    """
+    FAST_METHODS = frozenset(('GetPluginInfo', 'GetPluginCapabilities',
+                              'Probe', 'ControllerGetCapabilities',
+                              'NodeGetCapabilities', 'NodeGetInfo',
+                              'NodeGetId'))
+    CLASSES = {'CreateVolume': 'provisioning',
+               'DeleteVolume': 'provisioning',
+               'CreateSnapshot': 'provisioning',
+               'DeleteSnapshot': 'provisioning',
+               'ControllerExpandVolume': 'provisioning',
+               'ControllerPublishVolume': 'attachment',
+               'ControllerUnpublishVolume': 'attachment',
+               'NodeStageVolume': 'node',
+               'NodeUnstageVolume': 'node',
+               'NodePublishVolume': 'node',
+               'NodeUnpublishVolume': 'node',
+               'NodeExpandVolume': 'node',
+               'NodeGetVolumeStats': 'node',
+               'ListVolumes': 'listing',
+               'ListSnapshots': 'listing',
+               'ValidateVolumeCapabilities': 'listing',
+               # May ask the backend for its stats
+               'GetCapacity': 'capacity'}
+    RETRY_PUSHBACK_MS = 1000
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, workers, limits=None, timeout=None, queue=0):
+        self.workers = threading.Semaphore(workers)
+        self.queue = threading.Semaphore(queue)
+        self.limits = {name: threading.Semaphore(limit)
+                       for name, limit in (limits or {}).items()}
+        self.timeout = timeout
+
+    @classmethod
+    def get(cls):
+        """Return the admission control, creating it on the first call."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(CONF.WORKERS, CONF.CONCURRENCY_LIMITS,
+                                        CONF.ADMISSION_TIMEOUT or None,
+                                        CONF.ADMISSION_QUEUE)
+        return cls._instance
+
+    def _reject(self, method, context, reason):
+        metrics.ADMISSION_REJECTIONS.inc(method)
+        context.set_trailing_metadata(
+            (('grpc-retry-pushback-ms', str(self.RETRY_PUSHBACK_MS)),))
+        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                      'Cannot %s now, %s, retry in %ss' %
+                      (method, reason, self.RETRY_PUSHBACK_MS / 1000.0))
+
+    def _get_limit(self, method):
+        limit = self.limits.get(method)
+        if limit is None:
+            limit = self.limits.get(self.CLASSES.get(method))
+        return limit
+
+    def _wait_for_worker(self, method, context):
+        if not self.queue.acquire(False):
+            self._reject(method, context, 'all workers are busy')
+        try:
+            acquired = self.workers.acquire(timeout=self.timeout)
+        finally:
+            self.queue.release()
+        if not acquired:
+            self._reject(method, context, 'all workers are busy')
+
+    @contextlib.contextmanager
+    def admit(self, method, context):
+        # The asyncio server admits calls before they get a thread
+        if method in self.FAST_METHODS or getattr(context, 'admitted', False):
+            yield
+            return
+
+        if not self.workers.acquire(False):
+            self._wait_for_worker(method, context)
+        try:
+            limit = self._get_limit(method)
+            if limit is None:
+                yield
+                return
+
+            if not limit.acquire(timeout=self.timeout):
+                self._reject(method, context, 'too many concurrent calls')
+            try:
+                yield
+            finally:
+                limit.release()
+        finally:
+            self.workers.release()
 
 
 class Worker(object):
     current_workers = {}
-    locks = {}
+    locks = KeyedLock()
+
+    @staticmethod
+    def _acquire_lease(worker_id, method, context):
+        """Acquire a distributed lease if enabled and supported."""
+        persistence = cinderlib.Backend.persistence
+        if (not CONF.LEASE_DURATION or
+                not hasattr(persistence, 'acquire_lease')):
+            return None
+
+        lease = Lease(persistence, worker_id, CONF.LEASE_DURATION)
+        holder = lease.acquire()
+        if holder != lease.holder:
+            metrics.WORKER_ABORTS.inc(method)
+            context.abort(grpc.StatusCode.ABORTED,
+                          'Cannot %s on %s while %s is working on it' %
+                          (method, worker_id, holder or 'another controller'))
+        return lease
+
+    @staticmethod
+    def lock_timed_out(lock_key, context):
+        method, worker_id = lock_key
+        metrics.WORKER_ABORTS.inc(method)
+        context.abort(grpc.StatusCode.ABORTED,
+                      'Timed out waiting to %s on %s' % (method, worker_id))
 
     @classmethod
-    def _unique_worker(cls, func, request_field):
+    def _unique_worker(cls, func, request_field, distributed=False):
         @functools.wraps(func)
         def wrapper(self, request, context):
             worker_id = getattr(request, request_field)
@@ -56,59 +312,174 @@ class Worker(object):
             my_thread = threading.current_thread().ident
             current = (my_method, my_thread)
 
-            if CONF.ABORT_DUPLICATES:
-                lock = noop_cm()
-            else:
-                lock = cls.locks.get(my_method)
-                if not lock:
-                    lock = cls.locks[my_method] = threading.Lock()
+            # Only serialize calls to the same method for the same resource,
+            # unless the asyncio server already has the lock for us
+            lock_key = (my_method, worker_id)
+            must_lock = (not CONF.ABORT_DUPLICATES and
+                         getattr(context, 'lock_key', None) != lock_key)
+            if must_lock:
+                if not cls.locks.acquire(lock_key, CONF.LOCK_TIMEOUT or None):
+                    cls.lock_timed_out(lock_key, context)
 
-            with lock:
+            try:
                 method, thread = cls.current_workers.setdefault(worker_id,
                                                                 current)
 
                 if (method, thread) != current:
+                    metrics.WORKER_ABORTS.inc(my_method)
                     context.abort(
                         grpc.StatusCode.ABORTED,
                         'Cannot %s on %s while thread %s is doing %s' %
                         (my_method, worker_id, thread, method))
 
+                lease = None
                 try:
+                    if distributed:
+                        lease = cls._acquire_lease(worker_id, my_method,
+                                                   context)
                     return func(self, request, context)
                 finally:
+                    if lease:
+                        lease.release()
                     del cls.current_workers[worker_id]
+            finally:
+                if must_lock:
+                    cls.locks.release(lock_key)
+        # Outer decorators keep it, so the asyncio server can find the lock
+        wrapper.unique_field = request_field
         return wrapper
 
     @classmethod
-    def unique(cls, *args):
+    def unique(cls, *args, **kwargs):
+        """Prevent concurrent calls on the same resource.
+
+        Calls using distributed=True are also prevented across processes
+        sharing the persistence when leases are enabled.
+        """
         if len(args) == 1 and callable(args[0]):
             return cls._unique_worker(args[0], 'volume_id')
         else:
+            request_field = args[0] if args else 'volume_id'
             return functools.partial(cls._unique_worker,
-                                     request_field=args[0])
+                                     request_field=request_field, **kwargs)
+
+
+def _count_locks(waiters=False):
+    """Count resource locks, or their waiters, per method."""
+    result = collections.Counter()
+    for (method, worker_id), (thread, since, num_waiters) in (
+            Worker.locks.holders().items()):
+        result[(method,)] += num_waiters if waiters else 1
+    return result
+
+
+metrics.WORKER_LOCKS.set_function(_count_locks)
+metrics.WORKER_LOCK_WAITERS.set_function(
+    functools.partial(_count_locks, waiters=True))
+
+
+def batched(f):
+    """Write the call's persistence changes together, if supported.
+
+    Only the CRD plugin supports batches, the DB and memory plugins still write
+    each change as it happens.
+    """
+    @functools.wraps(f)
+    def wrapper(self, request, context):
+        batch = getattr(cinderlib.Backend.persistence, 'batch', None)
+        if not batch:
+            return f(self, request, context)
+        with batch():
+            return f(self, request, context)
+    return wrapper
+
+
+ID_FIELDS = ('name', 'id', 'volume_id', 'snapshot_id')
+RESOURCE_FIELDS = ('volume', 'snapshot')
+
+
+def _first_field(message, fields):
+    names = message.DESCRIPTOR.fields_by_name
+    for field in fields:
+        if field in names:
+            return field
+    return None
+
+
+class AbortRpc(Exception):
+    pass
+
+
+class _RpcState(object):
+    __slots__ = ('code', 'details', 'trailing_metadata')
+
+    def __init__(self):
+        self.code = None
+        self.details = None
+        self.trailing_metadata = None
+
+
+class SyncContext(object):
+    """Servicer context for calls that don't come from the threaded server.
+
+    Behaves like the threaded server's context: abort raises an exception and
+    the code and details are stored in the _state attribute, where logrpc
+    looks for them.
+
+    The asyncio server admits calls and acquires their Worker lock before
+    running them, and tells us with the admitted and lock_key attributes.
+    """
+    def __init__(self, metadata=()):
+        self._metadata = metadata
+        self._state = _RpcState()
+        self.admitted = False
+        self.lock_key = None
+
+    def invocation_metadata(self):
+        return self._metadata
+
+    def set_code(self, code):
+        self._state.code = code
+
+    def set_details(self, details):
+        self._state.details = details
+
+    def set_trailing_metadata(self, trailing_metadata):
+        self._state.trailing_metadata = tuple(trailing_metadata)
+
+    def abort(self, code, details=''):
+        self._state.code = code
+        self._state.details = details
+        raise AbortRpc('%s: %s' % (code, details))
 
 
 def logrpc(f):
     def tab(what):
         return '\t' + '\n\t'.join(filter(None, str(what).split('\n')))
 
-    def _get_idempotent_id(request):
-        for param in ('name', 'id', 'volume_id', 'snapshot_id'):
-            try:
-                return ' ' + getattr(request, param)
-            except AttributeError:
-                pass
-        return ''
+    # Requests and responses of a method are always of the same type, so we
+    # only need to look for their id fields on the first call.
+    fields = {}
 
-    def _get_response_id(response):
-        id_str = ' (id =%s)'
+    def _get_field(kind, message, candidates):
+        if kind not in fields:
+            fields[kind] = _first_field(message, candidates)
+        return fields[kind]
 
-        for resource in ('volume', 'snapshot'):
-            try:
-                return id_str % _get_idempotent_id(getattr(response, resource))
-            except AttributeError:
-                pass
-        return ''
+    def _get_id(message, kind='request'):
+        field = _get_field(kind, message, ID_FIELDS)
+        return getattr(message, field) if field else None
+
+    def _get_idempotent_id(message, kind='request'):
+        resource_id = _get_id(message, kind)
+        return '' if resource_id is None else ' ' + resource_id
+
+    def _get_response_id(response):
+        resource = _get_field('response', response, RESOURCE_FIELDS)
+        if not resource:
+            return ''
+        return ' (id =%s)' % _get_idempotent_id(getattr(response, resource),
+                                                'resource')
 
     @functools.wraps(f)
     def dolog(self, request, context):
@@ -121,13 +492,23 @@ def logrpc(f):
 
         start = datetime.utcnow()
         LOG.info('=> GRPC %s%s' % (f.__name__, _get_idempotent_id(request)))
-        if request.ListFields():
-            msg = ' params:\n%s' % tab(request)
-        else:
-            msg = 'out params'
-        LOG.debug('With%s' % msg)
+        # Don't stringify messages, which can be huge, if we won't log them
+        debug = LOG.isEnabledFor(logging.DEBUG)
+        if debug:
+            if request.ListFields():
+                msg = ' params:\n%s' % tab(request)
+            else:
+                msg = 'out params'
+            LOG.debug('With%s' % msg)
+        metrics.RPC_IN_FLIGHT.inc(f.__name__)
         try:
-            result = f(self, request, context)
+            with tracing.rpc_span(f.__name__, context), \
+                    Admission.get().admit(f.__name__, context):
+                resource_id = _get_id(request)
+                if resource_id:
+                    tracing.set_attribute('ember_csi.resource_id',
+                                          resource_id)
+                result = f(self, request, context)
         except Exception as exc:
             end = datetime.utcnow()
             if context._state.code:
@@ -138,17 +519,26 @@ def logrpc(f):
                 code = 'Unexpected exception'
                 details = getattr(exc, 'message', '-')
                 tback = '\n' + tab(traceback.format_exc())
+            metrics.RPC_LATENCY.observe((end - start).total_seconds(),
+                                        f.__name__,
+                                        code if context._state.code
+                                        else 'UNKNOWN')
             LOG.error('!! GRPC %s failed in %.0fs with %s (%s)%s' %
                       (f.__name__, (end - start).total_seconds(), code,
                        details, tback))
             raise
+        finally:
+            metrics.RPC_IN_FLIGHT.dec(f.__name__)
         end = datetime.utcnow()
+        metrics.RPC_LATENCY.observe((end - start).total_seconds(),
+                                    f.__name__, 'OK')
 
         LOG.info('<= GRPC %s%s served in %.0fs' % (
             f.__name__, _get_response_id(result),
             (end - start).total_seconds()))
-        str_result = tab(result) if str(result) else 'nothing'
-        LOG.debug('Returns:\n%s' % tab(str_result))
+        if debug:
+            str_result = tab(result) if str(result) else 'nothing'
+            LOG.debug('Returns:\n%s' % tab(str_result))
         return result
     return dolog
 
@@ -228,18 +618,50 @@ def require(*fields):
 
 
 class NodeInfo(object):
-    __slots__ = ('id', 'connector_dict')
+    """Node connector information.
+
+    Controllers cache it, since it's read on every publish and unpublish and
+    it rarely changes.  When the persistence plugin keeps a local copy of the
+    key-values up to date, like the CRD one with the informer, we always read
+    it and only parse it again if it has changed.  Otherwise we read it again
+    once the cached one is older than `node_info_ttl` seconds.
+
+    A TTL of 0 disables the cache.
+    """
+    __slots__ = ('id', 'connector_dict', 'value')
 
-    def __init__(self, node_id, connector_dict):
+    # Node id to (NodeInfo, time it was read)
+    _cache = {}
+
+    def __init__(self, node_id, connector_dict, value=None):
         self.id = node_id
         self.connector_dict = connector_dict
+        self.value = value
 
     @classmethod
     def get(cls, node_id):
-        kv = cinderlib.Backend.persistence.get_key_values(node_id)
+        persistence = cinderlib.Backend.persistence
+        now = time.time()
+        cached, read_at = cls._cache.get(node_id, (None, 0))
+        if (cached and not getattr(persistence, 'watches_key_values', False)
+                and now - read_at < CONF.NODE_INFO_TTL):
+            return cached
+
+        kv = persistence.get_key_values(node_id)
         if not kv:
+            cls._cache.pop(node_id, None)
             return None
-        return cls(node_id, json.loads(kv[0].value))
+
+        value = kv[0].value
+        if not cached or cached.value != value:
+            cached = cls(node_id, json.loads(value), value)
+        if CONF.NODE_INFO_TTL:
+            cls._cache[node_id] = (cached, now)
+        return cached
+
+    @classmethod
+    def invalidate(cls, node_id):
+        cls._cache.pop(node_id, None)
 
     @classmethod
     def set(cls, node_id, storage_nw_ip):
@@ -249,7 +671,157 @@ class NodeInfo(object):
         value = json.dumps(connector_dict, separators=(',', ':'))
         kv = cinderlib.KeyValue(node_id, value)
         cinderlib.Backend.persistence.set_key_value(kv)
-        return NodeInfo(node_id, connector_dict)
+        node_info = NodeInfo(node_id, connector_dict, value)
+        # Controller running on the same process sees the change right away
+        if CONF.NODE_INFO_TTL:
+            cls._cache[node_id] = (node_info, time.time())
+        return node_info
+
+
+class ConnectionList(list):
+    """List of a volume's connections indexed by host and path.
+
+    Replaces cinderlib's list in the volume, so connections added or removed
+    by cinderlib or by us are reflected in the indexes, which are rebuilt on
+    the next lookup after a change.  Changing the attached host or mountpoint
+    of a connection requires calling invalidate.
+    """
+    def __init__(self, *args):
+        super(ConnectionList, self).__init__(*args)
+        self._index = None
+
+    @classmethod
+    def of(cls, volume):
+        """Return the volume's connections, replacing them if necessary."""
+        connections = volume.connections
+        if not isinstance(connections, cls):
+            connections = volume._connections = cls(connections)
+        return connections
+
+    def invalidate(self):
+        self._index = None
+
+    def _get_index(self):
+        if self._index is None:
+            by_host = collections.defaultdict(list)
+            by_host_path = collections.defaultdict(list)
+            for conn in self:
+                by_host[conn.attached_host].append(conn)
+                by_host_path[(conn.attached_host,
+                              conn.mountpoint)].append(conn)
+            self._index = (by_host, by_host_path)
+        return self._index
+
+    def with_host(self, host):
+        return self._get_index()[0].get(host, [])
+
+    def with_host_path(self, host, path):
+        return self._get_index()[1].get((host, path), [])
+
+
+def _invalidating(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort',
+              'reverse', '__setitem__', '__delitem__', '__iadd__',
+              '__setslice__', '__delslice__'):
+    if hasattr(list, _name):
+        setattr(ConnectionList, _name, _invalidating(_name))
+
+
+class BackendStats(object):
+    """Backend stats cache refreshed in the background.
+
+    Some storage arrays take seconds to return their stats, so once they are
+    older than the TTL we start refreshing them in the background and keep
+    returning the cached ones in the meantime.  Only calls made while we
+    don't have any stats wait.
+
+    If a refresh fails we keep returning the old stats, if we have them, and
+    try again on the next call.
+
+    A TTL of 0 disables the cache.
+    """
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.refreshing = False
+        self.updated = 0
+        self.stats = None
+        self.error = None
+
+    def _refresh(self):
+        try:
+            with tracing.span('backend.stats'):
+                stats = self.backend.stats(refresh=True)
+        except Exception as exc:
+            with self.lock:
+                self.error = exc
+                self.refreshing = False
+                stale = self.stats is not None
+            LOG.warning('Error getting backend stats%s: %s',
+                        ', using the old ones' if stale else '', exc)
+        else:
+            with self.lock:
+                self.stats = stats
+                self.error = None
+                self.updated = time.time()
+                self.refreshing = False
+        self.ready.set()
+
+    def get(self):
+        """Return the backend stats.
+
+        Raises the exception from the last refresh if it failed and we don't
+        have any stats.
+        """
+        if not self.ttl:
+            return self.backend.stats(refresh=True)
+
+        with self.lock:
+            wait = self.stats is None
+            refresh = (not self.refreshing and
+                       time.time() - self.updated > self.ttl)
+            if refresh:
+                self.refreshing = True
+                if wait:
+                    self.ready.clear()
+
+        if refresh:
+            if wait:
+                self._refresh()
+            else:
+                thread = threading.Thread(target=self._refresh)
+                thread.daemon = True
+                thread.start()
+
+        if wait:
+            self.ready.wait()
+        with self.lock:
+            if self.stats is None:
+                raise self.error
+            return self.stats
+
+    @staticmethod
+    def free_capacity_gb(stats):
+        """Return the free capacity of all the pools in the stats."""
+        free = 0
+        for pool in stats.get('pools') or [stats]:
+            pool_free = pool.get('free_capacity_gb')
+            # Ignore 'unknown' and 'infinite' values
+            if isinstance(pool_free, numbers.Number):
+                free += pool_free
+        return free
 
 
 class EnumWrapper(object):
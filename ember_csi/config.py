@@ -43,7 +43,7 @@ class Config(object):
 
     @staticmethod
     def _env_bool(name, default=False):
-        res = os.environ.get('X_CSI_ABORT_DUPLICATES')
+        res = os.environ.get(name)
         if not res:
             res = str(default)
         return res.upper() == 'TRUE'
@@ -105,6 +105,7 @@ class Config(object):
         self.CSI_SPEC = self._env_string('X_CSI_SPEC_VERSION',
                                          defaults.SPEC_VERSION)
         self.ABORT_DUPLICATES = self._env_bool('X_CSI_ABORT_DUPLICATES')
+        self.GRPC_ASYNCIO = self._env_bool('X_CSI_GRPC_ASYNCIO')
         self.DEBUG_MODE = self._env_string('X_CSI_DEBUG_MODE').upper()
         self.SYSTEM_FILES = self._env_string('X_CSI_SYSTEM_FILES')
 
@@ -135,10 +136,38 @@ class Config(object):
         self.ENABLE_PROBE = EMBER_CONFIG.pop('enable_probe',
                                              defaults.ENABLE_PROBE)
         self.HAS_SLOW_OPERATIONS = EMBER_CONFIG.pop('slow_operations')
+        self.WAIT_TIMEOUT = EMBER_CONFIG.pop('wait_timeout')
+        self.STATS_TTL = EMBER_CONFIG.pop('stats_ttl')
+        self.PRIVILEGED_DAEMON = EMBER_CONFIG.pop('privileged_daemon')
+        self.METRICS_PORT = EMBER_CONFIG.pop('metrics_port')
+        self.TRACING_EXPORTER = EMBER_CONFIG.pop('tracing_exporter')
+        self.LOCK_TIMEOUT = EMBER_CONFIG.pop('lock_timeout')
+        self.LEASE_DURATION = EMBER_CONFIG.pop('lease_duration')
+        self.RESERVED_WORKERS = EMBER_CONFIG.pop('reserved_workers')
+        self.CONCURRENCY_LIMITS = EMBER_CONFIG.pop('concurrency_limits')
+        self.ADMISSION_TIMEOUT = EMBER_CONFIG.pop('admission_timeout')
+        self.ADMISSION_QUEUE = EMBER_CONFIG.pop('admission_queue')
+        self.NODE_INFO_TTL = EMBER_CONFIG.pop('node_info_ttl')
+        if (self.PERSISTENCE_CONFIG.get('storage') == 'crd' and
+                'pool_size' not in self.PERSISTENCE_CONFIG):
+            self.PERSISTENCE_CONFIG = dict(self.PERSISTENCE_CONFIG,
+                                           pool_size=self._get_pool_size())
         self.EMBER_CONFIG = EMBER_CONFIG
 
         self._set_logging(self.EMBER_CONFIG)
 
+    def _get_pool_size(self):
+        """Kubernetes API connections our threads may use at the same time.
+
+        Each gRPC worker, reserved ones included, can use a connection, and
+        so can each lease renewal.  Batched writes are done concurrently, and
+        batches usually have a volume and a connection, so we allow a second
+        connection for each worker.  The CRD plugin adds the connections of
+        its informer watches.
+        """
+        per_worker = 2 + bool(self.LEASE_DURATION)
+        return self.WORKERS * per_worker + self.RESERVED_WORKERS
+
     @staticmethod
     def _get_names(csi_version, plugin_name):
         # In spec < 1.0 name must follow reverse domain name notation
@@ -192,6 +221,45 @@ class Config(object):
             LOG.error('grpc_workers must be a positive integer number')
             exit(constants.ERROR_WORKERS)
 
+        if (not isinstance(self.RESERVED_WORKERS, int) or
+                self.RESERVED_WORKERS < 0):
+            LOG.error('reserved_workers must be a non negative integer number')
+            exit(constants.ERROR_CONCURRENCY)
+
+        if (not isinstance(self.ADMISSION_QUEUE, int) or
+                self.ADMISSION_QUEUE < 0):
+            LOG.error('admission_queue must be a non negative integer number')
+            exit(constants.ERROR_CONCURRENCY)
+
+        if (not isinstance(self.CONCURRENCY_LIMITS, dict) or
+                not all(isinstance(v, int) and v > 0
+                        for v in self.CONCURRENCY_LIMITS.values())):
+            LOG.error('concurrency_limits must be a dictionary of positive '
+                      'integer numbers')
+            exit(constants.ERROR_CONCURRENCY)
+
+        # Durations in seconds, where 0 usually disables the feature
+        for option in ('wait_timeout', 'stats_ttl', 'lock_timeout',
+                       'lease_duration', 'admission_timeout',
+                       'node_info_ttl'):
+            value = getattr(self, option.upper())
+            if not self._is_number(value) or value < 0:
+                LOG.error('%s must be a non negative number' % option)
+                exit(constants.ERROR_NUMBER)
+
+        if (not isinstance(self.METRICS_PORT, six.integer_types) or
+                isinstance(self.METRICS_PORT, bool) or
+                not 0 <= self.METRICS_PORT <= 65535):
+            LOG.error('metrics_port must be a port number, or 0 to disable '
+                      'metrics')
+            exit(constants.ERROR_NUMBER)
+
+        if (self.TRACING_EXPORTER and not self.TRACING_EXPORTER.startswith(
+                ('file://', 'http://', 'https://'))):
+            LOG.error('Invalid tracing_exporter %s (valid schemes are file, '
+                      'http, and https)' % self.TRACING_EXPORTER)
+            exit(constants.ERROR_TRACING)
+
         # Accept spaces and a v prefix on CSI spec version
         spec_version = self.CSI_SPEC.strip()
         if spec_version.startswith('v'):
@@ -219,6 +287,12 @@ class Config(object):
         self._set_topology_config()
         self._create_default_dirs_files()
 
+    @staticmethod
+    def _is_number(value):
+        # JSON booleans are ints in Python
+        return (isinstance(value, six.integer_types + (float,)) and
+                not isinstance(value, bool))
+
     @staticmethod
     def _get_drivers_map():
         """Get mapping for drivers NiceName to PythonNamespace."""
@@ -28,6 +28,7 @@ ONE_DAY_IN_SECONDS = 60 * 60 * 24
 CINDER_VERSION = pkg_resources.get_distribution('cinder').version
 CINDERLIB_VERSION = pkg_resources.get_distribution('cinderlib').version
 REFRESH_TIME = 1
+MAX_REFRESH_TIME = 16
 VENDOR_VERSION = '0.9.1'
 MULTIPATH_FIND_RETRIES = 3
 
@@ -46,6 +47,11 @@ ERROR_TOPOLOGY_LIST = 10
 ERROR_PLUGIN_NAME = 11
 ERROR_JSON = 12
 ERROR_DEBUG_MODE = 13
+ERROR_TRACING = 14
+ERROR_GRPC_ASYNCIO = 15
+ERROR_CONCURRENCY = 16
+ERROR_WORKERS = 17
+ERROR_NUMBER = 18
 
 
 BACKEND_KEY_MAPPINGS = (('driver', 'volume_driver'),
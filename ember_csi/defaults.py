@@ -26,12 +26,36 @@ REQUEST_MULTIPATH = False
 WORKERS = 30
 ENABLE_PROBE = False
 HAS_SLOW_OPERATIONS = True
+WAIT_TIMEOUT = 60
+STATS_TTL = 30
+PRIVILEGED_DAEMON = False
+METRICS_PORT = 0
+TRACING_EXPORTER = ''
+LOCK_TIMEOUT = 0
+LEASE_DURATION = 0
+RESERVED_WORKERS = 4
+CONCURRENCY_LIMITS = {}
+ADMISSION_TIMEOUT = 0
+ADMISSION_QUEUE = 100
+NODE_INFO_TTL = 60
 EMBER_CFG = {'project_id': NAME, 'user_id': NAME, 'plugin_name': '',
              'root_helper': ROOT_HELPER,
              'request_multipath': REQUEST_MULTIPATH,
              'file_locks_path': LOCKS_DIR, 'state_path': STATE_PATH,
              'enable_probe': ENABLE_PROBE, 'grpc_workers': WORKERS,
-             'slow_operations': HAS_SLOW_OPERATIONS, 'disabled': tuple()}
+             'slow_operations': HAS_SLOW_OPERATIONS,
+             'wait_timeout': WAIT_TIMEOUT, 'stats_ttl': STATS_TTL,
+             'privileged_daemon': PRIVILEGED_DAEMON,
+             'metrics_port': METRICS_PORT,
+             'tracing_exporter': TRACING_EXPORTER,
+             'lock_timeout': LOCK_TIMEOUT,
+             'lease_duration': LEASE_DURATION,
+             'reserved_workers': RESERVED_WORKERS,
+             'concurrency_limits': CONCURRENCY_LIMITS,
+             'admission_timeout': ADMISSION_TIMEOUT,
+             'admission_queue': ADMISSION_QUEUE,
+             'node_info_ttl': NODE_INFO_TTL,
+             'disabled': tuple()}
 
 LOGGING_FORMAT = ('%(asctime)s %(project_name)s %(levelname)s %(name)s '
                   '[%(request_id)s] %(message)s')
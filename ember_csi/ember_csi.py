@@ -24,7 +24,9 @@ import threading
 import time
 
 import eventlet
-eventlet.monkey_patch()  # noqa
+# The asyncio gRPC server doesn't use eventlet
+if os.environ.get('X_CSI_GRPC_ASYNCIO', '').upper() != 'TRUE':
+    eventlet.monkey_patch()  # noqa
 
 import grpc
 from oslo_log import log as logging
@@ -32,6 +34,8 @@ from oslo_log import log as logging
 from ember_csi import common
 from ember_csi import config
 from ember_csi import constants
+from ember_csi import metrics
+from ember_csi import tracing
 from ember_csi import workarounds
 
 
@@ -63,13 +67,29 @@ def main():
     else:
         options = None
 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=CONF.WORKERS),
-                         options=options)
+    # Reserve threads for calls that bypass admission control, like Probe
+    workers = CONF.WORKERS + CONF.RESERVED_WORKERS
+    if CONF.GRPC_ASYNCIO:
+        try:
+            from ember_csi import aio
+        except (ImportError, SyntaxError, AttributeError) as exc:
+            LOG.error('Cannot use the asyncio gRPC server: %s' % exc)
+            exit(constants.ERROR_GRPC_ASYNCIO)
+        LOG.warning('The asyncio gRPC server is experimental')
+        server = aio.Server(workers, options=options)
 
-    signal.signal(signal.SIGTERM, shutdown_handler)
-    signal.signal(signal.SIGINT, shutdown_handler)
+    else:
+        # Calls queued by admission control wait on their own threads
+        server = grpc.server(
+            futures.ThreadPoolExecutor(
+                max_workers=workers + CONF.ADMISSION_QUEUE),
+            options=options)
+
+        signal.signal(signal.SIGTERM, shutdown_handler)
+        signal.signal(signal.SIGINT, shutdown_handler)
+
+        workarounds.grpc_eventlet(server)
 
-    workarounds.grpc_eventlet(server)
     node_id = CONF.NAME + '.' + CONF.NODE_ID
     csi_plugin = server_class(server=server,
                               persistence_config=CONF.PERSISTENCE_CONFIG,
@@ -84,6 +104,18 @@ def main():
         LOG.error('ERROR: Could not bind to %s' % CONF.ENDPOINT)
         exit(constants.ERROR_BIND_PORT)
 
+    if CONF.METRICS_PORT:
+        metrics.start_server(CONF.METRICS_PORT)
+
+    if CONF.TRACING_EXPORTER:
+        tracing.setup(CONF.TRACING_EXPORTER)
+
+    if CONF.GRPC_ASYNCIO:
+        LOG.info('Now serving on %s using asyncio...' % CONF.ENDPOINT)
+        server.run(60 * GRACEFUL_TIMEOUT)
+        stop_persistence(csi_plugin)
+        return
+
     server.start()
     LOG.info('Now serving on %s...' % CONF.ENDPOINT)
 
@@ -91,6 +123,7 @@ def main():
     SHUTDOWN_EVENT.wait()
 
     stop_server(server)
+    stop_persistence(csi_plugin)
 
 
 def shutdown_handler(signum, stack):
@@ -118,6 +151,13 @@ def stop_server(server):
     threading.Thread(target=force_stop).start()
 
 
+def stop_persistence(csi_plugin):
+    # Only some persistence plugins, like the CRD one, have things to stop
+    stop = getattr(csi_plugin.persistence, 'stop', None)
+    if stop:
+        stop()
+
+
 def _get_csi_server_class(class_name):
     module_name = 'ember_csi.v%s.csi' % CONF.CSI_SPEC.replace('.', '_')
     module = importlib.import_module(module_name)
@@ -148,8 +188,8 @@ def _log_used_parameters(csi_plugin):
     LOG.info('Debugging feature is %s.' % debug_msg)
     LOG.info('Supported filesystems: %s' % (
         ', '.join(CONF.SUPPORTED_FS_TYPES)))
-    if getattr(csi_plugin, 'TOPOLOGY_HIERA', None):
-        LOG.debug('Topologies: %s.' % csi_plugin.TOPOLOGY_HIERA)
+    if getattr(csi_plugin, 'TOPOLOGY_INDEX', None):
+        LOG.debug('Topologies: %s.' % csi_plugin.TOPOLOGY_INDEX)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,561 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Fake Kubernetes API server for the CRD persistence plugin.
+
+Serves, over HTTP and without authentication, the subset of the Kubernetes
+API used by the CRD plugin: list, watch, get, create, replace, merge patch,
+and delete of custom resource definitions and custom objects, with
+resourceVersions, label selectors, pagination, and delete preconditions.
+Objects are kept in memory.
+
+It allows exercising the CRD plugin without a Kubernetes cluster, and it can
+add latency to every request and reject a fraction of the writes to existing
+objects with a 409 Conflict, as if they had been changed concurrently.
+
+The plugin can start one in-process using the `fake_api` key of the
+persistence configuration::
+
+    {"storage": "crd", "fake_api": {"latency": 0.005, "conflict_rate": 0.01}}
+
+Or we can run a standalone server, to share it between processes, and tell
+the plugin to use it with the `api_host` key::
+
+    $ python -m ember_csi.fake_k8s --port 8001 --latency 0.005
+
+    {"storage": "crd", "api_host": "http://127.0.0.1:8001"}
+
+Some simplifications compared to Kubernetes: resourceVersions are global and
+sequential, continue tokens don't list from a consistent snapshot, CRDs don't
+need to exist to use their objects, and watches only send events for objects
+that match the label selector after the change.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import base64
+import bisect
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from oslo_log import log as logging
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_HISTORY = 10000
+DEFAULT_WATCH_TIMEOUT = 1800
+SET_REQUIREMENT = re.compile(r'^(\S+)\s+(in|notin)\s*\((.*)\)$')
+
+
+class ApiError(Exception):
+    """Error returned to the client as a Kubernetes Status."""
+    def __init__(self, code, reason, message):
+        super(ApiError, self).__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+    def to_dict(self):
+        return {'kind': 'Status', 'apiVersion': 'v1', 'metadata': {},
+                'status': 'Failure', 'message': self.message,
+                'reason': self.reason, 'code': self.code}
+
+
+def not_found(collection, name):
+    return ApiError(404, 'NotFound', '%s "%s" not found' %
+                    (_plural(collection), name))
+
+
+def conflict(collection, name):
+    return ApiError(409, 'Conflict',
+                    'Operation cannot be fulfilled on %s "%s": the object has '
+                    'been modified; please apply your changes to the latest '
+                    'version and try again' % (_plural(collection), name))
+
+
+def _plural(collection):
+    return collection.rsplit('/', 1)[-1]
+
+
+def parse_path(path):
+    """Return the collection, namespace, and object name of a URL path.
+
+    Paths are /apis/<group>/<version>[/namespaces/<namespace>]/<plural> for
+    collections, followed by /<name> for objects.
+    """
+    parts = path.strip('/').split('/')
+    if len(parts) < 4 or parts[0] != 'apis':
+        raise ApiError(404, 'NotFound', 'the server could not find the '
+                       'requested resource')
+    namespaced = parts[3] == 'namespaces'
+    size = 6 if namespaced else 4
+    if len(parts) not in (size, size + 1):
+        raise ApiError(404, 'NotFound', 'the server could not find the '
+                       'requested resource')
+    collection = '/' + '/'.join(parts[:size])
+    namespace = parts[4] if namespaced else None
+    name = parts[size] if len(parts) > size else None
+    return collection, namespace, name
+
+
+def parse_selector(selector):
+    """Parse a label selector into a list of (key, operator, values).
+
+    Supports the equality (=, ==, !=), set (in, notin), and existence (key,
+    !key) requirements.
+    """
+    requirements = []
+    for term in re.findall(r'(?:[^,(]|\([^)]*\))+', selector or ''):
+        term = term.strip()
+        match = SET_REQUIREMENT.match(term)
+        if match:
+            key, operator, values = match.groups()
+            values = set(value.strip() for value in values.split(','))
+        elif term.startswith('!'):
+            key, operator, values = term[1:], 'notexists', None
+        elif '!=' in term:
+            key, value = term.split('!=', 1)
+            operator, values = 'notin', {value.strip()}
+        elif '=' in term:
+            key, value = term.split('=', 1)
+            operator, values = 'in', {value.lstrip('=').strip()}
+        else:
+            key, operator, values = term, 'exists', None
+
+        key = key.strip()
+        if not key:
+            raise ApiError(400, 'BadRequest',
+                           'unable to parse requirement: %s' % term)
+        requirements.append((key, operator, values))
+    return requirements
+
+
+def matches(requirements, obj):
+    labels = obj['metadata'].get('labels') or {}
+    for key, operator, values in requirements:
+        if operator == 'exists':
+            match = key in labels
+        elif operator == 'notexists':
+            match = key not in labels
+        elif operator == 'in':
+            match = labels.get(key) in values
+        else:
+            match = labels.get(key) not in values
+        if not match:
+            return False
+    return True
+
+
+def merge_patch(target, patch):
+    """Apply a JSON merge patch (RFC 7386) without changing the target."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+class Store(object):
+    """In-memory objects and the history of changes for the watches.
+
+    Every change gets the next resourceVersion and is recorded in the history,
+    which keeps the last `history` changes, so watches from an older
+    resourceVersion get a 410 Gone like on Kubernetes when etcd compacts.
+
+    Stored objects are never modified, changes replace them, so they can be
+    serialized without holding the lock.
+    """
+    def __init__(self, conflict_rate=0, history=DEFAULT_HISTORY):
+        self.conflict_rate = conflict_rate
+        self.history = history
+        self.changed = threading.Condition()
+        self.version = 0
+        # Collection -> name -> object
+        self.items = collections.defaultdict(dict)
+        # Collection -> sorted object names, for pagination
+        self.names = collections.defaultdict(list)
+        # (resourceVersion, collection, event type, object) of each change
+        self.events = []
+        self.first_version = 1
+
+    def _get(self, collection, name):
+        obj = self.items[collection].get(name)
+        if obj is None:
+            raise not_found(collection, name)
+        return obj
+
+    def _check_conflict(self, collection, name, obj, version=None):
+        if ((version and version != obj['metadata']['resourceVersion']) or
+                (self.conflict_rate and
+                 random.random() < self.conflict_rate)):
+            raise conflict(collection, name)
+
+    def _commit(self, collection, name, event_type, obj):
+        """Store a change with a new resourceVersion and notify watchers."""
+        self.version += 1
+        obj = dict(obj, metadata=dict(obj['metadata'],
+                                      resourceVersion=str(self.version)))
+        items = self.items[collection]
+        names = self.names[collection]
+        if event_type == 'DELETED':
+            del items[name]
+            del names[bisect.bisect_left(names, name)]
+        else:
+            if name not in items:
+                bisect.insort(names, name)
+            items[name] = obj
+
+        self.events.append((self.version, collection, event_type, obj))
+        # Trim the history in bulk, not on every change
+        excess = len(self.events) - self.history
+        if excess > self.history // 10:
+            del self.events[:excess]
+            self.first_version += excess
+        self.changed.notify_all()
+        return obj
+
+    def get(self, collection, name):
+        with self.changed:
+            return self._get(collection, name)
+
+    def list(self, collection, selector=None, limit=None, token=None):
+        """List objects sorted by name, paginated with continue tokens."""
+        requirements = parse_selector(selector)
+        start = None
+        if token:
+            try:
+                start = json.loads(
+                    base64.urlsafe_b64decode(token.encode('utf-8'))
+                    .decode('utf-8'))['start']
+            except (ValueError, TypeError, KeyError):
+                raise ApiError(400, 'BadRequest',
+                               'continue key is not valid: %s' % token)
+
+        result = []
+        token = None
+        with self.changed:
+            items = self.items[collection]
+            names = self.names[collection]
+            first = bisect.bisect_right(names, start) if start else 0
+            for i in range(first, len(names)):
+                obj = items[names[i]]
+                if not matches(requirements, obj):
+                    continue
+                if limit and len(result) == limit:
+                    last = result[-1]['metadata']['name']
+                    token = base64.urlsafe_b64encode(
+                        json.dumps({'start': last}).encode('utf-8'))
+                    token = token.decode('utf-8')
+                    break
+                result.append(obj)
+            version = str(self.version)
+
+        metadata = {'resourceVersion': version}
+        if token:
+            metadata['continue'] = token
+        return {'kind': 'List', 'apiVersion': 'v1', 'metadata': metadata,
+                'items': result}
+
+    def create(self, collection, namespace, obj):
+        metadata = obj.get('metadata') or {}
+        name = metadata.get('name')
+        if not name:
+            raise ApiError(422, 'Invalid', 'metadata.name: Required value')
+
+        metadata = dict(metadata, uid=str(uuid.uuid4()),
+                        creationTimestamp=time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                        time.gmtime()))
+        if namespace:
+            metadata['namespace'] = namespace
+        with self.changed:
+            if name in self.items[collection]:
+                raise ApiError(409, 'AlreadyExists', '%s "%s" already exists'
+                               % (_plural(collection), name))
+            return self._commit(collection, name, 'ADDED',
+                                dict(obj, metadata=metadata))
+
+    def replace(self, collection, name, obj):
+        metadata = obj.get('metadata') or {}
+        with self.changed:
+            current = self._get(collection, name)
+            self._check_conflict(collection, name, current,
+                                 metadata.get('resourceVersion'))
+            # Fields set by the server can't be changed
+            metadata = dict(metadata, name=name)
+            for key in ('namespace', 'uid', 'creationTimestamp'):
+                if key in current['metadata']:
+                    metadata[key] = current['metadata'][key]
+            return self._commit(collection, name, 'MODIFIED',
+                                dict(obj, metadata=metadata))
+
+    def patch(self, collection, name, patch):
+        if not isinstance(patch, dict):
+            raise ApiError(415, 'UnsupportedMediaType',
+                           'only JSON merge patches are supported')
+        version = (patch.get('metadata') or {}).get('resourceVersion')
+        with self.changed:
+            current = self._get(collection, name)
+            self._check_conflict(collection, name, current, version)
+            obj = merge_patch(current, patch)
+            obj['metadata'] = dict(obj['metadata'],
+                                   name=name,
+                                   uid=current['metadata']['uid'])
+            return self._commit(collection, name, 'MODIFIED', obj)
+
+    def delete(self, collection, name, preconditions=None):
+        preconditions = preconditions or {}
+        with self.changed:
+            current = self._get(collection, name)
+            self._check_conflict(collection, name, current,
+                                 preconditions.get('resourceVersion'))
+            uid = preconditions.get('uid')
+            if uid and uid != current['metadata']['uid']:
+                raise conflict(collection, name)
+            return self._commit(collection, name, 'DELETED', current)
+
+    def watch(self, collection, selector=None, version=None,
+              timeout=DEFAULT_WATCH_TIMEOUT):
+        """Return a generator of the events of the collection's objects.
+
+        Without a resourceVersion we first get an ADDED event for each one of
+        the existing objects.  Raises a 410 Gone error if the resourceVersion
+        is older than our history.
+        """
+        requirements = parse_selector(selector)
+        with self.changed:
+            if version and version != '0':
+                try:
+                    version = int(version)
+                except ValueError:
+                    raise ApiError(400, 'BadRequest',
+                                   'invalid resource version: %s' % version)
+                if version + 1 < self.first_version:
+                    raise self._expired(version)
+                initial = []
+            else:
+                version = self.version
+                initial = [obj for obj in self.items[collection].values()
+                           if matches(requirements, obj)]
+        return self._events(collection, requirements, version, initial,
+                            time.time() + timeout)
+
+    def _expired(self, version):
+        return ApiError(410, 'Expired', 'too old resource version: %s (%s)' %
+                        (version, self.first_version - 1))
+
+    def _events(self, collection, requirements, version, initial, deadline):
+        for obj in initial:
+            yield 'ADDED', obj
+
+        while True:
+            with self.changed:
+                start = version + 1 - self.first_version
+                while start >= len(self.events):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self.changed.wait(remaining)
+                    start = version + 1 - self.first_version
+                events = self.events[start:] if start >= 0 else None
+
+            # We fell behind and the history was trimmed
+            if events is None:
+                yield 'ERROR', self._expired(version).to_dict()
+                return
+
+            for version, event_collection, event_type, obj in events:
+                if (event_collection == collection and
+                        matches(requirements, obj)):
+                    yield event_type, obj
+
+
+class ApiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections open, like the Kubernetes API does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else None
+        if not data:
+            return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError as exc:
+            raise ApiError(400, 'BadRequest', 'invalid JSON body: %s' % exc)
+
+    def _handle(self, method):
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        store = self.server.store
+        watch = query.get('watch') in ('true', '1')
+        code = 200
+        try:
+            body = self._read_body()
+            collection, namespace, name = parse_path(url.path)
+            if self.server.latency and not watch:
+                time.sleep(self.server.latency)
+
+            if method == 'GET' and name:
+                result = store.get(collection, name)
+            elif method == 'GET' and watch:
+                events = store.watch(collection,
+                                     query.get('labelSelector'),
+                                     query.get('resourceVersion'),
+                                     int(query.get('timeoutSeconds') or
+                                         DEFAULT_WATCH_TIMEOUT))
+                self._stream(events)
+                return
+            elif method == 'GET':
+                result = store.list(collection, query.get('labelSelector'),
+                                    int(query.get('limit') or 0),
+                                    query.get('continue'))
+            elif method == 'POST' and not name:
+                result = store.create(collection, namespace, body or {})
+                code = 201
+            elif method == 'PUT' and name:
+                result = store.replace(collection, name, body or {})
+            elif method == 'PATCH' and name:
+                result = store.patch(collection, name, body or {})
+            elif method == 'DELETE' and name:
+                result = store.delete(collection, name,
+                                      (body or {}).get('preconditions'))
+            else:
+                raise ApiError(405, 'MethodNotAllowed',
+                               'the server does not allow this method on the '
+                               'requested resource')
+        except ApiError as exc:
+            code, result = exc.code, exc.to_dict()
+        self._send(code, result)
+
+    def _send(self, code, result):
+        data = json.dumps(result).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(('%x\r\n' % len(data)).encode('utf-8') + data +
+                         b'\r\n')
+
+    def _stream(self, events):
+        """Send watch events as JSON lines in a chunked response."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event_type, obj in events:
+            event = {'type': event_type, 'object': obj}
+            self._write_chunk(json.dumps(event).encode('utf-8') + b'\n')
+        self._write_chunk(b'')
+
+    def log_message(self, format, *args):
+        LOG.debug('Fake Kubernetes API request: ' + format, *args)
+
+
+class FakeApiServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded fake Kubernetes API server.
+
+    :param latency: Seconds added to every request except watches.
+    :param conflict_rate: Fraction, from 0 to 1, of the replaces, patches, and
+                          deletes of existing objects that fail with a 409.
+    :param history: Number of changes that can be watched.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address='127.0.0.1', port=0, latency=0,
+                 conflict_rate=0, history=DEFAULT_HISTORY):
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port), ApiHandler)
+        self.latency = latency
+        self.store = Store(conflict_rate, history)
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def handle_error(self, request, client_address):
+        # Clients closing watches and idle connections are expected
+        LOG.debug('Fake Kubernetes API connection from %s closed with error',
+                  client_address, exc_info=True)
+
+    def start(self):
+        """Serve the API on a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        LOG.info('Serving fake Kubernetes API on %s' % self.url)
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m ember_csi.fake_k8s',
+        description='Fake Kubernetes API server for the CRD persistence '
+                    'plugin.')
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8001,
+                        help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to every request (default: '
+                             '%(default)s)')
+    parser.add_argument('--conflict-rate', type=float, default=0,
+                        help='Fraction of writes to existing objects that '
+                             'fail with a conflict (default: %(default)s)')
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY,
+                        help='Number of changes that can be watched '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    server = FakeApiServer(args.address, args.port, args.latency,
+                           args.conflict_rate, args.history)
+    print('Serving fake Kubernetes API on %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Prometheus metrics.
+
+Minimal implementation of counters, gauges, and histograms with labels that
+are served in the Prometheus text format on the port configured with the
+`metrics_port` key of X_CSI_EMBER_CONFIG.
+
+We don't use the prometheus_client library to reduce dependencies, like we do
+with rpdb.
+"""
+from __future__ import absolute_import
+import bisect
+import contextlib
+import functools
+import os
+import threading
+import time
+
+from oslo_concurrency import processutils as putils
+from oslo_log import log as logging
+from six.moves import BaseHTTPServer
+
+
+LOG = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, float('inf'))
+REGISTRY = []
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _key(labels):
+    # Keys must be sortable, so we can't mix types
+    return tuple(str(label) for label in labels)
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _labels(self, labels, extra=None):
+        pairs = list(zip(self.labelnames, labels))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                                 for k, v in pairs)
+
+    def _samples(self):
+        with self.lock:
+            return [(labels, self.values[labels])
+                    for labels in sorted(self.values)]
+
+    def collect(self):
+        result = ['# HELP %s %s' % (self.name, self.documentation),
+                  '# TYPE %s %s' % (self.name, self.TYPE)]
+        for labels, value in self._samples():
+            result.append('%s%s %s' % (self.name, self._labels(labels),
+                                       _format_value(value)))
+        return result
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, *labels):
+        labels = _key(labels)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+    function = None
+
+    def set_function(self, function):
+        """Get the values from a function when collected.
+
+        The function returns a dictionary of label values to values.
+        """
+        self.function = function
+
+    def _samples(self):
+        if self.function is None:
+            return super(Gauge, self)._samples()
+        values = {_key(labels): value
+                  for labels, value in self.function().items()}
+        return sorted(values.items())
+
+    def add(self, amount, *labels):
+        labels = _key(labels)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def inc(self, *labels):
+        self.add(1, *labels)
+
+    def dec(self, *labels):
+        self.add(-1, *labels)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        labels = _key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if not data:
+                data = self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, *labels)
+
+    def _samples(self):
+        with self.lock:
+            return [(labels, (list(self.values[labels][0]),
+                              self.values[labels][1],
+                              self.values[labels][2]))
+                    for labels in sorted(self.values)]
+
+    def collect(self):
+        result = ['# HELP %s %s' % (self.name, self.documentation),
+                  '# TYPE %s %s' % (self.name, self.TYPE)]
+        for labels, (buckets, total, count) in self._samples():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                result.append('%s_bucket%s %s' % (
+                    self.name,
+                    self._labels(labels, ('le', _format_value(bound))),
+                    cumulative))
+            label_str = self._labels(labels)
+            result.append('%s_sum%s %s' % (self.name, label_str,
+                                           _format_value(total)))
+            result.append('%s_count%s %s' % (self.name, label_str, count))
+        return result
+
+
+RPC_LATENCY = Histogram('ember_csi_rpc_duration_seconds',
+                        'Duration of gRPC calls.', ('method', 'code'))
+RPC_IN_FLIGHT = Gauge('ember_csi_rpc_in_flight',
+                      'Number of gRPC calls being served.', ('method',))
+WORKER_LOCKS = Gauge('ember_csi_worker_locks',
+                     'Number of resources locked by calls.', ('method',))
+WORKER_LOCK_WAITERS = Gauge('ember_csi_worker_lock_waiters',
+                            'Number of calls waiting for a resource lock.',
+                            ('method',))
+PERSISTENCE_LATENCY = Histogram('ember_csi_persistence_duration_seconds',
+                                'Duration of persistence plugin calls.',
+                                ('operation',))
+COMMAND_LATENCY = Histogram('ember_csi_privileged_command_duration_seconds',
+                            'Duration of privileged commands.', ('command',))
+COMMAND_FAILURES = Counter('ember_csi_privileged_command_failures_total',
+                           'Number of failed privileged commands.',
+                           ('command', 'exit_code'))
+WORKER_ABORTS = Counter('ember_csi_duplicate_call_aborts_total',
+                        'Number of calls aborted because another call was '
+                        'running for the same resource.', ('method',))
+ADMISSION_REJECTIONS = Counter('ember_csi_admission_rejections_total',
+                               'Number of calls rejected because there were '
+                               'too many concurrent calls.', ('method',))
+
+
+def timed(histogram):
+    """Decorator to measure a method's duration using its name as label."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with histogram.time(f.__name__):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def track_command(command):
+    command = os.path.basename(command)
+    try:
+        with COMMAND_LATENCY.time(command):
+            yield
+    except putils.ProcessExecutionError as exc:
+        COMMAND_FAILURES.inc(command, exc.exit_code)
+        raise
+    except Exception:
+        COMMAND_FAILURES.inc(command, 'error')
+        raise
+
+
+def collect():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = collect().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOG.debug('Metrics request: ' + format, *args)
+
+
+def start_server(port, address=''):
+    """Serve the metrics on a background thread."""
+    server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    LOG.info('Serving metrics on port %s' % port)
+    return server
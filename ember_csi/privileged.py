@@ -0,0 +1,286 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Privileged operations run on a long lived oslo.privsep daemon.
+
+When the `privileged_daemon` option is enabled in X_CSI_EMBER_CONFIG the node
+doesn't run sudo for each privileged command.  Instead an oslo.privsep daemon
+is started with the root helper the first time it's needed, and we talk to it
+over a Unix socket.  This is the same mechanism OS-Brick already uses.
+
+Mounts, bind mounts, unmounts, and syncs are done by the daemon using system
+calls.  The only commands it runs are lsblk, mkfs, and the filesystem resize
+tools, each one through its own entrypoint that builds the command from
+validated arguments, so the daemon can't be used to run arbitrary commands.
+
+Errors are reported as ProcessExecutionError exceptions with the exit codes
+the mount and umount commands would return, so callers don't need to know
+which mechanism was used.
+
+The daemon imports this module, so it must not import other Ember-CSI modules
+that read the configuration or initialize cinderlib, only defaults.
+"""
+from __future__ import absolute_import
+import ctypes
+import ctypes.util
+import os
+import re
+import shlex
+
+from oslo_concurrency import processutils as putils
+from oslo_privsep import capabilities
+from oslo_privsep import priv_context
+
+from ember_csi import defaults
+
+
+default = priv_context.PrivContext(
+    'ember_csi',
+    cfg_section='ember_csi_privileged',
+    pypath=__name__ + '.default',
+    capabilities=[capabilities.CAP_SYS_ADMIN,
+                  capabilities.CAP_DAC_OVERRIDE,
+                  capabilities.CAP_DAC_READ_SEARCH,
+                  capabilities.CAP_CHOWN,
+                  capabilities.CAP_FOWNER],
+)
+
+# Exit code used by mount and umount commands on mount failures
+MOUNT_FAILURE = 32
+
+# From linux/mount.h
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOEXEC = 8
+MS_SYNCHRONOUS = 16
+MS_REMOUNT = 32
+MS_DIRSYNC = 128
+MS_NOATIME = 1024
+MS_NODIRATIME = 2048
+MS_BIND = 4096
+MS_RELATIME = 1 << 21
+MS_STRICTATIME = 1 << 24
+MS_LAZYTIME = 1 << 25
+
+# Options that are mount flags instead of filesystem specific data.  Options
+# that clear a flag are the default, so they have no flag value.
+MOUNT_OPTIONS = {'defaults': 0, 'rw': 0, 'suid': 0, 'dev': 0, 'exec': 0,
+                 'async': 0, 'atime': 0, 'diratime': 0,
+                 'ro': MS_RDONLY, 'nosuid': MS_NOSUID, 'nodev': MS_NODEV,
+                 'noexec': MS_NOEXEC, 'sync': MS_SYNCHRONOUS,
+                 'dirsync': MS_DIRSYNC, 'noatime': MS_NOATIME,
+                 'nodiratime': MS_NODIRATIME, 'relatime': MS_RELATIME,
+                 'strictatime': MS_STRICTATIME, 'lazytime': MS_LAZYTIME,
+                 'bind': MS_BIND, 'norelatime': 0, 'nostrictatime': 0,
+                 'nolazytime': 0}
+
+# Options the mount command uses itself and doesn't pass to the kernel
+USERSPACE_OPTIONS = frozenset(('_netdev', 'nofail', 'auto', 'noauto', 'user',
+                               'nouser', 'users', 'owner', 'noowner', 'group',
+                               'nogroup', 'loop'))
+USERSPACE_PREFIXES = ('x-', 'X-', 'comment=', 'helper=', 'uhelper=')
+
+FS_TYPE = re.compile(r'^[a-z0-9]+$')
+EXT_FS = ('ext2', 'ext3', 'ext4')
+
+_LIBC = None
+
+
+def _libc():
+    global _LIBC
+    if _LIBC is None:
+        _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _LIBC
+
+
+def _encode(value):
+    return value.encode('utf-8') if value is not None else None
+
+
+def _syscall_errno(result):
+    """Return the errno of a failed libc call or 0 if it succeeded."""
+    return ctypes.get_errno() if result != 0 else 0
+
+
+def _parse_options(options):
+    """Split mount options into mount flags and filesystem specific data.
+
+    Like the mount command, options only meaningful to it are ignored.
+    """
+    flags = 0
+    data = []
+    for option in options or []:
+        if option in MOUNT_OPTIONS:
+            flags |= MOUNT_OPTIONS[option]
+        elif (option in USERSPACE_OPTIONS or
+                option.startswith(USERSPACE_PREFIXES)):
+            continue
+        else:
+            data.append(option)
+    return flags, ','.join(data) or None
+
+
+def _check_path(path):
+    if not path or not os.path.isabs(path):
+        raise ValueError('Invalid path %s' % path)
+
+
+def mkfs_command(fs_type, options, device):
+    """Return the command to create a filesystem, validating its arguments."""
+    if not FS_TYPE.match(fs_type or ''):
+        raise ValueError('Invalid filesystem %s' % fs_type)
+    if not all(option.startswith('-') for option in options):
+        raise ValueError('Invalid mkfs options %s' % ' '.join(options))
+    _check_path(device)
+    return [defaults.MKFS + fs_type] + list(options) + [device]
+
+
+def resize_command(fs_type, device, target):
+    """Return the command to grow a mounted filesystem, None if unsupported.
+
+    Ext filesystems are resized using the device, and the rest using the
+    mount point.
+    """
+    if fs_type in EXT_FS:
+        _check_path(device)
+        return ['resize2fs', '-f', '-F', device]
+
+    _check_path(target)
+    if fs_type == 'btrfs':
+        return ['btrfs', 'filesystem', 'resize', 'max', target]
+    if fs_type == 'xfs':
+        return ['xfs_growfs', '-d', target]
+    return None
+
+
+def _run(*cmd):
+    try:
+        stdout, stderr = putils.execute(*cmd)
+    except putils.ProcessExecutionError as exc:
+        return exc.exit_code, exc.stdout, exc.stderr
+    return 0, stdout, stderr
+
+
+@default.entrypoint
+def _lsblk_fs_type(device):
+    _check_path(device)
+    return _run('lsblk', '-nlfoFSTYPE', device)
+
+
+@default.entrypoint
+def _mkfs(fs_type, options, device):
+    return _run(*mkfs_command(fs_type, options, device))
+
+
+@default.entrypoint
+def _resize_fs(fs_type, device, target):
+    cmd = resize_command(fs_type, device, target)
+    if not cmd:
+        raise ValueError("Don't know how to extend %s filesystem" % fs_type)
+    return _run(*cmd)
+
+
+@default.entrypoint
+def _mount(source, target, fs_type, flags, data):
+    libc = _libc()
+    res = libc.mount(_encode(source), _encode(target), _encode(fs_type),
+                     flags, _encode(data))
+    error = _syscall_errno(res)
+
+    # Read-only bind mounts require a remount
+    if not error and flags & MS_BIND and flags & MS_RDONLY:
+        res = libc.mount(None, _encode(target), None,
+                         MS_REMOUNT | MS_BIND | MS_RDONLY, None)
+        error = _syscall_errno(res)
+        if error:
+            libc.umount2(_encode(target), 0)
+    return error
+
+
+@default.entrypoint
+def _umount(target):
+    return _syscall_errno(_libc().umount2(_encode(target), 0))
+
+
+@default.entrypoint
+def _sync(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        return exc.errno
+    return 0
+
+
+def init(root_helper):
+    """Set the root helper used to start the daemon."""
+    priv_context.init(root_helper=shlex.split(root_helper))
+
+
+def _check(error, cmd):
+    if error:
+        raise putils.ProcessExecutionError(stderr=os.strerror(error),
+                                           exit_code=MOUNT_FAILURE,
+                                           cmd=' '.join(cmd))
+
+
+def _result(result, cmd):
+    """Return stdout and stderr of a command run by the daemon."""
+    exit_code, stdout, stderr = result
+    if exit_code:
+        raise putils.ProcessExecutionError(stdout=stdout, stderr=stderr,
+                                           exit_code=exit_code,
+                                           cmd=' '.join(cmd))
+    return stdout, stderr
+
+
+def lsblk_fs_type(device):
+    """Return the output of lsblk listing the filesystems of a device."""
+    return _result(_lsblk_fs_type(device),
+                   ('lsblk', '-nlfoFSTYPE', device))
+
+
+def mkfs(fs_type, options, device):
+    cmd = mkfs_command(fs_type, options, device)
+    return _result(_mkfs(fs_type, list(options), device), cmd)
+
+
+def resize_fs(fs_type, device, target):
+    cmd = resize_command(fs_type, device, target)
+    return _result(_resize_fs(fs_type, device, target), cmd or [fs_type])
+
+
+def mount(fs_type, options, source, target):
+    """Mount a filesystem, options is a list like the ones for mount -o."""
+    flags, data = _parse_options(options)
+    _check(_mount(source, target, fs_type, flags, data),
+           ('mount', '-t', fs_type, source, target))
+
+
+def bind_mount(source, target, read_only=False):
+    flags = MS_BIND | (MS_RDONLY if read_only else 0)
+    _check(_mount(source, target, None, flags, None),
+           ('mount', '--bind', source, target))
+
+
+def umount(target):
+    _check(_umount(target), ('umount', target))
+
+
+def sync(path):
+    _check(_sync(path), ('sync', path))
@@ -0,0 +1,294 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Distributed tracing.
+
+Minimal OpenTelemetry compatible tracing, enabled with the `tracing_exporter`
+key of X_CSI_EMBER_CONFIG, which accepts:
+
+- file:///path/to/file: Writes spans as JSON lines to the file.
+- http://host:4318/v1/traces: Sends spans to an OTLP/HTTP collector using
+  JSON encoding.
+
+Each gRPC call creates a root span, continuing the trace from the incoming
+W3C `traceparent` metadata if present, and persistence, driver, OS-Brick, and
+privileged command calls create children spans.
+
+When tracing is disabled spans are not created at all.
+"""
+from __future__ import absolute_import
+import binascii
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from oslo_log import log as logging
+from six.moves import queue
+from six.moves.urllib import parse
+from six.moves.urllib import request as urllib_request
+
+
+LOG = logging.getLogger(__name__)
+
+SERVICE_NAME = 'ember-csi'
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACEPARENT = 'traceparent'
+TRACEPARENT_REGEX = re.compile(
+    r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+EXPORTER = None
+_LOCAL = threading.local()
+
+
+def _random_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        value = {'boolValue': value}
+    elif isinstance(value, int):
+        value = {'intValue': str(value)}
+    else:
+        value = {'stringValue': str(value)}
+    return {'key': key, 'value': value}
+
+
+class Span(object):
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'kind', 'start',
+                 'end', 'attributes', 'status', 'message')
+
+    def __init__(self, name, trace_id, parent_id, kind, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = STATUS_OK
+        self.message = ''
+        self.start = time.time()
+        self.end = None
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.message = message
+
+    def finish(self):
+        self.end = time.time()
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(int(self.start * 1e9)),
+            'endTimeUnixNano': str(int(self.end * 1e9)),
+            'attributes': [_attribute(k, v)
+                           for k, v in sorted(self.attributes.items())],
+            'status': {'code': self.status, 'message': self.message},
+        }
+
+
+class FileExporter(object):
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a')
+
+    def export(self, span):
+        data = json.dumps(span.to_dict())
+        with self.lock:
+            self.file.write(data + '\n')
+            self.file.flush()
+
+
+class OTLPExporter(object):
+    """Send spans in batches to an OTLP/HTTP collector."""
+    BATCH_SIZE = 512
+    INTERVAL = 5
+    TIMEOUT = 10
+    MAX_QUEUED = 8192
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.queue = queue.Queue(self.MAX_QUEUED)
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def export(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            LOG.warning('Tracing queue is full, dropping span %s', span.name)
+
+    def _get_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.time() + self.INTERVAL
+        while len(batch) < self.BATCH_SIZE:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        data = {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name',
+                                                   SERVICE_NAME)]},
+            'scopeSpans': [{'scope': {'name': 'ember_csi'},
+                            'spans': [span.to_dict() for span in batch]}],
+        }]}
+        req = urllib_request.Request(
+            self.endpoint, data=json.dumps(data).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        urllib_request.urlopen(req, timeout=self.TIMEOUT).close()
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            try:
+                self._send(batch)
+            except Exception as exc:
+                LOG.warning('Error sending %s spans to %s: %s',
+                            len(batch), self.endpoint, exc)
+
+
+def setup(exporter_url):
+    global EXPORTER
+    url = parse.urlparse(exporter_url)
+    if url.scheme == 'file':
+        EXPORTER = FileExporter(url.path)
+    elif url.scheme in ('http', 'https'):
+        EXPORTER = OTLPExporter(exporter_url)
+    else:
+        raise ValueError('Unsupported tracing exporter %s' % exporter_url)
+    LOG.info('Tracing to %s' % exporter_url)
+
+
+def current_span():
+    return getattr(_LOCAL, 'span', None)
+
+
+def set_attribute(key, value):
+    """Set an attribute on the current span, if there's one."""
+    current = current_span()
+    if current:
+        current.attributes[key] = value
+
+
+def in_current_span(f):
+    """Wrap a function to run in another thread as part of the current span.
+
+    Spans created by the function will be children of the current one, which
+    must not finish before the function does.
+    """
+    parent = current_span()
+    if not parent:
+        return f
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        _LOCAL.span = parent
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _LOCAL.span = None
+    return wrapper
+
+
+def parent_from_metadata(metadata):
+    """Return trace and span ids from gRPC metadata's traceparent."""
+    for key, value in metadata or ():
+        if key == TRACEPARENT:
+            match = TRACEPARENT_REGEX.match(value)
+            if match:
+                return match.groups()
+    return None
+
+
+@contextlib.contextmanager
+def span(name, attributes=None, parent=None, kind=INTERNAL):
+    """Create a span as a child of the current one or of a remote parent."""
+    if not EXPORTER:
+        yield None
+        return
+
+    current = current_span()
+    if parent:
+        trace_id, parent_id = parent
+    elif current:
+        trace_id, parent_id = current.trace_id, current.span_id
+    else:
+        trace_id, parent_id = _random_id(16), None
+
+    new_span = Span(name, trace_id, parent_id, kind, attributes)
+    _LOCAL.span = new_span
+    try:
+        yield new_span
+    except Exception as exc:
+        new_span.set_error(str(exc))
+        raise
+    finally:
+        _LOCAL.span = current
+        new_span.finish()
+        EXPORTER.export(new_span)
+
+
+@contextlib.contextmanager
+def rpc_span(method, context):
+    """Create the root span of a gRPC call."""
+    if not EXPORTER:
+        yield None
+        return
+
+    parent = parent_from_metadata(context.invocation_metadata())
+    attributes = {'rpc.system': 'grpc', 'rpc.method': method}
+    with span(method, attributes, parent, SERVER) as new_span:
+        try:
+            yield new_span
+        except Exception:
+            code = context._state.code
+            new_span.attributes['rpc.grpc.status_code'] = (
+                str(code)[11:] if code else 'UNKNOWN')
+            raise
+        new_span.attributes['rpc.grpc.status_code'] = 'OK'
+
+
+def traced(prefix):
+    """Decorator to create a span named with the prefix and method name."""
+    def decorator(f):
+        name = prefix + f.__name__
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -35,7 +35,7 @@ class Controller(base.ControllerBase):
 
     # CreateVolume implemented on base Controller class.
     # Requires _convert_volume_type method.
-    def _convert_volume_type(self, vol):
+    def _convert_volume_type(self, vol, topologies=None):
         specs = vol.volume_type.extra_specs if vol.volume_type_id else None
         return types.Volume(capacity_bytes=int(vol.size * constants.GB),
                             id=vol.id,
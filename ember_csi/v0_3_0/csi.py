@@ -50,7 +50,7 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
     # methods.
     def _validate_requirements(self, request, context):
         super(Controller, self)._validate_requirements(request, context)
-        self._validate_accessibility(request, context)
+        return self._validate_accessibility(request, context)
 
     def _create_volume(self, name, vol_size, request, context, **params):
         if not request.HasField('volume_content_source'):
@@ -64,7 +64,7 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
                                      request.name, context, **params)
         return vol
 
-    def _convert_volume_type(self, vol):
+    def _convert_volume_type(self, vol, topologies=None):
         specs = vol.volume_type.extra_specs if vol.volume_type_id else None
         parameters = dict(capacity_bytes=int(vol.size * constants.GB),
                           id=vol.id,
@@ -79,8 +79,11 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
 
         # accessible_topology should only be returned if we reported
         # ACCESSIBILITY_CONSTRAINTS capability.
+        # Only the ones accessible from the request's topologies if we know
+        # them.
         if self.GRPC_TOPOLOGIES:
-            parameters['accessible_topology'] = self.GRPC_TOPOLOGIES
+            parameters['accessible_topology'] = (topologies or
+                                                 self.GRPC_TOPOLOGIES)
 
         return types.Volume(**parameters)
 
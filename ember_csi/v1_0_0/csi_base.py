@@ -24,6 +24,7 @@ from ember_csi import base
 from ember_csi import common
 from ember_csi import config
 from ember_csi import constants
+from ember_csi import tracing
 
 
 CONF = config.CONF
@@ -45,7 +46,7 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
     # methods.
     def _validate_requirements(self, request, context):
         super(Controller, self)._validate_requirements(request, context)
-        self._validate_accessibility(request, context)
+        return self._validate_accessibility(request, context)
 
     def _disable_features(self, features):
         # Snapshot disabling is handled by SnapshotBase
@@ -63,7 +64,8 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
         if src_vol.size > vol_size:
             context.abort(grpc.StatusCode.OUT_OF_RANGE,
                           'Volume %s is bigger than requested volume' % vol_id)
-        vol = src_vol.clone(name=name, size=vol_size, **params)
+        with tracing.span('backend.clone'):
+            vol = src_vol.clone(name=name, size=vol_size, **params)
         return vol
 
     def _create_volume(self, name, vol_size, request, context, **params):
@@ -84,7 +86,7 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
                                         request.name, context, **params)
         return vol
 
-    def _convert_volume_type(self, vol):
+    def _convert_volume_type(self, vol, topologies=None):
         specs = vol.volume_type.extra_specs if vol.volume_type_id else None
         parameters = dict(capacity_bytes=int(vol.size * constants.GB),
                           volume_id=vol.id,
@@ -104,8 +106,11 @@ class Controller(base.TopologyBase, base.SnapshotBase, base.ControllerBase):
 
         # accessible_topology should only be returned if we reported
         # VOLUME_ACCESSIBILITY_CONSTRAINTS capability.
+        # Only the ones accessible from the request's topologies if we know
+        # them.
         if self.GRPC_TOPOLOGIES:
-            parameters['accessible_topology'] = self.GRPC_TOPOLOGIES
+            parameters['accessible_topology'] = (topologies or
+                                                 self.GRPC_TOPOLOGIES)
 
         return self.TYPES.Volume(**parameters)
 
@@ -23,6 +23,8 @@ from oslo_log import log as logging
 from ember_csi import config
 from ember_csi import common
 from ember_csi import constants
+from ember_csi import privileged
+from ember_csi import tracing
 from ember_csi.v1_0_0 import csi_base as v1_base
 from ember_csi.v1_1_0 import csi_pb2_grpc as csi
 from ember_csi.v1_1_0 import csi_types as types
@@ -83,7 +85,7 @@ class Controller(v1_base.Controller):
     @common.debuggable
     @common.logrpc
     @common.require('volume_id', 'capacity_range')
-    @common.Worker.unique('volume_id')
+    @common.Worker.unique('volume_id', distributed=True)
     def ControllerExpandVolume(self, request, context):
         vol = self._get_vol(request.volume_id, context=context)
 
@@ -111,7 +113,8 @@ class Controller(v1_base.Controller):
         else:
             LOG.debug('Expanding volume %s from %s to %s',
                       vol.id, vol.size, vol_size)
-            vol.extend(vol_size)
+            with tracing.span('backend.extend'):
+                vol.extend(vol_size)
 
         # Return size and tell CO we need a call node expansion to finish
         # if it's currently attached (will be called now), or if it's a mount
@@ -175,7 +178,8 @@ class Node(v1_base.Node):
         # TODO: Check it's the right path
 
         # The extend call will return the size in bytes, like we want
-        current_size = vol.connections[0].extend()
+        with tracing.span('os_brick.extend'):
+            current_size = vol.connections[0].extend()
 
         # Extend filesystem if necessary
         self._resize_fs(context, vol, private_bind)
@@ -201,20 +205,16 @@ class Node(v1_base.Node):
         # Our volumes don't have partitions, so we don't need to extend them.
         # For ext3 we need to have the resize_inode feature enabled to be able
         # to do mounted resize, which is enabled by default in /etc/mkefs.conf
-        if fs_type in self.EXT_FS:
-            command = ('resize2fs', '-f', '-F', private_bind)
-
-        elif fs_type == 'btrfs':
-            command = ('btrfs', 'filesystem', 'resize', 'max', target)
-
-        elif fs_type == 'xfs':
-            command = ('xfs_growfs', '-d', target)
-
-        else:
+        command = privileged.resize_command(fs_type, private_bind, target)
+        if not command:
             context.abort(grpc.StatusCode.FAILED_PRECONDITION,
-                          "Don't know how to extend %s filesystem")
+                          "Don't know how to extend %s filesystem" % fs_type)
 
-        self.sudo(*command)
+        if CONF.PRIVILEGED_DAEMON:
+            self._privileged(command[0], privileged.resize_fs, fs_type,
+                             private_bind, target)
+        else:
+            self.sudo(*command)
 
 
 class All(Controller, Node):
@@ -0,0 +1,57 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Notify threads waiting for resources to change.
+
+Persistence plugins call notify when they see a resource change, be it because
+this process changed it or because they were told by the storage, and threads
+waiting on that resource wake up to check it instead of waiting for their next
+polling interval.
+
+Plugins that don't call notify still work, waiting threads will just take
+longer to see the changes.
+"""
+from __future__ import absolute_import
+import contextlib
+import threading
+
+
+_LOCK = threading.Lock()
+_WAITERS = {}
+
+
+def notify(resource_id):
+    """Wake up all threads waiting for changes on a resource."""
+    with _LOCK:
+        for event in _WAITERS.get(resource_id, ()):
+            event.set()
+
+
+@contextlib.contextmanager
+def listen(resource_id):
+    """Return an Event that will be set when a resource changes.
+
+    The event must be cleared after each wait.
+    """
+    event = threading.Event()
+    with _LOCK:
+        _WAITERS.setdefault(resource_id, set()).add(event)
+    try:
+        yield event
+    finally:
+        with _LOCK:
+            events = _WAITERS[resource_id]
+            events.discard(event)
+            if not events:
+                del _WAITERS[resource_id]
@@ -0,0 +1,34 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Benchmarks of the CSI RPC hot paths.
+
+Run them from the root of the repository with `make benchmark` or with:
+
+    $ python -m tests.benchmark --volumes 1000 --concurrency 30
+
+The CRD persistence plugin can be benchmarked without a Kubernetes cluster
+using its in-process fake Kubernetes API server, with some latency and a rate
+of conflicts on writes if we want:
+
+    $ python -m tests.benchmark --volumes 10000 --concurrency 30 \
+        --persistence '{"storage": "crd", "informer": true,
+                        "fake_api": {"latency": 0.002, "conflict_rate": 0}}'
+
+See `python -m tests.benchmark --help` for all the options.
+
+This is a tool to measure performance changes and it is not part of the test
+suite, since it doesn't check the results of the calls.  Code paths must
+still be covered by the unit tests.
+"""
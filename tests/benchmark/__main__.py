@@ -0,0 +1,373 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Benchmark the CSI RPC hot paths.
+
+Drives the CSI v1.1 All servicer in-process, calling its methods directly
+like the gRPC server would, with a fake Cinder driver, in-memory persistence
+unless configured otherwise, and a sandbox instead of mounts and sudo.
+
+Each phase runs an operation on all the volumes using a pool of threads and
+reports its throughput and latency percentiles.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+GB = 1024 ** 3
+POD_UID_KEY = 'csi.storage.k8s.io/pod.uid'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m tests.benchmark',
+        description='Benchmark the CSI RPC hot paths in-process.')
+    parser.add_argument('--volumes', type=int, default=100,
+                        help='Number of volumes (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Concurrent calls (default: %(default)s)')
+    parser.add_argument('--pods', type=int, default=1,
+                        help='Node publishes per volume, more than 1 uses '
+                             'multi-writer block volumes (default: '
+                             '%(default)s)')
+    parser.add_argument('--mode', choices=('block', 'mount'),
+                        default='block',
+                        help='Volume access type (default: %(default)s)')
+    parser.add_argument('--list-iterations', type=int, default=10,
+                        help='Full listings of volumes and snapshots '
+                             '(default: %(default)s)')
+    parser.add_argument('--page-size', type=int, default=0,
+                        help='Entries per listing page, 0 for all '
+                             '(default: %(default)s)')
+    parser.add_argument('--no-snapshots', action='store_true',
+                        help="Don't create and list snapshots")
+    parser.add_argument('--driver-latency', type=float, default=0,
+                        help='Seconds each driver operation takes '
+                             '(default: %(default)s)')
+    parser.add_argument('--persistence',
+                        default='{"storage": "memory"}',
+                        help='X_CSI_PERSISTENCE_CONFIG to use (default: '
+                             '%(default)s)')
+    parser.add_argument('--no-eventlet', action='store_true',
+                        help="Don't monkey patch with eventlet like the "
+                             "threaded gRPC server does")
+    parser.add_argument('--json', action='store_true',
+                        help='Output results as JSON')
+    parser.add_argument('--debug', action='store_true',
+                        help='Enable logging with debug level')
+    args = parser.parse_args()
+    if args.pods > 1 and args.mode == 'mount':
+        parser.error('Multiple pods are only supported in block mode')
+    return args
+
+
+def setup_environment(args, state_path):
+    """Set our configuration, must be called before importing Ember-CSI."""
+    backend_config = {'volume_backend_name': 'benchmark',
+                      'volume_driver': 'tests.benchmark.fakes.FakeDriver'}
+    ember_config = {'grpc_workers': args.concurrency,
+                    'state_path': state_path,
+                    'root_helper': 'env',
+                    'disable_logs': not args.debug,
+                    'debug': args.debug}
+    os.environ.update({
+        'CSI_MODE': 'all',
+        'X_CSI_SPEC_VERSION': '1.1',
+        'X_CSI_NODE_ID': 'benchmark-node',
+        'X_CSI_PERSISTENCE_CONFIG': args.persistence,
+        'X_CSI_BACKEND_CONFIG': json.dumps(backend_config),
+        'X_CSI_EMBER_CONFIG': json.dumps(ember_config),
+    })
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Result(object):
+    def __init__(self, name, latencies, errors, elapsed, error=None):
+        self.name = name
+        self.calls = len(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.error = error
+        latencies = sorted(latencies)
+        self.throughput = self.calls / elapsed if elapsed else 0
+        self.p50 = percentile(latencies, 50)
+        self.p99 = percentile(latencies, 99)
+
+    def to_dict(self):
+        return {'operation': self.name, 'calls': self.calls,
+                'errors': self.errors, 'elapsed': self.elapsed,
+                'throughput': self.throughput, 'p50': self.p50,
+                'p99': self.p99, 'error': self.error}
+
+    HEADER = '%-26s %7s %7s %10s %10s %10s' % (
+        'Operation', 'Calls', 'Errors', 'Calls/s', 'p50 (ms)', 'p99 (ms)')
+
+    def __str__(self):
+        return '%-26s %7d %7d %10.1f %10.2f %10.2f' % (
+            self.name, self.calls, self.errors, self.throughput,
+            self.p50 * 1000, self.p99 * 1000)
+
+
+class Benchmark(object):
+    def __init__(self, plugin, args, workdir):
+        # Ember-CSI reads its configuration on import
+        from concurrent import futures
+        from ember_csi import common
+        from ember_csi.v1_1_0 import csi_pb2
+
+        self.futures = futures
+        self.pb2 = csi_pb2
+        self.common = common
+        self.plugin = plugin
+        self.args = args
+        self.workdir = workdir
+        self.volume_ids = {}
+        self.publish_contexts = {}
+        self.snapshot_ids = {}
+        self.results = []
+
+        cap = csi_pb2.VolumeCapability
+        modes = cap.AccessMode
+        mode = (modes.MULTI_NODE_MULTI_WRITER if args.pods > 1
+                else modes.SINGLE_NODE_WRITER)
+        if args.mode == 'block':
+            self.capability = cap(block=cap.BlockVolume(),
+                                  access_mode=modes(mode=mode))
+        else:
+            self.capability = cap(mount=cap.MountVolume(),
+                                  access_mode=modes(mode=mode))
+
+    def _call(self, method, **kwargs):
+        request_class = getattr(self.pb2, method + 'Request')
+        return getattr(self.plugin, method)(request_class(**kwargs),
+                                            self.common.SyncContext())
+
+    def _timed_call(self, func, item):
+        start = time.time()
+        try:
+            func(item)
+            error = None
+        except Exception as exc:
+            error = '%s: %s' % (type(exc).__name__, exc)
+        return time.time() - start, error
+
+    def run(self, name, func, items):
+        items = list(items)
+        if not items:
+            return
+        start = time.time()
+        with self.futures.ThreadPoolExecutor(self.args.concurrency) as pool:
+            results = list(pool.map(lambda item: self._timed_call(func, item),
+                                    items))
+        elapsed = time.time() - start
+
+        errors = [error for latency, error in results if error]
+        result = Result(name, [latency for latency, error in results],
+                        len(errors), elapsed, errors[0] if errors else None)
+        self.results.append(result)
+        if not self.args.json:
+            print(result)
+            if result.error:
+                print('    First error: %s' % result.error)
+
+    def _staging_path(self, i):
+        return os.path.join(self.workdir, 'staging', str(i))
+
+    def _target_path(self, i, pod):
+        return os.path.join(self.workdir, 'pods', str(pod), str(i))
+
+    def _prepare_paths(self):
+        for i in range(self.args.volumes):
+            os.makedirs(self._staging_path(i))
+        for pod in range(self.args.pods):
+            os.makedirs(os.path.join(self.workdir, 'pods', str(pod)))
+
+    def create_volume(self, i):
+        resp = self._call('CreateVolume', name='benchmark-%06d' % i,
+                          capacity_range=self.pb2.CapacityRange(
+                              required_bytes=GB),
+                          volume_capabilities=[self.capability])
+        self.volume_ids[i] = resp.volume.volume_id
+
+    def controller_publish(self, i):
+        resp = self._call('ControllerPublishVolume',
+                          volume_id=self.volume_ids[i],
+                          node_id=self.plugin.node_info.id,
+                          volume_capability=self.capability)
+        self.publish_contexts[i] = dict(resp.publish_context)
+
+    def node_stage(self, i):
+        self._call('NodeStageVolume', volume_id=self.volume_ids[i],
+                   publish_context=self.publish_contexts[i],
+                   staging_target_path=self._staging_path(i),
+                   volume_capability=self.capability)
+
+    def node_publish(self, item):
+        i, pod = item
+        self._call('NodePublishVolume', volume_id=self.volume_ids[i],
+                   publish_context=self.publish_contexts[i],
+                   staging_target_path=self._staging_path(i),
+                   target_path=self._target_path(i, pod),
+                   volume_capability=self.capability,
+                   volume_context={POD_UID_KEY: 'benchmark-pod-%s' % pod})
+
+    def _list_all(self, method):
+        token = ''
+        while True:
+            resp = self._call(method, max_entries=self.args.page_size,
+                              starting_token=token)
+            token = resp.next_token
+            if not token:
+                return
+
+    def list_volumes(self, iteration):
+        self._list_all('ListVolumes')
+
+    def create_snapshot(self, i):
+        resp = self._call('CreateSnapshot', name='benchmark-snap-%06d' % i,
+                          source_volume_id=self.volume_ids[i])
+        self.snapshot_ids[i] = resp.snapshot.snapshot_id
+
+    def list_snapshots(self, iteration):
+        self._list_all('ListSnapshots')
+
+    def node_unpublish(self, item):
+        i, pod = item
+        self._call('NodeUnpublishVolume', volume_id=self.volume_ids[i],
+                   target_path=self._target_path(i, pod))
+
+    def node_unstage(self, i):
+        self._call('NodeUnstageVolume', volume_id=self.volume_ids[i],
+                   staging_target_path=self._staging_path(i))
+
+    def controller_unpublish(self, i):
+        self._call('ControllerUnpublishVolume', volume_id=self.volume_ids[i],
+                   node_id=self.plugin.node_info.id)
+
+    def delete_snapshot(self, i):
+        self._call('DeleteSnapshot', snapshot_id=self.snapshot_ids[i])
+
+    def delete_volume(self, i):
+        self._call('DeleteVolume', volume_id=self.volume_ids[i])
+
+    def run_all(self):
+        self._prepare_paths()
+        volumes = range(self.args.volumes)
+        pods = [(i, pod) for i in volumes for pod in range(self.args.pods)]
+        iterations = range(self.args.list_iterations)
+        snapshots = not self.args.no_snapshots
+
+        if not self.args.json:
+            print(Result.HEADER)
+        self.run('CreateVolume', self.create_volume, volumes)
+        # Later phases only use the volumes that were created
+        volumes = sorted(self.volume_ids)
+        self.run('ControllerPublishVolume', self.controller_publish, volumes)
+        staged = sorted(self.publish_contexts)
+        self.run('NodeStageVolume', self.node_stage, staged)
+        pods = [(i, pod) for i, pod in pods if i in self.publish_contexts]
+        self.run('NodePublishVolume', self.node_publish, pods)
+        self.run('ListVolumes', self.list_volumes, iterations)
+        if snapshots:
+            self.run('CreateSnapshot', self.create_snapshot, volumes)
+            self.run('ListSnapshots', self.list_snapshots, iterations)
+        self.run('NodeUnpublishVolume', self.node_unpublish, pods)
+        self.run('NodeUnstageVolume', self.node_unstage, staged)
+        self.run('ControllerUnpublishVolume', self.controller_unpublish,
+                 staged)
+        if snapshots:
+            self.run('DeleteSnapshot', self.delete_snapshot,
+                     sorted(self.snapshot_ids))
+        self.run('DeleteVolume', self.delete_volume, volumes)
+
+        if self.args.json:
+            print(json.dumps([result.to_dict() for result in self.results],
+                             indent=2))
+        return not any(result.errors for result in self.results)
+
+
+def fake_connector_properties(root_helper, my_ip, multipath, enforce_multipath,
+                              *args, **kwargs):
+    return {'platform': 'x86_64', 'os_type': 'linux', 'ip': my_ip,
+            'host': 'benchmark-node', 'multipath': multipath,
+            'initiator': 'iqn.1994-05.com.redhat:benchmark'}
+
+
+def create_plugin():
+    from ember_csi import common
+    from ember_csi import config
+    from ember_csi.v1_1_0 import csi
+    from tests.benchmark import fakes
+
+    CONF = config.CONF
+    # The sandbox doesn't need the filesystem tools
+    if CONF.DEFAULT_MOUNT_FS not in CONF.SUPPORTED_FS_TYPES:
+        CONF.SUPPORTED_FS_TYPES.append(CONF.DEFAULT_MOUNT_FS)
+    CONF.validate()
+
+    # Don't look for initiators in the system
+    common.brick_connector.get_connector_properties = (
+        fake_connector_properties)
+
+    plugin_class = type('BenchmarkAll', (fakes.SandboxNodeMixin, csi.All),
+                        {})
+    plugin = plugin_class(server=fakes.FakeServer(),
+                          persistence_config=CONF.PERSISTENCE_CONFIG,
+                          backend_config=CONF.BACKEND_CONFIG,
+                          ember_config=CONF.EMBER_CONFIG,
+                          storage_nw_ip='127.0.0.1',
+                          node_id=CONF.NAME + '.' + CONF.NODE_ID)
+    plugin.sandbox = fakes.Sandbox()
+    plugin.mount_table = plugin.sandbox.mounts
+    return plugin
+
+
+def main():
+    args = parse_args()
+    if not args.no_eventlet:
+        import eventlet
+        eventlet.monkey_patch()
+
+    workdir = tempfile.mkdtemp(prefix='ember-csi-benchmark-')
+    try:
+        state_path = os.path.join(workdir, 'state')
+        os.mkdir(state_path)
+        setup_environment(args, state_path)
+
+        from tests.benchmark import fakes
+        fakes.FakeDriver.LATENCY = args.driver_latency
+        fakes.FakeDriver.DEVICES_PATH = os.path.join(workdir, 'devices')
+        os.mkdir(fakes.FakeDriver.DEVICES_PATH)
+
+        benchmark = Benchmark(create_plugin(), args, workdir)
+        success = benchmark.run_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
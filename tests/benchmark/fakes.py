@@ -0,0 +1,236 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Fakes used by the benchmarks.
+
+- FakeDriver: Cinder driver that keeps its volumes in memory and exports them
+  as local devices.
+- Sandbox: Stand-in for the privileged commands run by the node, keeping an
+  in-memory mount table instead of mounting anything.
+- FakeServer: What the servicers need from the gRPC server.  Calls get
+  Ember-CSI's own common.SyncContext as their context.
+"""
+from __future__ import absolute_import
+import os
+import threading
+import time
+
+from cinder.volume import driver
+from oslo_concurrency import processutils as putils
+import six
+
+from ember_csi import base
+
+
+class FakeDriver(driver.VolumeDriver):
+    """Cinder driver that doesn't store any data.
+
+    Volumes are exported as local devices that are empty files in
+    DEVICES_PATH, since the local connector checks that they exist, but the
+    node's sandbox doesn't access them.  LATENCY is the time in seconds each
+    operation on the backend takes.
+    """
+    VERSION = '1.0.0'
+    LATENCY = 0
+    TOTAL_CAPACITY_GB = 1000000
+    DEVICES_PATH = None
+
+    def __init__(self, *args, **kwargs):
+        super(FakeDriver, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.volumes = {}
+        self.snapshots = set()
+
+    def _wait(self):
+        if self.LATENCY:
+            time.sleep(self.LATENCY)
+
+    def do_setup(self, context):
+        pass
+
+    def check_for_setup_error(self):
+        pass
+
+    def get_volume_stats(self, refresh=False):
+        self._wait()
+        with self.lock:
+            used = sum(self.volumes.values())
+        backend_name = (self.configuration.safe_get('volume_backend_name') or
+                        type(self).__name__)
+        return {'volume_backend_name': backend_name,
+                'vendor_name': 'Ember-CSI',
+                'driver_version': self.VERSION,
+                'storage_protocol': 'local',
+                'total_capacity_gb': self.TOTAL_CAPACITY_GB,
+                'free_capacity_gb': self.TOTAL_CAPACITY_GB - used,
+                'reserved_percentage': 0,
+                'multiattach': True,
+                'thin_provisioning_support': True}
+
+    def _add_volume(self, volume, size):
+        self._wait()
+        with self.lock:
+            self.volumes[volume.id] = size
+
+    def create_volume(self, volume):
+        self._add_volume(volume, volume.size)
+
+    def create_volume_from_snapshot(self, volume, snapshot):
+        self._add_volume(volume, volume.size)
+
+    def create_cloned_volume(self, volume, src_vref):
+        self._add_volume(volume, volume.size)
+
+    def extend_volume(self, volume, new_size):
+        self._add_volume(volume, new_size)
+
+    def delete_volume(self, volume):
+        self._wait()
+        with self.lock:
+            self.volumes.pop(volume.id, None)
+
+    def create_snapshot(self, snapshot):
+        self._wait()
+        with self.lock:
+            self.snapshots.add(snapshot.id)
+
+    def delete_snapshot(self, snapshot):
+        self._wait()
+        with self.lock:
+            self.snapshots.discard(snapshot.id)
+
+    def create_export(self, context, volume, connector):
+        pass
+
+    def ensure_export(self, context, volume):
+        pass
+
+    def remove_export(self, context, volume):
+        pass
+
+    def initialize_connection(self, volume, connector):
+        self._wait()
+        device_path = os.path.join(self.DEVICES_PATH, volume.id)
+        open(device_path, 'a').close()
+        return {'driver_volume_type': 'local',
+                'data': {'device_path': device_path}}
+
+    def terminate_connection(self, volume, connector, **kwargs):
+        self._wait()
+
+
+class SandboxMounts(base.MountTable):
+    """Mount table kept in memory instead of read from the kernel."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = []
+        self.changed = False
+        self.next_id = 1000
+        self._load()
+
+    def _load(self):
+        self._file = six.StringIO(''.join(self.lines))
+        super(SandboxMounts, self)._load()
+
+    def refresh(self):
+        with self.lock:
+            if self.changed:
+                self.changed = False
+                self._load()
+
+    def _add(self, root, target, options, fs_type, source):
+        with self.lock:
+            self.next_id += 1
+            self.lines.append('%s 1 0:0 %s %s %s - %s %s %s\n' %
+                              (self.next_id, root, target, options, fs_type,
+                               source, options))
+            self.changed = True
+
+    def mount(self, source, target, fs_type, options):
+        self._add('/', target, ','.join(['rw'] + options), fs_type, source)
+
+    def bind(self, source, target, read_only=False):
+        options = 'ro' if read_only else 'rw'
+        # Like the kernel, binds of binds show the original root and source
+        mount = self.find(source)
+        if mount:
+            self._add(mount.root, target, options, mount.fs_type,
+                      mount.mount_source)
+        else:
+            self._add(source, target, options, 'devtmpfs', 'devtmpfs')
+
+    def umount(self, target):
+        with self.lock:
+            for i in range(len(self.lines) - 1, -1, -1):
+                if self.lines[i].split()[4] == target:
+                    del self.lines[i]
+                    self.changed = True
+                    return
+        raise putils.ProcessExecutionError(exit_code=32,
+                                           stderr='%s: not mounted' % target,
+                                           cmd='umount ' + target)
+
+
+class Sandbox(object):
+    """Stand-in for the commands the node runs as root."""
+    def __init__(self):
+        self.mounts = SandboxMounts()
+        self.fs_types = {}
+
+    def _mount(self, args):
+        fs_type = None
+        options = []
+        paths = []
+        args = iter(args)
+        for arg in args:
+            if arg == '--bind':
+                options.append('bind')
+            elif arg == '-o':
+                options.extend(next(args).split(','))
+            elif arg == '-t':
+                fs_type = next(args)
+            else:
+                paths.append(arg)
+
+        source, target = paths
+        if 'bind' in options:
+            self.mounts.bind(source, target, 'ro' in options)
+        else:
+            self.mounts.mount(source, target, fs_type, options)
+
+    def execute(self, *cmd):
+        command = os.path.basename(cmd[0])
+        if command == 'mount':
+            self._mount(cmd[1:])
+        elif command == 'umount':
+            self.mounts.umount(cmd[-1])
+        elif command == 'lsblk':
+            return self.fs_types.get(cmd[-1], '') + '\n', ''
+        elif command.startswith('mkfs.'):
+            self.fs_types[cmd[-1]] = command[5:]
+        return '', ''
+
+
+class SandboxNodeMixin(object):
+    """Run the node's privileged operations in a sandbox."""
+    sandbox = None
+
+    def _execute(self, *cmd):
+        return self.sandbox.execute(*cmd)
+
+
+class FakeServer(object):
+    """Server that servicers can register with."""
+    def add_generic_rpc_handlers(self, generic_rpc_handlers):
+        pass
@@ -0,0 +1,111 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the asyncio gRPC server."""
+from concurrent import futures
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import common
+
+try:
+    import asyncio
+    from ember_csi import aio
+except (ImportError, SyntaxError, AttributeError):
+    aio = None
+
+
+class Request(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Servicer(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.blocked = False
+
+    @common.Worker.unique('name')
+    def CreateVolume(self, request, context):
+        # The first vol1 call waits until another call releases it
+        if request.name == 'vol1' and not self.blocked:
+            self.blocked = True
+            if not self.release.wait(5):
+                return 'timed out'
+        elif request.name == 'vol2':
+            self.release.set()
+        return 'created ' + request.name
+
+
+@unittest.skipIf(aio is None, 'The asyncio gRPC server is not supported')
+class TestGenericHandler(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(common.CONF, ABORT_DUPLICATES=False,
+                                      LOCK_TIMEOUT=5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+        self.executor = futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.servicer = Servicer()
+
+        self.context = mock.Mock()
+        self.context.invocation_metadata.return_value = ()
+        self.context.abort.side_effect = self._abort
+
+    def _abort(self, code, details, trailing_metadata):
+        # Let the blocked call finish once we have been rejected
+        self.servicer.release.set()
+        return asyncio.sleep(0)
+
+    def _call(self, admission, *names):
+        handler = aio.GenericHandler(None, self.executor, admission)
+        create = handler._wrap(self.servicer.CreateVolume)
+        calls = [create(Request(name), self.context) for name in names]
+        return self.loop.run_until_complete(asyncio.gather(*calls))
+
+    def test_lock_waits_without_thread(self):
+        # The second vol1 call waits for the lock on the event loop, so vol2
+        # gets the other thread and releases the first call
+        self.assertEqual(['created vol1', 'created vol1', 'created vol2'],
+                         self._call(aio.Admission(3), 'vol1', 'vol1', 'vol2'))
+        self.assertEqual({}, common.Worker.locks.holders())
+        self.context.abort.assert_not_called()
+
+    def test_admission_queue(self):
+        # vol3 waits for vol1's worker and vol4 doesn't fit in the queue
+        self.assertEqual(['created vol1', 'created vol3', None],
+                         self._call(aio.Admission(1, queue=1),
+                                    'vol1', 'vol3', 'vol4'))
+        self.context.abort.assert_called_once_with(
+            common.grpc.StatusCode.RESOURCE_EXHAUSTED, mock.ANY, mock.ANY)
+
+    def test_lock_timeout(self):
+        with mock.patch.object(common.CONF, 'LOCK_TIMEOUT', 0.01):
+            self.assertEqual(['created vol1', None],
+                             self._call(aio.Admission(2), 'vol1', 'vol1'))
+        self.context.abort.assert_called_once_with(
+            common.grpc.StatusCode.ABORTED, 'Timed out waiting to '
+            'CreateVolume on vol1', None)
+        self.assertEqual({}, common.Worker.locks.holders())
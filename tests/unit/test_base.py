@@ -0,0 +1,289 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the mount table, topology, and wait helpers of the base module."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import base
+from ember_csi import waiters
+
+
+PRIVATE_BIND = '/var/lib/ember-csi/vols/d4f1'
+MOUNTINFO = (
+    '22 1 253:0 / / rw,relatime shared:1 - xfs /dev/mapper/root rw\n'
+    # Private bind of the device, its source is devtmpfs
+    '40 22 0:5 /sdb %(bind)s rw,nosuid shared:2 - devtmpfs devtmpfs rw\n'
+    # The filesystem mounted on the staging directory
+    '41 22 8:16 / /stage rw,relatime shared:3 - xfs %(bind)s '
+    'rw,attr2,nouuid\n'
+    # The staging directory bind mounted on the publish directory
+    '42 22 8:16 / /publish ro,relatime shared:3 - xfs %(bind)s '
+    'rw,attr2,nouuid\n'
+    # A different volume
+    '43 22 8:32 / /other rw,relatime shared:4 - ext4 /dev/sdc rw\n'
+) % {'bind': PRIVATE_BIND}
+
+
+class TestMountTable(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.filename = os.path.join(self.tempdir, 'mountinfo')
+        with open(self.filename, 'w') as f:
+            f.write(MOUNTINFO)
+        self.table = base.MountTable(self.filename)
+
+    def test_find(self):
+        self.assertEqual('/dev/sdc', self.table.find('/other').source)
+        self.assertIsNone(self.table.find('/missing'))
+
+    def test_find_stacked(self):
+        with open(self.filename, 'a') as f:
+            f.write('44 43 8:48 / /other rw,relatime shared:5 - xfs /dev/sdd '
+                    'rw\n')
+        table = base.MountTable(self.filename)
+        # The top mount shadows the one below
+        self.assertEqual('/dev/sdd', table.find('/other').source)
+
+    def test_with_source(self):
+        self.assertEqual(['/stage', '/publish'],
+                         [mount.mount_point for mount in
+                          self.table.with_source(PRIVATE_BIND)])
+        # Binds of devices are found by their root
+        self.assertEqual([PRIVATE_BIND],
+                         [mount.mount_point for mount in
+                          self.table.with_source('/sdb')])
+
+    def test_get_mount(self):
+        node = mock.Mock(mount_table=self.table)
+        self.assertEqual(
+            [[PRIVATE_BIND, '/stage', 'xfs', 'rw,relatime,attr2,nouuid'],
+             [PRIVATE_BIND, '/publish', 'xfs', 'ro,relatime,attr2,nouuid']],
+            base.NodeBase._get_mount(node, PRIVATE_BIND))
+        self.assertEqual([], base.NodeBase._get_mount(node, '/missing'))
+
+
+class TestMountInfo(unittest.TestCase):
+    def test_parse(self):
+        mounts = list(base.MountInfo.parse(MOUNTINFO.splitlines()))
+        self.assertEqual(5, len(mounts))
+        mount = mounts[1]
+        self.assertEqual('40', mount.mount_id)
+        self.assertEqual('22', mount.parent_id)
+        self.assertEqual('0:5', mount.st_dev)
+        self.assertEqual('/sdb', mount.root)
+        self.assertEqual(PRIVATE_BIND, mount.mount_point)
+        self.assertEqual('rw,nosuid', mount.mount_options)
+        self.assertEqual(('shared:2',), mount.optional_fields)
+        self.assertEqual('devtmpfs', mount.fs_type)
+        self.assertEqual('devtmpfs', mount.mount_source)
+        self.assertEqual('rw', mount.super_options)
+
+    def test_parse_skips_empty_lines(self):
+        lines = ['', '   ', MOUNTINFO.splitlines()[0], '\n']
+        self.assertEqual(['/'], [mount.mount_point for mount in
+                                 base.MountInfo.parse(lines)])
+
+    def test_optional_fields(self):
+        mount = base.MountInfo('1 0 0:1 / /a rw - tmpfs tmpfs rw')
+        self.assertEqual((), mount.optional_fields)
+        self.assertEqual('tmpfs', mount.fs_type)
+
+        mount = base.MountInfo('1 0 0:1 / /a rw shared:1 master:2 - tmpfs '
+                               'tmpfs rw')
+        self.assertEqual(('shared:1', 'master:2'), mount.optional_fields)
+        self.assertEqual('tmpfs', mount.mount_source)
+
+    def test_malformed_lines(self):
+        for line in ('1 0 0:1 / /a rw', '1 0 0:1 / /a rw shared:1 tmpfs x y',
+                     '1 0 0:1 / /a rw - tmpfs', '1 0 0:1 / /a - xfs /dev rw'):
+            mount = base.MountInfo(line)
+            self.assertEqual('', mount.mount_point)
+            self.assertEqual('', mount.source)
+
+    def test_unescape(self):
+        self.assertEqual('/mnt/a b\tc\nd\\e',
+                         base.MountInfo.unescape(
+                             r'/mnt/a\040b\011c\012d\134e'))
+        self.assertEqual('/mnt/plain', base.MountInfo.unescape('/mnt/plain'))
+        # Only 3 digit octal escapes are escapes
+        self.assertEqual(r'/mnt/a\04', base.MountInfo.unescape(r'/mnt/a\04'))
+
+    def test_escaped_paths(self):
+        mount = base.MountInfo(r'1 0 0:1 /r\040t /mnt/a\040b rw - ext4 '
+                               r'/dev/disk\040x rw')
+        self.assertEqual('/r t', mount.root)
+        self.assertEqual('/mnt/a b', mount.mount_point)
+        self.assertEqual('/dev/disk x', mount.mount_source)
+
+    def test_source(self):
+        mounts = list(base.MountInfo.parse(MOUNTINFO.splitlines()))
+        # Device binds use the root, the rest their mount source
+        self.assertEqual('/sdb', mounts[1].source)
+        self.assertEqual(PRIVATE_BIND, mounts[2].source)
+
+
+class AbortError(Exception):
+    pass
+
+
+def topology(**segments):
+    return mock.Mock(segments=segments)
+
+
+class TestTopologyIndex(unittest.TestCase):
+    TOPOLOGIES = [{'region': 'r1', 'zone': 'z1'},
+                  {'region': 'r1', 'zone': 'z2'},
+                  {'region': 'r2'}]
+
+    def setUp(self):
+        self.index = base.TopologyIndex(self.TOPOLOGIES)
+
+    def test_exact_match(self):
+        self.assertEqual({0}, self.index.matches({'region': 'r1',
+                                                  'zone': 'z1'}))
+        self.assertEqual({2}, self.index.matches({'region': 'r2'}))
+
+    def test_subset_of_configured(self):
+        self.assertEqual({0, 1}, self.index.matches({'region': 'r1'}))
+        self.assertEqual({1}, self.index.matches({'zone': 'z2'}))
+
+    def test_superset_of_configured(self):
+        self.assertEqual({2}, self.index.matches({'region': 'r2',
+                                                  'zone': 'z9'}))
+        self.assertEqual({0}, self.index.matches({'region': 'r1',
+                                                  'zone': 'z1',
+                                                  'rack': 'k1'}))
+
+    def test_empty_segments_match_all(self):
+        self.assertEqual({0, 1, 2}, self.index.matches({}))
+
+    def test_no_match(self):
+        self.assertEqual(set(), self.index.matches({'region': 'r3'}))
+        self.assertEqual(set(), self.index.matches({'region': 'r1',
+                                                    'zone': 'z3'}))
+        self.assertEqual(set(), self.index.matches({'rack': 'k1'}))
+
+    def test_duplicated_topologies(self):
+        index = base.TopologyIndex([{'zone': 'z1'}, {'zone': 'z1'}])
+        self.assertEqual({0, 1}, index.matches({'zone': 'z1'}))
+        self.assertEqual({0, 1}, index.matches({'zone': 'z1',
+                                                'rack': 'k1'}))
+
+    def test_no_topologies(self):
+        self.assertEqual(set(), base.TopologyIndex([]).matches({'a': 'b'}))
+
+
+class TestTopologyRequirements(unittest.TestCase):
+    def setUp(self):
+        self.plugin = base.TopologyBase()
+        self.plugin.TOPOLOGY_INDEX = base.TopologyIndex(
+            TestTopologyIndex.TOPOLOGIES)
+        self.plugin.GRPC_TOPOLOGIES = ['grpc0', 'grpc1', 'grpc2']
+        self.context = mock.Mock()
+        self.context.abort.side_effect = AbortError
+
+    def _validate(self, requisite=None, preferred=None):
+        req = mock.Mock(requisite=requisite, preferred=preferred)
+        return self.plugin._validate_accessible_requirements(
+            req, self.context)
+
+    def test_accessible_topologies_sorted_and_unique(self):
+        self.assertEqual(['grpc0', 'grpc1', 'grpc2'],
+                         self.plugin._accessible_topologies(
+                             [topology(region='r2'), topology(region='r1'),
+                              topology(zone='z1')]))
+
+    def test_requisite(self):
+        self.assertEqual(['grpc0', 'grpc1'],
+                         self._validate([topology(region='r1')]))
+
+    def test_empty_requirements(self):
+        self.assertRaises(AbortError, self._validate, [], [])
+
+    def test_only_preferred(self):
+        self.assertIsNone(self._validate([], [topology(region='r1')]))
+
+    def test_preferred_not_in_requisite(self):
+        self.assertRaises(AbortError, self._validate,
+                          [topology(region='r1')], [topology(region='r2')])
+
+    def test_preferred_in_requisite(self):
+        self.assertEqual(['grpc2'],
+                         self._validate([topology(region='r2'),
+                                         topology(region='r9')],
+                                        [topology(region='r2')]))
+
+    def test_requisite_not_accessible(self):
+        self.assertRaises(AbortError, self._validate,
+                          [topology(region='r9')])
+
+
+class TestWait(unittest.TestCase):
+    def setUp(self):
+        self.resource = mock.Mock(id='vol1', status='creating')
+
+    def _wait(self, wait_timeout, refresh_time):
+        with mock.patch.object(base.CONF, 'WAIT_TIMEOUT', wait_timeout), \
+                mock.patch.object(base.constants, 'REFRESH_TIME',
+                                  refresh_time):
+            return base.ControllerBase._wait(mock.Mock(), self.resource,
+                                             ('available',))
+
+    def test_notify_wakes_up(self):
+        def change():
+            # Give the waiter time to start listening
+            time.sleep(0.05)
+            self.resource.status = 'available'
+            waiters.notify('vol1')
+
+        thread = threading.Thread(target=change)
+        thread.start()
+        start = time.time()
+        # Without the notification it would only check again in 10 seconds
+        self.assertTrue(self._wait(60, 10))
+        thread.join()
+        self.assertLess(time.time() - start, 5)
+        self.resource.refresh.assert_called_once_with()
+
+    def test_deadline(self):
+        start = time.time()
+        self.assertFalse(self._wait(0.05, 0.01))
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        # Refreshed with an exponential backoff until the deadline
+        self.assertLess(self.resource.refresh.call_count, 5)
+
+    def test_no_deadline(self):
+        def refresh():
+            if self.resource.refresh.call_count == 5:
+                self.resource.status = 'available'
+        self.resource.refresh.side_effect = refresh
+
+        self.assertTrue(self._wait(0, 0.001))
+        self.assertEqual(5, self.resource.refresh.call_count)
+
+    def test_error(self):
+        self.resource.status = 'error'
+        self.assertFalse(self._wait(60, 10))
+        self.resource.delete.assert_not_called()
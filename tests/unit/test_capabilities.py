@@ -0,0 +1,135 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the volume capabilities."""
+import json
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import capabilities
+from ember_csi.v1_1_0 import csi_types
+
+MODES = csi_types.AccessModeType
+
+
+def mount(access_mode=MODES.SINGLE_NODE_WRITER, fs_type='ext4',
+          mount_flags=None, **kwargs):
+    return dict(is_block=False, access_mode=access_mode, fs_type=fs_type,
+                mount_flags=mount_flags, **kwargs)
+
+
+def block(access_mode=MODES.SINGLE_NODE_WRITER, **kwargs):
+    return dict(is_block=True, access_mode=access_mode, **kwargs)
+
+
+class TestCapability(unittest.TestCase):
+    def setUp(self):
+        capabilities.set_access_modes(MODES)
+        for cls in (capabilities.Capability, capabilities.Capabilities):
+            for attr in ('_interned', '_parsed'):
+                if hasattr(cls, attr):
+                    patcher = mock.patch.dict(getattr(cls, attr), clear=True)
+                    patcher.start()
+                    self.addCleanup(patcher.stop)
+
+    def test_load_interns_equal_capabilities(self):
+        cap = capabilities.Capability.load(mount(mount_flags=['noatime']))
+        same = capabilities.Capability.load(
+            json.dumps(mount(mount_flags=['noatime'])))
+
+        self.assertIs(cap, same)
+        self.assertIsNot(cap, capabilities.Capability.load(block()))
+
+    def test_load_parses_json_once(self):
+        jsons = json.dumps(mount())
+        with mock.patch.object(capabilities.json, 'loads',
+                               wraps=json.loads) as loads:
+            first = capabilities.Capability.load(jsons)
+            second = capabilities.Capability.load(jsons)
+
+        self.assertIs(first, second)
+        loads.assert_called_once_with(jsons)
+
+    def test_load_capability_instance(self):
+        cap = capabilities.Capability.load(mount())
+        self.assertIs(cap, capabilities.Capability.load(cap))
+        self.assertIs(cap, capabilities.Capability.load(cap, False))
+
+    def test_load_ro_forced(self):
+        cap = capabilities.Capability.load(mount())
+        forced = capabilities.Capability.load(cap, ro_forced=True)
+
+        self.assertIsNot(cap, forced)
+        self.assertTrue(forced.ro_forced)
+        self.assertTrue(forced.used_as_ro)
+        self.assertIs(forced, capabilities.Capability.load(mount(),
+                                                           ro_forced=True))
+        self.assertIs(forced,
+                      capabilities.Capability.load(forced.jsons))
+
+    def test_json_round_trip(self):
+        cap = capabilities.Capability.load(mount(mount_flags=['noatime']))
+        self.assertEqual(['noatime'], cap.json['mount_flags'])
+        self.assertIs(cap, capabilities.Capability.load(cap.jsons))
+
+    def test_eq_and_hash(self):
+        cap = capabilities.Capability.load(mount())
+        other = capabilities.Capability(mount())
+
+        self.assertIsNot(cap, other)
+        self.assertEqual(cap, other)
+        self.assertEqual(cap, mount())
+        self.assertEqual(hash(cap), hash(other))
+        self.assertNotEqual(cap, mount(fs_type='xfs'))
+
+    def test_supports(self):
+        rwx = capabilities.Capability.load(
+            mount(MODES.MULTI_NODE_MULTI_WRITER))
+        rwo = capabilities.Capability.load(mount())
+        ro = capabilities.Capability.load(mount(MODES.SINGLE_NODE_READER_ONLY))
+
+        self.assertTrue(rwx.supports(rwx))
+        self.assertTrue(rwx.supports(rwo))
+        self.assertTrue(rwo.supports(ro))
+        self.assertFalse(rwo.supports(rwx))
+        self.assertFalse(ro.supports(rwo))
+        self.assertFalse(rwo.supports(capabilities.Capability.load(block())))
+        self.assertFalse(rwo.supports(
+            capabilities.Capability.load(mount(fs_type='xfs'))))
+
+    def test_supports_memoized(self):
+        rwo = capabilities.Capability.load(mount())
+        ro = capabilities.Capability.load(mount(MODES.SINGLE_NODE_READER_ONLY))
+
+        with mock.patch.object(capabilities.Capability, '_check_supports',
+                               return_value=True) as check:
+            rwo.supports(ro)
+            rwo.supports(ro)
+
+        check.assert_called_once_with(ro)
+
+    def test_capabilities_load_cached(self):
+        jsons = json.dumps([mount(), block()])
+        caps = capabilities.Capabilities.load(jsons)
+
+        self.assertIs(caps, capabilities.Capabilities.load(jsons))
+        self.assertEqual([capabilities.Capability.load(mount()),
+                          capabilities.Capability.load(block())],
+                         caps.capabilities)
+        self.assertTrue(caps.supports(json.dumps(block())))
+        self.assertFalse(caps.has_multi_mode)
@@ -0,0 +1,550 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the CRD persistence plugin."""
+import json
+import time
+import unittest
+import uuid
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import kubernetes as k8s
+
+from ember_csi import cl_crd
+from ember_csi import fake_k8s
+
+
+def cro(name, version, **labels):
+    return {'metadata': {'name': name, 'resourceVersion': str(version),
+                         'labels': labels}}
+
+
+def resource_json(cls, backend_name, **fields):
+    return json.dumps(
+        {'class': cls, 'backend': {'volume_backend_name': backend_name},
+         'ovo': {'versioned_object.name': cls,
+                 'versioned_object.namespace': 'cinder',
+                 'versioned_object.version': '1.8',
+                 'versioned_object.data': fields}},
+        separators=(',', ':'))
+
+
+class CRDTestCase(unittest.TestCase):
+    """Base class that initializes the CRDs without Kubernetes."""
+    def setUp(self):
+        for crd in cl_crd.CRD.__subclasses__():
+            singular = crd.__name__.lower()
+            for attr, value in (('kind', crd.__name__),
+                                ('singular', singular),
+                                ('plural', singular + 's'),
+                                ('informer', None)):
+                patcher = mock.patch.object(crd, attr, value, create=True)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(cl_crd, 'K8S')
+        self.k8s = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestInformer(CRDTestCase):
+    def setUp(self):
+        super(TestInformer, self).setUp()
+        self.informer = cl_crd.Informer(cl_crd.Volume)
+
+    def test_store_indexes(self):
+        self.informer.store(cro('vol1', 1, backend_name='a'))
+        self.informer.store(cro('vol2', 2, backend_name='b'))
+
+        self.assertEqual(['vol1'],
+                         [c['metadata']['name'] for c in
+                          self.informer.find({'backend_name': 'a'})])
+        self.assertEqual(2, len(self.informer.find({})))
+        self.assertEqual([], self.informer.find({'backend_name': 'c'}))
+
+    def test_store_ignores_older_versions(self):
+        self.informer.store(cro('vol1', 5, backend_name='a'))
+        self.informer.store(cro('vol1', 4, backend_name='b'))
+
+        current = self.informer.get('vol1')
+        self.assertEqual('5', current['metadata']['resourceVersion'])
+        self.assertEqual([], self.informer.find({'backend_name': 'b'}))
+
+    def test_store_newer_version_reindexes(self):
+        self.informer.store(cro('vol1', 1, backend_name='a'))
+        self.informer.store(cro('vol1', 2, backend_name='b'))
+
+        self.assertEqual([], self.informer.find({'backend_name': 'a'}))
+        self.assertEqual(1, len(self.informer.find({'backend_name': 'b'})))
+        self.assertEqual(['vol1'], self.informer.names)
+
+    def test_remove_leaves_tombstone(self):
+        self.informer.store(cro('vol1', 3))
+        self.informer.remove('vol1')
+
+        self.assertIsNone(self.informer.get('vol1'))
+        self.assertEqual([], self.informer.names)
+        # Late watch events of the deleted CRO are ignored
+        self.informer.store(cro('vol1', 3))
+        self.assertIsNone(self.informer.get('vol1'))
+        # But not if it's created again
+        self.informer.store(cro('vol1', 7))
+        self.assertIsNotNone(self.informer.get('vol1'))
+        self.assertNotIn('vol1', self.informer.tombstones)
+
+    def test_remove_deleted_event_clears_tombstone(self):
+        self.informer.store(cro('vol1', 3))
+        self.informer.remove('vol1')
+        self.informer.remove('vol1', cro('vol1', 4))
+
+        self.assertEqual({}, self.informer.tombstones)
+
+    def test_page(self):
+        names = sorted(str(uuid.uuid4()) for i in range(5))
+        for i, name in enumerate(names):
+            self.informer.store(cro(name, i, backend_name='a'))
+
+        page, marker = self.informer.page({'backend_name': 'a'}, limit=2)
+        self.assertEqual(names[:2], [c['metadata']['name'] for c in page])
+        self.assertEqual(names[1], marker)
+
+        page, marker = self.informer.page({'backend_name': 'a'}, limit=2,
+                                          marker=marker)
+        self.assertEqual(names[2:4], [c['metadata']['name'] for c in page])
+
+        page, marker = self.informer.page({'backend_name': 'a'}, limit=2,
+                                          marker=marker)
+        self.assertEqual(names[4:], [c['metadata']['name'] for c in page])
+        self.assertIsNone(marker)
+
+    def test_page_filters_and_exact_limit(self):
+        names = sorted(str(uuid.uuid4()) for i in range(4))
+        for i, name in enumerate(names):
+            self.informer.store(cro(name, i, backend_name='ab'[i % 2]))
+
+        page, marker = self.informer.page({'backend_name': 'a'}, limit=2)
+        self.assertEqual([names[0], names[2]],
+                         [c['metadata']['name'] for c in page])
+        # No marker when there are no more CROs
+        self.assertIsNone(marker)
+
+    def test_page_invalid_marker(self):
+        self.assertRaises(ValueError, self.informer.page, {}, 1, 'bad')
+
+    def _watch_events(self, *events):
+        patcher = mock.patch.object(cl_crd.k8s.watch, 'Watch')
+        watch = patcher.start()
+        self.addCleanup(patcher.stop)
+        watch.return_value.stream.return_value = [
+            {'type': event_type, 'object': obj}
+            for event_type, obj in events]
+
+    @mock.patch.object(cl_crd.waiters, 'notify')
+    def test_watch_events(self, notify_mock):
+        self.informer.running = True
+        self.informer.store(cro('vol2', 2))
+        self._watch_events(('BOOKMARK', cro('', 3)),
+                           ('ADDED', cro('vol1', 4)),
+                           ('DELETED', cro('vol2', 5)))
+
+        self.informer._watch()
+
+        self.assertIsNotNone(self.informer.get('vol1'))
+        self.assertIsNone(self.informer.get('vol2'))
+        self.assertEqual('5', self.informer.resource_version)
+        self.assertEqual([mock.call('vol1'), mock.call('vol2')],
+                         notify_mock.call_args_list)
+
+    def test_watch_error_event(self):
+        self.informer.running = True
+        self._watch_events(('ERROR', fake_k8s.ApiError(
+            500, 'InternalError', 'failure').to_dict()))
+
+        with self.assertRaises(k8s.client.rest.ApiException) as cm:
+            self.informer._watch()
+        self.assertEqual(500, cm.exception.status)
+
+    def test_watch_expired_event_lists_again(self):
+        self.informer.resource_version = '1'
+        self.informer.store(cro('vol1', 1))
+        self._watch_events(('ERROR', fake_k8s.ApiError(
+            410, 'Expired', 'too old resource version: 1 (5)').to_dict()))
+
+        def list_cros(*args):
+            # Stop the informer once it has listed again
+            self.informer.running = False
+            return {'metadata': {'resourceVersion': '20'},
+                    'items': [cro('vol2', 20)]}
+
+        list_mock = self.k8s.crd_api.list_namespaced_custom_object
+        list_mock.side_effect = list_cros
+        self.informer.running = True
+        self.informer._run()
+
+        list_mock.assert_called_once_with(cl_crd.CRD.DOMAIN,
+                                          cl_crd.CRD.CRD_VERSION,
+                                          cl_crd.CRD.NAMESPACE, 'volumes')
+        self.assertIsNone(self.informer.get('vol1'))
+        self.assertIsNotNone(self.informer.get('vol2'))
+        self.assertEqual('20', self.informer.resource_version)
+
+
+class TestCRDInformerLookups(CRDTestCase):
+    def setUp(self):
+        super(TestCRDInformerLookups, self).setUp()
+        cl_crd.Volume.informer = cl_crd.Informer(cl_crd.Volume)
+        self.api = self.k8s.crd_api
+
+    def test_get_cro_cached(self):
+        cl_crd.Volume.informer.store(cro('vol1', 1))
+        self.assertEqual('vol1',
+                         cl_crd.Volume._get_cro('vol1')['metadata']['name'])
+        self.api.get_namespaced_custom_object.assert_not_called()
+
+    def test_get_cro_miss_asks_kubernetes(self):
+        self.api.get_namespaced_custom_object.return_value = cro('vol1', 1)
+
+        self.assertEqual('vol1',
+                         cl_crd.Volume._get_cro('vol1')['metadata']['name'])
+        self.api.get_namespaced_custom_object.assert_called_once_with(
+            cl_crd.Volume.DOMAIN, cl_crd.Volume.CRD_VERSION,
+            cl_crd.Volume.NAMESPACE, 'volumes', 'vol1')
+        # And it's now in the cache
+        self.assertIsNotNone(cl_crd.Volume.informer.get('vol1'))
+
+    def test_get_cro_miss_not_found(self):
+        self.api.get_namespaced_custom_object.side_effect = (
+            k8s.client.rest.ApiException(status=404))
+        self.assertIsNone(cl_crd.Volume._get_cro('vol1'))
+
+    def test_list_cros_miss_asks_kubernetes(self):
+        self.api.list_namespaced_custom_object.return_value = {
+            'items': [cro('vol1', 1, backend_name='a')]}
+
+        res = cl_crd.Volume._list_cros({'backend_name': 'a'})
+
+        self.assertEqual(['vol1'], [c['metadata']['name'] for c in res])
+        self.assertEqual(1, len(cl_crd.Volume.informer.find(
+            {'backend_name': 'a'})))
+
+    def test_delete_removes_from_cache(self):
+        cl_crd.Volume.informer.store(cro('vol1', 1))
+        cl_crd.Volume.delete('vol1')
+        self.assertIsNone(cl_crd.Volume.informer.get('vol1'))
+
+    def test_delete_failure_keeps_cache(self):
+        cl_crd.Volume.informer.store(cro('vol1', 1))
+        self.api.delete_namespaced_custom_object.side_effect = (
+            k8s.client.rest.ApiException(status=500))
+
+        self.assertRaises(k8s.client.rest.ApiException,
+                          cl_crd.Volume.delete, 'vol1')
+        self.assertIsNotNone(cl_crd.Volume.informer.get('vol1'))
+
+    def test_stop_informers(self):
+        informer = cl_crd.Volume.informer
+        informer.running = True
+        informer.watcher = mock.Mock()
+
+        cl_crd.CRD.stop_informers()
+
+        self.assertIsNone(cl_crd.Volume.informer)
+        self.assertFalse(informer.running)
+        informer.watcher.stop.assert_called_once_with()
+
+
+class TestEnsureLabels(CRDTestCase):
+    def setUp(self):
+        super(TestEnsureLabels, self).setUp()
+        self.api = self.k8s.crd_api
+        # Loading cinderlib objects requires the backend to be loaded
+        patcher = mock.patch.object(cl_crd.cinderlib, 'load',
+                                    side_effect=AssertionError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _list(self, old_cros):
+        def list_cros(group, version, namespace, plural, label_selector):
+            return {'items': old_cros.get((plural, label_selector), [])}
+        self.api.list_namespaced_custom_object.side_effect = list_cros
+
+    def test_adds_missing_labels(self):
+        vol_id = str(uuid.uuid4())
+        snap_id = str(uuid.uuid4())
+        vol_name = 'pvc-' + 'a' * 70
+        vol_json = resource_json('Volume', 'lvm', id=vol_id,
+                                 display_name=vol_name, size=1)
+        snap_json = resource_json('Snapshot', 'lvm', id=snap_id,
+                                  display_name='snap', volume_id=vol_id)
+        old_vol = {'metadata': {'name': vol_id,
+                                'labels': {'volume_name': vol_name[:63]},
+                                'annotations': {'json': vol_json}}}
+        old_snap = {'metadata': {'name': snap_id, 'labels': {},
+                                 'annotations': {'json': snap_json}}}
+        self._list({
+            ('volumes', 'volume_name,!volume_name_hash'): [old_vol],
+            ('snapshots', '!backend_name'): [old_snap],
+        })
+
+        cl_crd.CRD.ensure_labels()
+
+        patches = {call[0][3]: (call[0][4], call[0][5]) for call in
+                   self.api.patch_namespaced_custom_object.call_args_list}
+        self.assertEqual({'volumes', 'snapshots'}, set(patches))
+
+        name, patch = patches['volumes']
+        self.assertEqual(vol_id, name)
+        labels = patch['metadata']['labels']
+        self.assertEqual('lvm', labels['backend_name'])
+        self.assertEqual(vol_id, labels['volume_id'])
+        self.assertEqual(cl_crd.CRD._hash(vol_name),
+                         labels['volume_name_hash'])
+        self.assertEqual(vol_name[:63], labels['volume_name'])
+        self.assertEqual(vol_name[63:], labels['volume_name2'])
+
+        name, patch = patches['snapshots']
+        self.assertEqual(snap_id, name)
+        self.assertEqual({'backend_name': 'lvm',
+                          'snapshot_id': snap_id,
+                          'snapshot_name': 'snap',
+                          'snapshot_name_hash': cl_crd.CRD._hash('snap'),
+                          'volume_id': vol_id},
+                         patch['metadata']['labels'])
+
+    def test_nothing_to_migrate(self):
+        self._list({})
+        cl_crd.CRD.ensure_labels()
+        self.api.patch_namespaced_custom_object.assert_not_called()
+
+
+class TestBatch(CRDTestCase):
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        # The plugin's initialization needs Kubernetes
+        self.persistence = cl_crd.CRDPersistence.__new__(
+            cl_crd.CRDPersistence)
+        for crd in (cl_crd.Volume, cl_crd.Connection):
+            for method in ('get', 'set', 'delete'):
+                patcher = mock.patch.object(crd, method)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.persistence, 'get_changed_fields',
+                                    return_value={'status': 'available'})
+        self.changed_fields = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _volume(vol_id='vol1'):
+        return mock.Mock(id=vol_id, backend='lvm', _changed_fields=set(),
+                         volume_type=None)
+
+    def test_no_batch_writes_immediately(self):
+        vol = self._volume()
+        self.persistence.set_volume(vol)
+        cl_crd.Volume.set.assert_called_once_with(vol, False, True)
+
+    def test_coalesces_writes_of_same_instance(self):
+        vol = self._volume()
+        with self.persistence.batch():
+            self.changed_fields.return_value = {'id': 'vol1'}
+            self.persistence.set_volume(vol)
+            self.changed_fields.return_value = {}
+            self.persistence.set_volume(vol)
+            cl_crd.Volume.set.assert_not_called()
+
+        cl_crd.Volume.set.assert_called_once_with(vol, True, True)
+
+    def test_writes_other_instance_first(self):
+        vol = self._volume()
+        other = self._volume()
+        with self.persistence.batch():
+            self.persistence.set_volume(vol)
+            self.persistence.set_volume(other)
+            cl_crd.Volume.set.assert_called_once_with(vol, False, True)
+
+        self.assertEqual([mock.call(vol, False, True),
+                          mock.call(other, False, True)],
+                         cl_crd.Volume.set.call_args_list)
+
+    def test_created_and_deleted_not_written(self):
+        conn = mock.Mock(id='conn1', volume_id='vol1', _changed_fields=set())
+        with self.persistence.batch():
+            self.changed_fields.return_value = {'id': 'conn1'}
+            self.persistence.set_connection(conn)
+            self.persistence.delete_connection(conn)
+
+        cl_crd.Connection.set.assert_not_called()
+        cl_crd.Connection.delete.assert_not_called()
+
+    def test_reads_see_pending_writes(self):
+        vol = self._volume()
+        deleted = self._volume('vol2')
+        stored = self._volume()
+        cl_crd.Volume.get.return_value = [stored, deleted]
+        with self.persistence.batch():
+            self.persistence.set_volume(vol)
+            self.persistence.delete_volume(deleted)
+
+            self.assertEqual([vol], self.persistence.get_volumes(
+                backend_name='lvm'))
+            self.assertEqual([vol],
+                             self.persistence.get_volumes(volume_id='vol1'))
+            self.assertEqual([],
+                             self.persistence.get_volumes(volume_id='vol2'))
+            self.assertEqual([], self.persistence.get_volumes(
+                backend_name='other'))
+
+        # Resources in the batch are not requested by id
+        cl_crd.Volume.get.assert_has_calls(
+            [mock.call(volume_id=None, volume_name=None, backend_name='lvm'),
+             mock.call(volume_id=None, volume_name=None,
+                       backend_name='other')])
+        self.assertEqual(2, cl_crd.Volume.get.call_count)
+
+    def test_flush_errors_raised_after_writing_all(self):
+        vols = [self._volume('vol%s' % i) for i in range(3)]
+        cl_crd.Volume.set.side_effect = [ValueError, None, ValueError]
+
+        with mock.patch.object(cl_crd, 'LOG') as log:
+            with self.assertRaises(ValueError):
+                with self.persistence.batch():
+                    for vol in vols:
+                        self.persistence.set_volume(vol)
+
+        self.assertEqual(3, cl_crd.Volume.set.call_count)
+        self.assertEqual(2, log.exception.call_count)
+
+    def test_flush_errors_dont_hide_block_error(self):
+        cl_crd.Volume.set.side_effect = ValueError
+
+        with mock.patch.object(cl_crd, 'LOG') as log:
+            with self.assertRaises(KeyError):
+                with self.persistence.batch():
+                    self.persistence.set_volume(self._volume())
+                    raise KeyError()
+
+        log.exception.assert_called_once_with('Error writing %s %s',
+                                              'volumes', 'vol1')
+
+
+class TestK8sConnection(unittest.TestCase):
+    def test_configure(self):
+        connection = cl_crd.K8sConnection()
+        connection.configure(pool_size=10, request_timeout=5, retries=3,
+                             host='http://127.0.0.1:8001')
+
+        self.assertEqual(5, connection.api.request_timeout)
+        pool_manager = connection.api.rest_client.pool_manager
+        pool = pool_manager.connection_from_url('http://127.0.0.1:8001')
+        self.assertEqual(10, pool.pool.maxsize)
+        self.assertEqual(3, pool.retries.total)
+        self.assertFalse(pool.retries.raise_on_status)
+
+
+class TestLease(CRDTestCase):
+    def setUp(self):
+        super(TestLease, self).setUp()
+        cl_crd.KeyValue.informer = cl_crd.Informer(cl_crd.KeyValue)
+        self.api = self.k8s.crd_api
+        self.name = cl_crd.Lease._name('vol1')
+
+    def _lease(self, holder, version, expires=None):
+        value = json.dumps({'holder': holder,
+                            'expires': expires or time.time() + 60})
+        return {'metadata': {'name': self.name,
+                             'resourceVersion': str(version),
+                             'annotations': {'value': value}}}
+
+    def test_acquire_reads_from_kubernetes(self):
+        # The informer hasn't seen that the lease expired and was taken
+        cl_crd.KeyValue.informer.store(self._lease('me', 1))
+        self.api.get_namespaced_custom_object.return_value = self._lease(
+            'other', 2)
+
+        self.assertEqual('other', cl_crd.Lease.acquire('vol1', 'me', 60))
+        self.api.patch_namespaced_custom_object.assert_not_called()
+
+    def test_acquire_expired(self):
+        self.api.get_namespaced_custom_object.return_value = self._lease(
+            'other', 2, expires=time.time() - 1)
+        self.api.patch_namespaced_custom_object.return_value = self._lease(
+            'me', 3)
+
+        self.assertEqual('me', cl_crd.Lease.acquire('vol1', 'me', 60))
+        patch = self.api.patch_namespaced_custom_object.call_args[0][5]
+        self.assertEqual('2', patch['metadata']['resourceVersion'])
+        self.assertEqual('3', cl_crd.KeyValue.informer.get(
+            self.name)['metadata']['resourceVersion'])
+
+    def test_release_deletes(self):
+        cl_crd.KeyValue.informer.store(self._lease('me', 1))
+        self.api.get_namespaced_custom_object.return_value = self._lease(
+            'me', 2)
+
+        cl_crd.Lease.release('vol1', 'me')
+
+        self.api.delete_namespaced_custom_object.assert_called_once_with(
+            cl_crd.KeyValue.DOMAIN, cl_crd.KeyValue.CRD_VERSION,
+            cl_crd.KeyValue.NAMESPACE, 'keyvalues', name=self.name,
+            body={'preconditions': {'resourceVersion': '2'}})
+        self.assertIsNone(cl_crd.KeyValue.informer.get(self.name))
+
+    def test_release_retries_on_conflict(self):
+        self.api.get_namespaced_custom_object.side_effect = [
+            self._lease('me', 2), self._lease('me', 3)]
+        self.api.delete_namespaced_custom_object.side_effect = [
+            k8s.client.rest.ApiException(status=409), None]
+
+        cl_crd.Lease.release('vol1', 'me')
+
+        delete = self.api.delete_namespaced_custom_object
+        self.assertEqual(2, delete.call_count)
+        self.assertEqual({'preconditions': {'resourceVersion': '3'}},
+                         delete.call_args[1]['body'])
+
+    def test_release_other_holder(self):
+        self.api.get_namespaced_custom_object.return_value = self._lease(
+            'other', 2)
+        cl_crd.Lease.release('vol1', 'me')
+        self.api.delete_namespaced_custom_object.assert_not_called()
+
+
+class TestFakeApi(unittest.TestCase):
+    def setUp(self):
+        for method in ('ensure_crds_exist', 'ensure_labels',
+                       'start_informers', 'stop_informers'):
+            patcher = mock.patch.object(cl_crd.CRD, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(cl_crd, 'K8S')
+        self.k8s = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('ember_csi.fake_k8s.FakeApiServer')
+    def test_fake_api(self, server_mock):
+        server = server_mock.return_value.start.return_value
+        persistence = cl_crd.CRDPersistence(fake_api={'latency': 1})
+
+        server_mock.assert_called_once_with(latency=1)
+        self.k8s.configure.assert_called_once_with(None, None, None,
+                                                   server.url)
+
+        persistence.stop()
+        server.shutdown.assert_called_once_with()
+        server.server_close.assert_called_once_with()
+        self.assertIsNone(persistence.fake_api)
@@ -0,0 +1,273 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the common helpers."""
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import common
+from ember_csi import metrics
+
+
+class TestKeyedLock(unittest.TestCase):
+    def setUp(self):
+        self.lock = common.KeyedLock()
+        self.acquired = []
+
+    def _wait_for_waiters(self, key, num_waiters):
+        for i in range(100):
+            holders = self.lock.holders()
+            if key in holders and holders[key][2] == num_waiters:
+                return
+            time.sleep(0.01)
+        self.fail('Expected %s waiters for %s' % (num_waiters, key))
+
+    def _acquire(self, key, name):
+        def acquire():
+            self.assertTrue(self.lock.acquire(key))
+            self.acquired.append(name)
+            self.lock.release(key)
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        return thread
+
+    def test_independent_keys(self):
+        self.assertTrue(self.lock.acquire('a'))
+        self.assertTrue(self.lock.acquire('b', timeout=0))
+        self.assertEqual({'a', 'b'}, set(self.lock.holders()))
+
+        self.lock.release('a')
+        self.lock.release('b')
+        self.assertEqual({}, self.lock.holders())
+
+    def test_fair_handoff(self):
+        self.assertTrue(self.lock.acquire('key'))
+        threads = []
+        for i, name in enumerate(('first', 'second', 'third')):
+            threads.append(self._acquire('key', name))
+            self._wait_for_waiters('key', i + 1)
+
+        self.lock.release('key')
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['first', 'second', 'third'], self.acquired)
+        self.assertEqual({}, self.lock.holders())
+
+    def test_timeout(self):
+        self.assertTrue(self.lock.acquire('key'))
+        thread = self._acquire('key', 'waiter')
+        self._wait_for_waiters('key', 1)
+
+        self.assertFalse(self.lock.acquire('key', timeout=0.01))
+        # The waiter that timed out is no longer in the queue
+        self.assertEqual(1, self.lock.holders()['key'][2])
+
+        self.lock.release('key')
+        thread.join()
+        self.assertEqual(['waiter'], self.acquired)
+        self.assertEqual({}, self.lock.holders())
+
+
+class TestLockMetrics(unittest.TestCase):
+    def test_gauges(self):
+        locks = common.KeyedLock()
+        with mock.patch.object(common.Worker, 'locks', locks):
+            locks.acquire(('NodeStageVolume', 'vol1'))
+            locks.acquire(('NodeStageVolume', 'vol2'))
+            locks.acquire(('NodePublishVolume', 'vol1'))
+            thread = threading.Thread(
+                target=locks.acquire,
+                args=(('NodeStageVolume', 'vol1'), 0.5))
+            thread.start()
+            for i in range(100):
+                if locks.holders()[('NodeStageVolume', 'vol1')][2]:
+                    break
+                time.sleep(0.01)
+
+            held = metrics.WORKER_LOCKS.collect()
+            waiting = metrics.WORKER_LOCK_WAITERS.collect()
+            locks.release(('NodeStageVolume', 'vol1'))
+            thread.join()
+
+        self.assertIn('ember_csi_worker_locks{method="NodePublishVolume"} '
+                      '1.0', held)
+        self.assertIn('ember_csi_worker_locks{method="NodeStageVolume"} 2.0',
+                      held)
+        self.assertIn('ember_csi_worker_lock_waiters'
+                      '{method="NodeStageVolume"} 1.0', waiting)
+        self.assertIn('ember_csi_worker_lock_waiters'
+                      '{method="NodePublishVolume"} 0.0', waiting)
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.context = mock.Mock(admitted=False)
+        self.context.abort.side_effect = Exception
+
+    def test_get_created_once_from_config(self):
+        with mock.patch.object(common.Admission, '_instance', None), \
+                mock.patch.multiple(common.CONF, WORKERS=3,
+                                    CONCURRENCY_LIMITS={'node': 1},
+                                    ADMISSION_TIMEOUT=0, ADMISSION_QUEUE=2):
+            admission = common.Admission.get()
+            self.assertIs(admission, common.Admission.get())
+        self.assertIsNone(admission.timeout)
+        self.assertTrue(admission.queue.acquire(False))
+        self.assertIn('node', admission.limits)
+
+    def _assert_rejected(self, admission, method):
+        with self.assertRaises(Exception):
+            with admission.admit(method, self.context):
+                pass
+        self.context.abort.assert_called_once_with(
+            common.grpc.StatusCode.RESOURCE_EXHAUSTED, mock.ANY)
+
+    def test_rejects_when_workers_busy(self):
+        admission = common.Admission(1)
+        with admission.admit('CreateVolume', self.context):
+            self._assert_rejected(admission, 'DeleteVolume')
+            # Cheap calls are always admitted
+            with admission.admit('Probe', self.context):
+                pass
+
+    def test_queued_until_worker_is_free(self):
+        admission = common.Admission(1, queue=1)
+        admitted = []
+
+        def call():
+            with admission.admit('DeleteVolume', self.context):
+                admitted.append(True)
+
+        with admission.admit('CreateVolume', self.context):
+            thread = threading.Thread(target=call)
+            thread.start()
+            for i in range(100):
+                if not admission.queue.acquire(False):
+                    break
+                admission.queue.release()
+                time.sleep(0.01)
+            # The queue is full
+            self._assert_rejected(admission, 'CreateSnapshot')
+            self.assertEqual([], admitted)
+        thread.join()
+        self.assertEqual([True], admitted)
+
+    def test_queued_until_timeout(self):
+        admission = common.Admission(1, timeout=0.01, queue=1)
+        with admission.admit('CreateVolume', self.context):
+            self._assert_rejected(admission, 'DeleteVolume')
+        # The call left the queue
+        self.assertTrue(admission.queue.acquire(False))
+
+    def test_get_capacity_limited(self):
+        admission = common.Admission(5, {'capacity': 1}, timeout=0.01)
+        with admission.admit('GetCapacity', self.context):
+            self._assert_rejected(admission, 'GetCapacity')
+
+    def test_limit_waits_for_timeout(self):
+        admission = common.Admission(5, {'provisioning': 1}, timeout=0.01)
+        with admission.admit('CreateVolume', self.context):
+            start = time.time()
+            self._assert_rejected(admission, 'DeleteVolume')
+            self.assertGreaterEqual(time.time() - start, 0.01)
+            # Other classes have their own limits
+            with admission.admit('NodeStageVolume', self.context):
+                pass
+
+
+class TestSyncContext(unittest.TestCase):
+    def test_abort(self):
+        context = common.SyncContext((('traceparent', 'value'),))
+        context.set_trailing_metadata([('key', 'value')])
+
+        self.assertRaises(common.AbortRpc, context.abort,
+                          common.grpc.StatusCode.NOT_FOUND, 'Missing')
+        self.assertEqual(common.grpc.StatusCode.NOT_FOUND,
+                         context._state.code)
+        self.assertEqual('Missing', context._state.details)
+        self.assertEqual((('key', 'value'),),
+                         context._state.trailing_metadata)
+        self.assertEqual((('traceparent', 'value'),),
+                         context.invocation_metadata())
+
+
+class TestBackendStats(unittest.TestCase):
+    def setUp(self):
+        self.backend = mock.Mock()
+        self._set_stats({'free': 1}, {'free': 2})
+        self.cache = common.BackendStats(self.backend, 30)
+        # Background refreshes wait for the call that started them
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _set_stats(self, *results):
+        results = list(results)
+
+        def stats(refresh):
+            self.gate.wait(1)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        self.backend.stats.side_effect = stats
+
+    def _get_expired(self, expire=True):
+        if expire:
+            self.cache.updated = 0
+        self.gate.clear()
+        result = self.cache.get()
+        self.gate.set()
+        for i in range(100):
+            if not self.cache.refreshing:
+                break
+            time.sleep(0.01)
+        return result
+
+    def test_cached(self):
+        self.assertEqual({'free': 1}, self.cache.get())
+        self.assertEqual({'free': 1}, self.cache.get())
+        self.backend.stats.assert_called_once_with(refresh=True)
+
+    def test_refreshed_in_background(self):
+        self.cache.get()
+        # We get the old stats while they are refreshed
+        self.assertEqual({'free': 1}, self._get_expired())
+        self.assertEqual({'free': 2}, self.cache.get())
+
+    def test_no_ttl(self):
+        cache = common.BackendStats(self.backend, 0)
+        self.assertEqual({'free': 1}, cache.get())
+        self.assertEqual({'free': 2}, cache.get())
+
+    def test_refresh_error_returns_old_stats(self):
+        self._set_stats({'free': 1}, ValueError(), {'free': 2})
+        self.cache.get()
+        self.assertEqual({'free': 1}, self._get_expired())
+        # The failure is not cached, we try again on the next call
+        self.assertEqual({'free': 1}, self._get_expired(expire=False))
+        self.assertEqual({'free': 2}, self.cache.get())
+        self.assertEqual(3, self.backend.stats.call_count)
+
+    def test_error_without_stats(self):
+        self._set_stats(ValueError(), {'free': 1})
+        self.assertRaises(ValueError, self.cache.get)
+        self.assertEqual({'free': 1}, self.cache.get())
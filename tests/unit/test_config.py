@@ -0,0 +1,80 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the validation of the configuration."""
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import config
+from ember_csi import constants
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        conf = config.CONF
+        patcher = mock.patch.multiple(
+            conf, MODE='node', WORKERS=30, RESERVED_WORKERS=4,
+            CONCURRENCY_LIMITS={}, ADMISSION_TIMEOUT=0, ADMISSION_QUEUE=100,
+            WAIT_TIMEOUT=60, STATS_TTL=30, LOCK_TIMEOUT=0, LEASE_DURATION=0,
+            NODE_INFO_TTL=60, METRICS_PORT=0, TRACING_EXPORTER=None,
+            CSI_SPEC='9.9', DEFAULT_MOUNT_FS='ext4',
+            SUPPORTED_FS_TYPES=['ext4'], _untar_file=mock.DEFAULT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assert_exit(self, code, **options):
+        with mock.patch.multiple(config.CONF, **options):
+            with self.assertRaises(SystemExit) as asserted:
+                config.CONF.validate()
+        self.assertEqual(code, asserted.exception.code)
+
+    def test_valid_numbers(self):
+        # Numbers are valid, so we fail later on the CSI spec
+        self._assert_exit(constants.ERROR_CSI_SPEC, WAIT_TIMEOUT=0.5,
+                          LEASE_DURATION=15, METRICS_PORT=9090)
+
+    def test_invalid_numbers(self):
+        for option in ('WAIT_TIMEOUT', 'STATS_TTL', 'LOCK_TIMEOUT',
+                       'LEASE_DURATION', 'ADMISSION_TIMEOUT',
+                       'NODE_INFO_TTL'):
+            for value in (-1, '10', None, True):
+                self._assert_exit(constants.ERROR_NUMBER, **{option: value})
+
+    def test_invalid_metrics_port(self):
+        for value in (-1, 65536, 9090.0, '9090', True):
+            self._assert_exit(constants.ERROR_NUMBER, METRICS_PORT=value)
+
+    def test_invalid_workers(self):
+        self._assert_exit(constants.ERROR_WORKERS, WORKERS=0)
+
+    def test_invalid_admission_queue(self):
+        for value in (-1, 1.5, None):
+            self._assert_exit(constants.ERROR_CONCURRENCY,
+                              ADMISSION_QUEUE=value)
+
+
+class TestPoolSize(unittest.TestCase):
+    def test_pool_size(self):
+        with mock.patch.multiple(config.CONF, WORKERS=10, RESERVED_WORKERS=4,
+                                 LEASE_DURATION=0):
+            self.assertEqual(24, config.CONF._get_pool_size())
+
+    def test_pool_size_leases(self):
+        with mock.patch.multiple(config.CONF, WORKERS=10, RESERVED_WORKERS=4,
+                                 LEASE_DURATION=15):
+            self.assertEqual(34, config.CONF._get_pool_size())
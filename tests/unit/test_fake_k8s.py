@@ -0,0 +1,191 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the fake Kubernetes API server."""
+import unittest
+
+from ember_csi import fake_k8s
+
+
+COLLECTION = '/apis/ember-csi.io/v1/namespaces/default/volumes'
+
+
+def obj(name, spec=None, **labels):
+    return {'metadata': {'name': name, 'labels': labels}, 'spec': spec}
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_path(self):
+        self.assertEqual((COLLECTION, 'default', 'vol1'),
+                         fake_k8s.parse_path(COLLECTION + '/vol1'))
+        self.assertEqual(('/apis/ember-csi.io/v1/volumes', None, None),
+                         fake_k8s.parse_path('/apis/ember-csi.io/v1/volumes'))
+        self.assertRaises(fake_k8s.ApiError, fake_k8s.parse_path, '/api/v1')
+
+    def test_parse_selector(self):
+        self.assertEqual(
+            [('a', 'in', {'1'}), ('b', 'notin', {'2'}),
+             ('c', 'in', {'3', '4'}), ('d', 'exists', None),
+             ('e', 'notexists', None)],
+            fake_k8s.parse_selector('a==1, b!=2,c in (3, 4),d,!e'))
+        self.assertRaises(fake_k8s.ApiError, fake_k8s.parse_selector, '=1')
+
+    def test_merge_patch(self):
+        target = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1, 2]}
+        result = fake_k8s.merge_patch(
+            target, {'a': None, 'b': {'c': 4, 'd': None}, 'e': [3], 'f': 5})
+
+        self.assertEqual({'b': {'c': 4}, 'e': [3], 'f': 5}, result)
+        # The target is not changed
+        self.assertEqual({'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1, 2]},
+                         target)
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.store = fake_k8s.Store()
+
+    def _create(self, *objs):
+        return [self.store.create(COLLECTION, 'default', o) for o in objs]
+
+    @staticmethod
+    def _names(result):
+        return [o['metadata']['name'] for o in result['items']]
+
+    def test_list_selector(self):
+        self._create(obj('vol1', backend='a', node='n1'),
+                     obj('vol2', backend='b', node='n1'),
+                     obj('vol3', backend='a'))
+
+        self.assertEqual(['vol1', 'vol3'], self._names(
+            self.store.list(COLLECTION, 'backend=a')))
+        self.assertEqual(['vol1'], self._names(
+            self.store.list(COLLECTION, 'backend=a,node')))
+        self.assertEqual(['vol2'], self._names(
+            self.store.list(COLLECTION, 'node notin (n2), backend!=a')))
+        self.assertEqual(['vol3'], self._names(
+            self.store.list(COLLECTION, '!node')))
+        self.assertEqual([], self._names(
+            self.store.list(COLLECTION, 'backend in (c)')))
+
+    def test_list_continue(self):
+        self._create(*[obj('vol%s' % i, backend='ab'[i % 2])
+                       for i in range(5)])
+
+        result = self.store.list(COLLECTION, 'backend=a', limit=2)
+        self.assertEqual(['vol0', 'vol2'], self._names(result))
+        token = result['metadata']['continue']
+
+        # Objects created after the first page are listed if they are after
+        # the token
+        self._create(obj('vol5', backend='a'))
+        result = self.store.list(COLLECTION, 'backend=a', limit=2,
+                                 token=token)
+        self.assertEqual(['vol4', 'vol5'], self._names(result))
+        self.assertNotIn('continue', result['metadata'])
+
+        self.assertRaises(fake_k8s.ApiError, self.store.list, COLLECTION,
+                          token='invalid')
+
+    def test_versions(self):
+        vol1, vol2 = self._create(obj('vol1'), obj('vol2'))
+        self.assertEqual('1', vol1['metadata']['resourceVersion'])
+        self.assertEqual('2', vol2['metadata']['resourceVersion'])
+        self.assertEqual('2', self.store.list(COLLECTION)['metadata']
+                         ['resourceVersion'])
+
+    def test_patch(self):
+        vol, = self._create(obj('vol1', {'a': 1, 'b': 2}, backend='a'))
+        patched = self.store.patch(
+            COLLECTION, 'vol1', {'spec': {'a': None, 'c': 3},
+                                 'metadata': {'labels': {'node': 'n1'},
+                                              'uid': 'ignored'}})
+
+        self.assertEqual({'b': 2, 'c': 3}, patched['spec'])
+        self.assertEqual({'backend': 'a', 'node': 'n1'},
+                         patched['metadata']['labels'])
+        self.assertEqual(vol['metadata']['uid'], patched['metadata']['uid'])
+        self.assertEqual('2', patched['metadata']['resourceVersion'])
+        self.assertEqual(patched, self.store.get(COLLECTION, 'vol1'))
+
+    def test_stale_version_conflicts(self):
+        vol, = self._create(obj('vol1', {'a': 1}))
+        self.store.patch(COLLECTION, 'vol1', {'spec': {'a': 2}})
+
+        for method, args in (
+                (self.store.patch, ({'spec': {'a': 3},
+                                     'metadata': vol['metadata']},)),
+                (self.store.replace, (vol,)),
+                (self.store.delete, (vol['metadata'],))):
+            with self.assertRaises(fake_k8s.ApiError) as cm:
+                method(COLLECTION, 'vol1', *args)
+            self.assertEqual(409, cm.exception.code)
+        self.assertEqual({'a': 2}, self.store.get(COLLECTION, 'vol1')['spec'])
+
+    def test_create_exists_and_not_found(self):
+        self._create(obj('vol1'))
+        with self.assertRaises(fake_k8s.ApiError) as cm:
+            self._create(obj('vol1'))
+        self.assertEqual(409, cm.exception.code)
+
+        for method, args in ((self.store.get, ()),
+                             (self.store.patch, ({},)),
+                             (self.store.delete, ())):
+            with self.assertRaises(fake_k8s.ApiError) as cm:
+                method(COLLECTION, 'vol2', *args)
+            self.assertEqual(404, cm.exception.code)
+
+    def test_conflict_rate(self):
+        store = fake_k8s.Store(conflict_rate=1)
+        store.create(COLLECTION, 'default', obj('vol1'))
+        self.assertRaises(fake_k8s.ApiError, store.patch, COLLECTION,
+                          'vol1', {'spec': {'a': 1}})
+
+    def test_watch(self):
+        vol1, = self._create(obj('vol1', backend='a'))
+        events = self.store.watch(COLLECTION, 'backend=a', timeout=0.01)
+        self._create(obj('vol2', backend='b'), obj('vol3', backend='a'))
+        self.store.delete(COLLECTION, 'vol1')
+
+        self.assertEqual([('ADDED', 'vol1'), ('ADDED', 'vol3'),
+                          ('DELETED', 'vol1')],
+                         [(event_type, o['metadata']['name'])
+                          for event_type, o in events])
+
+        # From a resourceVersion we only get the later changes
+        events = self.store.watch(COLLECTION,
+                                  version=vol1['metadata']['resourceVersion'],
+                                  timeout=0.01)
+        self.assertEqual(['vol2', 'vol3', 'vol1'],
+                         [o['metadata']['name'] for event_type, o in events])
+
+    def test_watch_expired(self):
+        store = fake_k8s.Store(history=10)
+        for i in range(12):
+            store.create(COLLECTION, 'default', obj('vol%s' % i))
+
+        with self.assertRaises(fake_k8s.ApiError) as cm:
+            store.watch(COLLECTION, version='1')
+        self.assertEqual(410, cm.exception.code)
+
+    def test_watch_falls_behind(self):
+        store = fake_k8s.Store(history=10)
+        events = store.watch(COLLECTION, version='0', timeout=0.01)
+        # The history is trimmed before the watch reads it
+        for i in range(12):
+            store.create(COLLECTION, 'default', obj('vol%s' % i))
+
+        event_type, status = list(events)[-1]
+        self.assertEqual('ERROR', event_type)
+        self.assertEqual(410, status['code'])
@@ -0,0 +1,86 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the argument handling of the privileged operations."""
+import unittest
+
+from ember_csi import privileged
+
+
+class TestParseOptions(unittest.TestCase):
+    def test_no_options(self):
+        self.assertEqual((0, None), privileged._parse_options(None))
+        self.assertEqual((0, None), privileged._parse_options([]))
+
+    def test_flags(self):
+        flags, data = privileged._parse_options(['ro', 'nosuid', 'noatime',
+                                                 'rw', 'defaults'])
+        self.assertEqual(privileged.MS_RDONLY | privileged.MS_NOSUID |
+                         privileged.MS_NOATIME, flags)
+        self.assertIsNone(data)
+
+    def test_filesystem_data(self):
+        flags, data = privileged._parse_options(['nouuid', 'ro',
+                                                 'context=system_u:foo'])
+        self.assertEqual(privileged.MS_RDONLY, flags)
+        self.assertEqual('nouuid,context=system_u:foo', data)
+
+    def test_userspace_options_ignored(self):
+        options = ['_netdev', 'nofail', 'noauto', 'loop', 'users',
+                   'x-systemd.automount', 'X-mount.mkdir',
+                   'comment=ember', 'discard']
+        self.assertEqual((0, 'discard'), privileged._parse_options(options))
+
+    def test_negated_flags(self):
+        self.assertEqual((0, None),
+                         privileged._parse_options(['norelatime',
+                                                    'nostrictatime',
+                                                    'nolazytime']))
+
+
+class TestCommands(unittest.TestCase):
+    def test_mkfs_command(self):
+        self.assertEqual(['/sbin/mkfs.ext4', '-F', '/dev/sdb'],
+                         privileged.mkfs_command('ext4', ('-F',), '/dev/sdb'))
+
+    def test_mkfs_command_invalid(self):
+        for args in (('../bin/sh', (), '/dev/sdb'),
+                     ('ext4 -x', (), '/dev/sdb'),
+                     (None, (), '/dev/sdb'),
+                     ('ext4', ('/etc/passwd',), '/dev/sdb'),
+                     ('ext4', (), 'sdb'),
+                     ('ext4', (), '')):
+            self.assertRaises(ValueError, privileged.mkfs_command, *args)
+
+    def test_resize_command(self):
+        self.assertEqual(['resize2fs', '-f', '-F', '/dev/sdb'],
+                         privileged.resize_command('ext3', '/dev/sdb',
+                                                   '/mnt/stage'))
+        self.assertEqual(['btrfs', 'filesystem', 'resize', 'max',
+                          '/mnt/stage'],
+                         privileged.resize_command('btrfs', '/dev/sdb',
+                                                   '/mnt/stage'))
+        self.assertEqual(['xfs_growfs', '-d', '/mnt/stage'],
+                         privileged.resize_command('xfs', '/dev/sdb',
+                                                   '/mnt/stage'))
+
+    def test_resize_command_unsupported(self):
+        self.assertIsNone(privileged.resize_command('vfat', '/dev/sdb',
+                                                    '/mnt/stage'))
+
+    def test_resize_command_invalid_path(self):
+        self.assertRaises(ValueError, privileged.resize_command, 'ext4',
+                          'sdb', '/mnt/stage')
+        self.assertRaises(ValueError, privileged.resize_command, 'xfs',
+                          '/dev/sdb', 'stage')
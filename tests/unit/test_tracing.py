@@ -0,0 +1,65 @@
+# Copyright (c) 2020, Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the distributed tracing."""
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ember_csi import tracing
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tracing, 'EXPORTER')
+        self.exporter = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _exported(self):
+        return {call[0][0].name: call[0][0]
+                for call in self.exporter.export.call_args_list}
+
+    def test_set_attribute(self):
+        tracing.set_attribute('ignored', 'no span')
+        with tracing.span('parent'):
+            with tracing.span('child'):
+                tracing.set_attribute('key', 'value')
+
+        spans = self._exported()
+        self.assertEqual({'key': 'value'}, spans['child'].attributes)
+        self.assertEqual({}, spans['parent'].attributes)
+
+    def test_in_current_span(self):
+        def child():
+            with tracing.span('child'):
+                pass
+
+        with tracing.span('parent') as parent:
+            thread = threading.Thread(target=tracing.in_current_span(child))
+            thread.start()
+            thread.join()
+
+        spans = self._exported()
+        self.assertEqual(parent.trace_id, spans['child'].trace_id)
+        self.assertEqual(parent.span_id, spans['child'].parent_id)
+        self.assertIsNone(tracing.current_span())
+
+    def test_in_current_span_no_span(self):
+        def child():
+            pass
+        self.assertIs(child, tracing.in_current_span(child))